@@ -15,10 +15,12 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
 
-from PyQt5.QtCore import Qt, QObject, QItemSelectionModel, QSortFilterProxyModel, pyqtSignal
+from PyQt5.QtCore import Qt, QObject, QTimer, QItemSelectionModel, QSortFilterProxyModel, pyqtSignal
 from garage_pm.models import TaskTreeModel, TaskEffortSpentModel
 from garage_pm.domain import PlanningState
+from datetime import datetime
 from enum import Enum
+from math import ceil
 
 def connect(signal, slot, connect_=True):
     if connect_:
@@ -107,8 +109,8 @@ class TaskDetailsController(QObject):
                 self._effort_spent_model.insertRow(self._effort_spent_model.rowCount())
                 
         def set_planned_start(value):
-            if self._task:
-                self._task.planned_start = value.toPyDateTime()
+            if self._task and self._view.planned_start_override_edit.isChecked():
+                self._task.planned_start_override = value.toPyDateTime()
                 
         self._view.name_edit.textChanged.connect(task_setter('name'))
         self._view.description_edit.textChanged.connect(set_task_description)
@@ -153,10 +155,10 @@ class TaskDetailsController(QObject):
         connect(self._task.pessimistic_effort_changed, self._view.pessimistic_effort_edit.set_duration, connect_)
         connect(self._task.predicted_effort_changed, self._view.predicted_effort_edit.set_duration, connect_)
         connect(self._task.actual_effort_changed, self._view.actual_effort_edit.set_duration, connect_)
-        connect(self._task.planned_start_changed, self._on_task_planned_start_changed, connect_)
-        connect(self._task.planned_end_changed, self._on_task_planned_end_changed, connect_)
-        connect(self._task.predicted_start_changed, self._on_task_predicted_start_changed, connect_)
-        connect(self._task.predicted_end_changed, self._on_task_predicted_end_changed, connect_)
+        connect(self._task.events.planned_start_changed, self._on_task_planned_start_changed, connect_)
+        connect(self._task.events.planned_end_changed, self._on_task_planned_end_changed, connect_)
+        connect(self._task.events.predicted_start_changed, self._on_task_predicted_start_changed, connect_)
+        connect(self._task.events.predicted_end_changed, self._on_task_predicted_end_changed, connect_)
         connect(self._task.state_changed, self._task_state_controller.set_value, connect_)
         
         if connect_:
@@ -174,12 +176,12 @@ class TaskDetailsController(QObject):
             self._view.pessimistic_effort_edit.duration = self._task.pessimistic_effort
             self._view.predicted_effort_edit.duration = self._task.predicted_effort
             self._view.actual_effort_edit.duration = self._task.actual_effort
-            self._on_task_planned_start_changed(self._task.planned_start)
-            self._on_task_planned_end_changed(self._task.planned_end)
-            self._on_task_predicted_start_changed(self._task.predicted_start)
-            self._on_task_predicted_end_changed(self._task.predicted_end)
+            self._on_task_planned_start_changed(self._task)
+            self._on_task_planned_end_changed(self._task)
+            self._on_task_predicted_start_changed(self._task)
+            self._on_task_predicted_end_changed(self._task)
             self._task_state_controller.value = self._task.state
-            self._view.planned_start_override_edit.setChecked(self._task.planned_start is not None)
+            self._view.planned_start_override_edit.setChecked(self._task.planned_start_override is not None)
         else:
             self._effort_spent_model = None
             self._view.effort_spent_table.setModel(None)
@@ -191,23 +193,23 @@ class TaskDetailsController(QObject):
         else:
             date_time_edit.setEnabled(False)
             
-    def _on_task_planned_start_changed(self, date_time):
-        self._on_start_end_changed(self._view.planned_start_edit, date_time)
+    def _on_task_planned_start_changed(self, task):
+        self._on_task_start_end_changed(self._view.planned_start_edit, task.planned_start)
         
-    def _on_task_planned_end_changed(self, date_time):
-        self._on_start_end_changed(self._view.planned_end_edit, date_time)
+    def _on_task_planned_end_changed(self, task):
+        self._on_task_start_end_changed(self._view.planned_end_edit, task.planned_end)
         
-    def _on_task_predicted_start_changed(self, date_time):
-        self._on_start_end_changed(self._view.predicted_start_edit, date_time)
+    def _on_task_predicted_start_changed(self, task):
+        self._on_task_start_end_changed(self._view.predicted_start_edit, task.predicted_start)
         
-    def _on_task_predicted_end_changed(self, date_time):
-        self._on_start_end_changed(self._view.predicted_end_edit, date_time)
+    def _on_task_predicted_end_changed(self, task):
+        self._on_task_start_end_changed(self._view.predicted_end_edit, task.predicted_end)
         
     def _on_view_planned_start_override_toggled(self, checked):
         if checked:
-            self._task.planned_start = self._view.planned_start_edit.dateTime().toPyDateTime()
+            self._task.planned_start_override = self._view.planned_start_edit.dateTime().toPyDateTime()
         else:
-            self._task.planned_start = None
+            self._task.planned_start_override = None
         
 class TaskTreeViewController(QObject):
     
@@ -243,3 +245,42 @@ class MainWindowController(QObject):
         else:
             task = None
         self._task_details_controller.task = task
+        
+class EventThreadDispatch(QObject):
+    
+    '''
+    Calls functions on the Qt event thread, from any thread
+    '''
+    
+    _called = pyqtSignal(object)
+    
+    def __init__(self):
+        super().__init__()
+        self._called.connect(self._call)
+        
+    def __call__(self, function):
+        self._called.emit(function)  # queued when emitted from another thread
+        
+    def _call(self, function):
+        function()
+        
+def start_minute_clock(minute_timer):
+    '''
+    Tick minute_timer during the first second of every minute, fitting our
+    granularity of just a minute
+    
+    Returns
+    -------
+    QTimer
+        The clock, keep a reference to it
+    '''
+    # Note: QTimer never emits early, but it can emit an ms late or much
+    # later (especially if the event loop gets clogged with computation
+    # (which doesn't belong on the event thread))
+    clock = QTimer()
+    clock.timeout.connect(lambda: clock.setInterval(60000))
+    clock.timeout.connect(minute_timer.tick)
+    now = datetime.now()
+    seconds_until_next_minute = 60 - (now.second + now.microsecond * 1e-6)
+    clock.start(ceil(seconds_until_next_minute * 1000) + 500)  # + half a second or we likely emit when python time still reports 59 seconds. Double checked the initial start delay is correct. There must be some lack of accuracy in python's datetime.now
+    return clock
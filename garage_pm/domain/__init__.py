@@ -17,8 +17,52 @@
 
 '''
 PM domain classes
+
+Each class is imported from its module when first used, so that importing the
+domain is cheap, e.g. for a command which does not open a project.
 '''
 
-from ._common import PlanningState, Interval, EstimateType, EmptyIntervalError
-from ._task import Task
-from ._time_tracker import TimeTracker
+import importlib
+
+_modules = {  # {name => module defining it}
+    'PlanningState': '_common',
+    'Interval': '_common',
+    'EstimateType': '_common',
+    'EmptyIntervalError': '_common',
+    'Task': '_task',
+    'TimeTracker': '_time_tracker',
+    'Recomputation': '_recomputation',
+    'Changes': '_changes',
+    'Change': '_changes',
+    'DirtyTasks': '_changes',
+    'EffortIndex': '_effort_index',
+    'EstimateCalibration': '_calibration',
+    'WorkingCalendar': '_calendar',
+    'Scheduler': '_scheduler',
+    'Slack': '_scheduler',
+    'ReadyTasks': '_ready_tasks',
+    'TaskTreeBuilder': '_builder',
+    'ColdStorage': '_cold_storage',
+    'Subtree': '_subtree',
+    'UndoStack': '_undo',
+    'Sandbox': '_sandbox',
+    'simulate': '_simulation',
+    'simulate_async': '_simulation',
+    'SimulationResult': '_simulation',
+    'ScheduleSnapshot': '_simulation',
+    'BackgroundSimulation': '_simulation',
+    'Signal': '_signal',
+}
+
+__all__ = sorted(_modules)
+
+def __getattr__(name):
+    # Only called for names not in the module yet
+    if name not in _modules:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module('.' + _modules[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,94 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+from chicken_turtle_util.exceptions import InvalidOperationError
+from ._common import PlanningState
+from ._task_state import TaskState
+
+class ArchivedTaskState(TaskState):
+    
+    '''
+    Finished branch task whose subtree is kept in storage until needed
+    
+    Only the task itself is in memory. Its effort spent and that of its
+    descendants are summarized in the effort index and estimate calibration.
+    In the schedules it takes no time, its work being done.
+    
+    When its children are first asked for, or a child is inserted, the task
+    becomes a regular branch task and its children are loaded. Finished
+    branches among them are archived tasks in turn.
+    
+    Parameters
+    ----------
+    common_data : TaskStateData
+    load : (TaskTreeBuilder, Task) -> None
+        Add the children of the task, and their subtrees, to the builder
+    '''
+    
+    def __init__(self, common_data, load):
+        super().__init__(common_data)
+        self._load = load
+        
+    def _get_planning_state(self):
+        return PlanningState.finished
+        
+    def _set_planning_state(self, value):
+        raise self.validate_set_planning_state(value)
+        
+    def validate_set_planning_state(self, state):
+        return InvalidOperationError("A branch task's state is derived from its child tasks, not set")
+    
+    @property
+    def is_leaf(self):
+        return False
+    
+    @property
+    def is_archived(self):
+        return True
+    
+    @property
+    def children(self):
+        self._expand()
+        return self._task.children
+    
+    @property
+    def _loaded_children(self):
+        return ()
+    
+    def _insert_child(self, index, child):
+        self._expand()
+        self._task._insert_child(index, child)
+        
+    def _validate_insert_child(self, index, child):
+        self._expand()
+        return self._task._validate_insert_child(index, child)
+        
+    def _expand(self):
+        '''
+        Load children, becoming a regular branch task
+        '''
+        task = self._task
+        context = self._context
+        with TaskTreeBuilder(context) as builder:
+            # Drop the summary, the loaded descendants take its place
+            context.effort_index._on_child_removed(task)
+            context.effort_index._forget(task)
+            context.estimate_calibration._forget(task)
+            task._become_branch_task()
+            self._load(builder, task)
+    
+from ._builder import TaskTreeBuilder
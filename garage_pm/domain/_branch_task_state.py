@@ -33,18 +33,20 @@ class BranchTaskState(TaskState):
         '''
         return self._planning_state
     
-    def _on_child_planning_state_changed(self, child):
-        self._update_planning_state()
-        self._dependency_graph[self.end_node][child.end_node]['active'] = child.is_active
-    
     def _update_planning_state(self):
+        '''
+        Recompute planning state from children, see `Recomputation`
+        '''
+        for child in self.children:
+            self._dependency_graph[self.end_node][child.end_node]['active'] = child.is_active
+        self._context.scheduler._invalidate(self._task)
         old_state = self._planning_state
         if any(child.planning_state == PlanningState.planned for child in self.children):
             self._planning_state = PlanningState.planned
         else:
             self._planning_state = PlanningState.finished
         if old_state != self._planning_state:
-            self.events.planning_state_changed.emit(self._task)
+            self._on_planning_state_changed()
         
     def _set_planning_state(self, value):
         raise self.validate_set_planning_state(value)
@@ -70,8 +72,10 @@ class BranchTaskState(TaskState):
             raise DependencyCycleError(cycles)
         self._children.insert(index, child)
         child._parent = self._task
-        child.events.planning_state_changed.connect(self._on_child_planning_state_changed)
-        self._on_child_planning_state_changed(child)
+        self._context.effort_index._on_child_inserted(child)
+        self._context.recomputation.mark_dirty('planning_state', self._task)
+        self._context.scheduler._invalidate(child)
+        self._context.ready_tasks._invalidate(child, self._task)
             
     def _validate_insert_child(self, index, child): # not a ton of validation needed as it's internal and we know how to behave
         assert child not in self.children
@@ -90,14 +94,16 @@ class BranchTaskState(TaskState):
         ))
         
     def _remove_child(self, child):
+        self._context.effort_index._on_child_removed(child)
         child._parent = None
-        child.events.planning_state_changed.disconnect(self._on_child_planning_state_changed)
         self._children.remove(child)
         self._remove_child_dependencies(child)
+        self._context.scheduler._invalidate(child, self._task)
+        self._context.ready_tasks._invalidate(child, self._task)
         if not self._children and not self._is_root:
             self._task._become_effort_task()
         else:
-            self._update_planning_state()
+            self._context.recomputation.mark_dirty('planning_state', self._task)
         
     @property
     def is_leaf(self):
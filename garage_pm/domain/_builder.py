@@ -0,0 +1,195 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+from ._common import PlanningState
+
+class TaskTreeBuilder(object):
+    
+    '''
+    Build a task tree in one pass, e.g. when loading a project
+    
+    Unlike the regular editing API, tasks, effort spent and dependencies are
+    added without validation. In particular, the dependency graph is checked for
+    cycles once, when the build ends, rather than on every edge. The build is a
+    single edit (see `Recomputation`), derived attributes are computed once at
+    its end. If the dependencies contain a cycle, they are all dropped and
+    `ValueError` is raised when the build ends.
+    
+    Use it as a context manager on a context which contains only the root task::
+    
+        with TaskTreeBuilder(context) as builder:
+            task = builder.add_task(context.root_task, 'name')
+            ...
+            
+    Archived tasks use it to load their children.
+    
+    Parameters
+    ----------
+    context : Context
+    '''
+    
+    def __init__(self, context):
+        self._context = context
+        self._edit = None
+        self._tasks = []
+        self._branches = set()
+        self._intervals = []
+        self._dependencies = []
+        self._archived = {}  # {Task => samples}, see EstimateCalibration._extend
+        
+    def __enter__(self):
+        self._edit = self._context.recomputation.edit()
+        self._edit.__enter__()
+        return self
+    
+    def __exit__(self, type_, value, traceback):
+        try:
+            if type_ is None:
+                self._finish()
+        finally:
+            self._edit.__exit__(type_, value, traceback)
+        
+    def add_task(self, parent, name, description='', planning_state=PlanningState.planned, delegated=False, duration=None, planned_start_override=None, effort_estimates={}, effort_spent=(), id_=None, index=None):
+        '''
+        Append new task to the children of a task
+        
+        Parameters
+        ----------
+        parent : Task
+            Root task or a task added earlier
+        name : str
+        description : str
+        planning_state : PlanningState
+            Ignored when the task gets children, a branch derives it instead
+        delegated : bool
+        duration : datetime.timedelta or None
+            Duration of delegated task
+        planned_start_override : datetime.datetime or None
+        effort_estimates : {EstimateType => datetime.timedelta}
+        effort_spent : iterable(Interval)
+        id_ : int or None
+            Id of the task, see `Task.id`. If ``None``, a new id.
+        index : int or None
+            Position among the children of the parent. If ``None``, append.
+        
+        Returns
+        -------
+        Task
+            The new task
+        '''
+        context = self._context
+        task = Task(name, context)
+        if id_ is not None:
+            context.changes._assign_id(task, id_)
+        common = task._common
+        common.description = description
+        common.planning_state = planning_state
+        common.planned_start_override = planned_start_override
+        if delegated:
+            task._become_delegated_task()
+            task._state._duration = duration
+        elif effort_estimates:
+            task.effort_estimates._estimates.update(effort_estimates)
+            task._update_predicted_effort()
+        
+        self._attach(parent, task, index)
+        
+        effort_spent = list(effort_spent)
+        if effort_spent:
+            task._load_effort_spent(effort_spent)
+            self._intervals.extend(effort_spent)
+        self._tasks.append(task)
+        return task
+    
+    def add_archived_task(self, parent, name, load, description='', effort_spent=(), samples=(), id_=None):
+        '''
+        Append new archived task to the children of a task
+        
+        Its subtree is loaded when needed, see `ArchivedTaskState`.
+        
+        Parameters
+        ----------
+        parent : Task
+            Root task or a task added earlier
+        name : str
+        load : (TaskTreeBuilder, Task) -> None
+            Add the children of the task, and their subtrees, to a builder
+        description : str
+        effort_spent : iterable(Interval)
+            Effort spent on the subtree of the task. Only per day totals are
+            kept.
+        samples : iterable(({EstimateType => datetime.timedelta}, datetime.timedelta))
+            Effort estimates and actual effort of each finished effort task in
+            the subtree, to calibrate estimates with, see `EstimateCalibration`
+        id_ : int or None
+            Id of the task, see `Task.id`. If ``None``, a new id.
+        
+        Returns
+        -------
+        Task
+            The new task
+        '''
+        context = self._context
+        task = Task(name, context, load=load)
+        if id_ is not None:
+            context.changes._assign_id(task, id_)
+        task._common.description = description
+        self._attach(parent, task)
+        context.effort_index._add_archived(task, effort_spent)
+        self._archived[task] = list(samples)
+        self._tasks.append(task)
+        return task
+    
+    def _attach(self, parent, task, index=None):
+        if parent.is_leaf:
+            parent._become_branch_task()
+        self._branches.add(parent)
+        parent._children.insert(len(parent._children) if index is None else index, task)
+        task._common.parent = parent
+        self._context.task_dependency_graph.add_edges_from((
+            (task.start_node, parent.start_node, {'active': True}),
+            (parent.end_node, task.end_node, {'active': True})
+        ))
+        
+    def add_dependency(self, task, dependency):
+        '''
+        Make a task depend on another
+        
+        Parameters
+        ----------
+        task : Task
+        dependency : Task
+            Task which must end before `task` can start
+        '''
+        edge = (task.start_node, dependency.end_node)
+        self._context.task_dependency_graph.add_edge(*edge, {'active': True})
+        self._dependencies.append(edge)
+        
+    def _finish(self):
+        import networkx as nx
+        context = self._context
+        graph = context.task_dependency_graph
+        if not nx.is_directed_acyclic_graph(graph):
+            cycles = context.root_task._dependency_cycles
+            graph.remove_edges_from(self._dependencies)
+            raise ValueError('Dependencies contain a cycle: {}'.format(cycles))
+        context.effort_index._extend(self._intervals)
+        context.estimate_calibration._extend(self._tasks, self._archived)
+        context.recomputation.mark_dirty('planning_state', *self._branches)
+        context.recomputation.mark_dirty('ready', *self._tasks)
+
+from ._task import Task
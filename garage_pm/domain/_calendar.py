@@ -0,0 +1,346 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime, timedelta, time
+from bisect import bisect_left, bisect_right
+
+_minute = timedelta(minutes=1)
+_epoch = datetime(2000, 1, 1)
+_whole_day = ((time(0), time(0)),)
+
+class WorkingCalendar(object):
+    
+    '''
+    Working hours: weekly hours, holidays and exceptions
+    
+    Converts between datetimes and working minutes, i.e. the number of working
+    minutes since an arbitrary, fixed point in time. It does so with a
+    precomputed table of the working spans and the cumulative working minutes
+    before each span, so that adding working time to a datetime or counting the
+    working time between datetimes takes O(log(n)) time, with n the number of
+    spans in the table. The table grows by a year at a time to cover the
+    datetimes asked for.
+    
+    Working spans are given as pairs of `datetime.time`, an end of ``time(0)``
+    means midnight at the end of the day. E.g. ``(time(0), time(0))`` is the
+    whole day.
+    
+    By default, every minute is working time. Edits are recorded as `Changes`
+    so that they are saved with the project.
+    
+    Parameters
+    ----------
+    context : Context
+    '''
+    
+    _table_days = 366
+    _max_days = 100 * 366  # furthest to look for working time, in days
+    
+    def __init__(self, context):
+        self._context = context
+        self._weekly_hours = (_whole_day,) * 7
+        self._holidays = set()
+        self._exceptions = {}  # {datetime.date => ((time, time))}
+        self._invalidate()
+        
+    @property
+    def weekly_hours(self):
+        '''
+        Working spans of each day of the week, Monday first
+        
+        Returns
+        -------
+        (((datetime.time, datetime.time),),)
+            7 tuples of (begin, end) working spans
+        '''
+        return self._weekly_hours
+    
+    @weekly_hours.setter
+    def weekly_hours(self, value):
+        value = _validate_weekly_hours(value)
+        old = self._weekly_hours
+        self._weekly_hours = value
+        self._on_changed('weekly_hours', value, old=(old,))
+        
+    @property
+    def holidays(self):
+        '''
+        Days on which no work is done, unless given an exception
+        
+        Returns
+        -------
+        frozenset(datetime.date)
+        '''
+        return frozenset(self._holidays)
+    
+    def add_holiday(self, day):
+        '''
+        Parameters
+        ----------
+        day : datetime.date
+        '''
+        if day not in self._holidays:
+            self._holidays.add(day)
+            self._on_changed('add_holiday', day)
+        
+    def remove_holiday(self, day):
+        '''
+        Parameters
+        ----------
+        day : datetime.date
+        '''
+        if day in self._holidays:
+            self._holidays.remove(day)
+            self._on_changed('remove_holiday', day)
+            
+    @property
+    def exceptions(self):
+        '''
+        Days with different working hours than the weekly hours
+        
+        Returns
+        -------
+        {datetime.date => ((datetime.time, datetime.time),)}
+            Working spans by day
+        '''
+        return dict(self._exceptions)
+    
+    def set_exception(self, day, spans):
+        '''
+        Set working spans of a day, overriding weekly hours and holidays
+        
+        Parameters
+        ----------
+        day : datetime.date
+        spans : iterable((datetime.time, datetime.time))
+            Working spans, may be empty
+        '''
+        spans = _validate_spans(spans)
+        old = self._exceptions.get(day)
+        self._exceptions[day] = spans
+        self._on_changed('set_exception', day, spans, old=(old,))
+        
+    def remove_exception(self, day):
+        '''
+        Parameters
+        ----------
+        day : datetime.date
+        '''
+        if day in self._exceptions:
+            old = self._exceptions.pop(day)
+            self._on_changed('remove_exception', day, old=(old,))
+            
+    def add(self, start, duration):
+        '''
+        Get datetime after working for a duration
+        
+        Parameters
+        ----------
+        start : datetime.datetime
+        duration : datetime.timedelta
+            Working time
+            
+        Returns
+        -------
+        datetime.datetime
+            The end of the working time. When it ends at the end of a working
+            span, this is the end of that span rather than the start of the
+            next.
+        '''
+        if not duration:
+            return start
+        return self.from_working_minutes(self.to_working_minutes(start) + duration / _minute)
+    
+    def working_time(self, begin, end):
+        '''
+        Get working time in [begin, end)
+        
+        Parameters
+        ----------
+        begin : datetime.datetime
+        end : datetime.datetime
+        
+        Returns
+        -------
+        datetime.timedelta
+        '''
+        return timedelta(minutes=self.to_working_minutes(end) - self.to_working_minutes(begin))
+    
+    def to_working_minutes(self, date_time):
+        '''
+        Get number of working minutes before a datetime
+        
+        Counted since an arbitrary point in time, which does not change until
+        the calendar is edited. Only differences between working minutes are
+        meaningful.
+        
+        Parameters
+        ----------
+        date_time : datetime.datetime
+        
+        Returns
+        -------
+        float
+        '''
+        minute = (date_time - _epoch) / _minute
+        while not self._begins or minute < self._begins[0]:
+            self._extend(forward=False)
+        while minute > self._ends[-1]:
+            self._extend(forward=True)
+        i = bisect_right(self._begins, minute) - 1
+        return self._cumulative[i] + min(minute, self._ends[i]) - self._begins[i]
+    
+    def from_working_minutes(self, working_minutes):
+        '''
+        Get datetime at which given number of working minutes have passed
+        
+        Inverse of `to_working_minutes`.
+        
+        Parameters
+        ----------
+        working_minutes : float
+        
+        Returns
+        -------
+        datetime.datetime
+        '''
+        while not self._cumulative or working_minutes <= self._cumulative[0]:
+            self._extend(forward=False)
+        while working_minutes > self._cumulative[-1] + self._ends[-1] - self._begins[-1]:
+            self._extend(forward=True)
+        i = bisect_left(self._cumulative, working_minutes) - 1
+        return _epoch + timedelta(minutes=self._begins[i] + working_minutes - self._cumulative[i])
+    
+    def _load(self, weekly_hours, holidays, exceptions):
+        '''
+        Replace all settings without recording changes, e.g. when loading
+        
+        Parameters
+        ----------
+        weekly_hours : see `weekly_hours`
+        holidays : iterable(datetime.date)
+        exceptions : {datetime.date => iterable((datetime.time, datetime.time))}
+        '''
+        self._weekly_hours = _validate_weekly_hours(weekly_hours)
+        self._holidays = set(holidays)
+        self._exceptions = {day: _validate_spans(spans) for day, spans in exceptions.items()}
+        self._invalidate()
+        self._context.scheduler.reschedule()
+        
+    def _on_changed(self, kind, *args, old=()):
+        with self._context.recomputation.edit():
+            self._invalidate()
+            self._context.changes._record(kind, None, *args, old=old)
+            self._context.scheduler.reschedule()
+        
+    def _invalidate(self):
+        self._begins = []  # minutes since _epoch at which each working span begins
+        self._ends = []
+        self._cumulative = []  # working minutes before each span
+        self._first_day = self._last_day = (datetime.now() - _epoch).days  # table covers [first_day, last_day)
+        
+    def _extend(self, forward):
+        '''
+        Extend table by a year, forward or backward in time
+        '''
+        if self._last_day - self._first_day > self._max_days:
+            raise ValueError('No working time found within {} days'.format(self._max_days))
+        if forward:
+            days = range(self._last_day, self._last_day + self._table_days)
+            self._last_day += self._table_days
+        else:
+            days = range(self._first_day - self._table_days, self._first_day)
+            self._first_day -= self._table_days
+        begins = []
+        ends = []
+        for day in days:
+            for begin, end in self._day_spans(day):
+                begins.append(begin)
+                ends.append(end)
+        cumulative = []
+        if forward:
+            total = self._cumulative[-1] + self._ends[-1] - self._begins[-1] if self._cumulative else 0
+            for begin, end in zip(begins, ends):
+                cumulative.append(total)
+                total += end - begin
+            self._begins += begins
+            self._ends += ends
+            self._cumulative += cumulative
+        else:
+            total = self._cumulative[0] if self._cumulative else 0
+            for begin, end in zip(reversed(begins), reversed(ends)):
+                total -= end - begin
+                cumulative.append(total)
+            cumulative.reverse()
+            self._begins = begins + self._begins
+            self._ends = ends + self._ends
+            self._cumulative = cumulative + self._cumulative
+            
+    def _day_spans(self, day):
+        '''
+        Get working spans of day
+        
+        Parameters
+        ----------
+        day : int
+            Days since _epoch
+        
+        Yields
+        ------
+        (int, int)
+            [begin, end) in minutes since _epoch
+        '''
+        date = (_epoch + timedelta(days=day)).date()
+        if date in self._exceptions:
+            spans = self._exceptions[date]
+        elif date in self._holidays:
+            spans = ()
+        else:
+            spans = self._weekly_hours[date.weekday()]
+        midnight = day * 24 * 60
+        for begin, end in spans:
+            yield midnight + _time_minutes(begin), midnight + (_time_minutes(end) or 24 * 60)
+            
+def _time_minutes(time_):
+    return time_.hour * 60 + time_.minute
+
+def _validate_weekly_hours(weekly_hours):
+    '''
+    Get weekly hours as tuple of sorted spans, raise if invalid
+    '''
+    weekly_hours = tuple(_validate_spans(spans) for spans in weekly_hours)
+    if len(weekly_hours) != 7:
+        raise ValueError('Weekly hours must have spans for each of the 7 days of the week, got {}'.format(len(weekly_hours)))
+    if not any(weekly_hours):
+        raise ValueError('Weekly hours must contain working time')
+    return weekly_hours
+
+def _validate_spans(spans):
+    '''
+    Get spans as sorted tuple, raise if invalid
+    '''
+    spans = tuple(sorted(tuple(span) for span in spans))
+    previous_end = 0
+    for begin, end in spans:
+        begin_ = _time_minutes(begin)
+        end_ = _time_minutes(end) or 24 * 60
+        if begin_ >= end_:
+            raise ValueError('Working span must begin before it ends: {} - {}'.format(begin, end))
+        if begin_ < previous_end:
+            raise ValueError('Working spans may not overlap: {}'.format(spans))
+        previous_end = end_
+    return spans
@@ -0,0 +1,257 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import timedelta
+from ._common import EstimateType, PlanningState
+import numpy as np
+
+_weights = np.array([1, 4, 1]) / 6  # PERT weights of optimistic, likely and pessimistic estimates
+_estimate_types = (EstimateType.optimistic, EstimateType.likely, EstimateType.pessimistic)
+
+class EstimateCalibration(object):
+    
+    '''
+    Correction model for effort estimates, fitted on finished tasks
+    
+    Fits ``log(actual_effort) = a + b * log(pert)`` by least squares over all
+    finished effort tasks with complete estimates, where ``pert`` is the 1-4-1
+    weighted mean of a task's estimates. This captures both a constant bias of
+    the user's estimates (a) and estimates growing worse with task size (b).
+    
+    The model is kept as running sums, so finishing (or reopening) a task
+    updates it in O(1). When the model changes, the predicted effort of all open
+    effort tasks is refreshed in a single batched computation.
+    
+    Until at least `min_samples` tasks have finished, predictions are plain PERT
+    estimates.
+    
+    Parameters
+    ----------
+    context : Context
+    '''
+    
+    min_samples = 3
+    
+    def __init__(self, context):
+        self._context = context
+        self._tasks = set()  # effort tasks to predict effort of
+        self._samples = {}  # {Task => (log(pert), log(actual_effort))} of finished tasks
+        self._archived = {}  # {Task => np.array}, sums (see _sums) of the samples in the subtree of an archived task
+        self._sums = np.zeros(5)  # n, sum(x), sum(y), sum(x**2), sum(x*y)
+        self._coefficients = None  # (a, b) or None if not calibrated
+        context.recomputation.register('predicted_effort', self._recompute)
+        
+    @property
+    def coefficients(self):
+        '''
+        Get fitted model coefficients
+        
+        Returns
+        -------
+        (float, float) or None
+            ``(a, b)``, or ``None`` if too few tasks have finished to calibrate
+        '''
+        return self._coefficients
+        
+    def predict(self, estimates):
+        '''
+        Predict effort required from effort estimates
+        
+        Parameters
+        ----------
+        estimates : {EstimateType => datetime.timedelta or None}
+        
+        Returns
+        -------
+        datetime.timedelta or None
+            ``None`` if any estimate is missing
+        '''
+        estimates = [estimates[x] for x in _estimate_types]
+        if any(x is None for x in estimates):
+            return None
+        if not self._coefficients:
+            return sum((weight * estimate for weight, estimate in zip((1, 4, 1), estimates)), timedelta()) / 6
+        minutes = np.array([x / timedelta(minutes=1) for x in estimates])
+        return self._predict(minutes[np.newaxis, :])[0]
+    
+    def _predict(self, minutes):
+        '''
+        Predict effort of tasks
+        
+        Parameters
+        ----------
+        minutes : np.array
+            Matrix of estimates in minutes, a row per task, a column per estimate type
+            
+        Returns
+        -------
+        [datetime.timedelta]
+        '''
+        a, b = self._coefficients
+        predicted = np.exp(a + b * np.log(minutes @ _weights))
+        predicted = np.maximum(np.rint(predicted), 1)
+        return [timedelta(minutes=x) for x in predicted.tolist()]
+        
+    def refit(self):
+        '''
+        Fit the model anew on all finished tasks of the project
+        
+        Normally the model is updated incrementally, use this after building a
+        project in bulk.
+        '''
+        self._samples.clear()
+        self._sums = sum(self._archived.values(), np.zeros(5))
+        self._extend(self._context.root_task._loaded_descendants)
+        
+    def _extend(self, tasks, archived=None):
+        '''
+        Add many samples at once
+        
+        Parameters
+        ----------
+        tasks : iterable(Task)
+            Tasks to add if they are samples
+        archived : {Task => [({EstimateType => datetime.timedelta}, datetime.timedelta)]} or None
+            Per archived task, the effort estimates and actual effort of the
+            finished effort tasks in its subtree. They are kept as sums only.
+        '''
+        if archived is None:
+            archived = {}
+        tasks = [task for task in tasks if self._is_sample(task)]
+        if tasks:
+            x, y = self._xy([task.effort_estimates for task in tasks], [task.actual_effort for task in tasks])
+            self._samples.update(zip(tasks, zip(x.tolist(), y.tolist())))
+            self._sums += _sums(x, y)
+        for task, samples in archived.items():
+            samples = [
+                (estimates, actual) for estimates, actual in samples
+                if actual and all(estimates.get(x) is not None for x in _estimate_types)
+            ]
+            if samples:
+                sums = _sums(*self._xy(*zip(*samples)))
+                self._archived[task] = sums
+                self._sums += sums
+        self._update_coefficients()
+        
+    def _archive(self, task, descendants):
+        '''
+        Keep the samples in the subtree of a task being archived as sums only
+        
+        The model is unchanged. Call before the descendants are forgotten.
+        '''
+        sums = np.zeros(5)
+        for task_ in descendants:
+            sample = self._samples.pop(task_, None)
+            if sample:
+                x, y = sample
+                sums += (1, x, y, x * x, x * y)
+            archived = self._archived.pop(task_, None)
+            if archived is not None:
+                sums += archived
+        if sums[0]:
+            self._archived[task] = sums
+        
+    def _xy(self, estimates, actual_efforts):
+        minutes = np.array([[estimates_[x] / timedelta(minutes=1) for x in _estimate_types] for estimates_ in estimates])
+        x = np.log(minutes @ _weights)
+        y = np.log(np.array([actual / timedelta(minutes=1) for actual in actual_efforts]))
+        return x, y
+    
+    def _is_sample(self, task):
+        return (
+            task.is_leaf and not task.delegated and
+            task.planning_state == PlanningState.finished and
+            all(task.effort_estimates[x] is not None for x in _estimate_types)
+        )
+        
+    def _register(self, task):
+        '''
+        Start predicting effort of an effort task
+        '''
+        self._tasks.add(task)
+        
+    def _forget(self, task):
+        self._tasks.discard(task)
+        self._remove_sample(task)
+        sums = self._archived.pop(task, None)
+        if sums is not None:
+            self._sums -= sums
+            self._update_coefficients()
+        
+    def _on_finished_changed(self, task):
+        '''
+        Update model when task finished or was reopened
+        '''
+        if self._is_sample(task):
+            if task not in self._samples:
+                pert = task.effort_estimates
+                x = np.log(np.array([pert[x] / timedelta(minutes=1) for x in _estimate_types]) @ _weights)
+                y = np.log(task.actual_effort / timedelta(minutes=1))
+                self._samples[task] = (x, y)
+                self._sums += (1, x, y, x * x, x * y)
+                self._update_coefficients()
+        else:
+            self._remove_sample(task)
+            
+    def _remove_sample(self, task):
+        sample = self._samples.pop(task, None)
+        if sample:
+            x, y = sample
+            self._sums -= (1, x, y, x * x, x * y)
+            self._update_coefficients()
+            
+    def _update_coefficients(self):
+        old = self._coefficients
+        n, sx, sy, sxx, sxy = self._sums.tolist()
+        if round(n) < self.min_samples:
+            self._coefficients = None
+        else:
+            denominator = n * sxx - sx * sx
+            if denominator < 1e-9 * n * n:  # estimates (nearly) all the same size, fit a constant bias only
+                self._coefficients = ((sy - sx) / n, 1.0)
+            else:
+                b = (n * sxy - sx * sy) / denominator
+                self._coefficients = ((sy - b * sx) / n, b)
+        if self._coefficients != old:
+            self._refresh()
+            
+    def _refresh(self):
+        '''
+        Mark predicted effort of all open effort tasks dirty
+        
+        They are then recomputed in one batch, see `_recompute`.
+        '''
+        self._tasks = {task for task in self._tasks if task.is_leaf and not task.delegated}
+        tasks = [task for task in self._tasks if task.planning_state != PlanningState.finished]
+        self._context.recomputation.mark_dirty('predicted_effort', *tasks)
+        
+    def _recompute(self, tasks):
+        '''
+        Recompute predicted effort of effort tasks in one batch, see `Recomputation`
+        '''
+        tasks = [task for task in tasks if task.is_leaf and not task.delegated]
+        predictions = {}
+        if self._coefficients:
+            complete = [task for task in tasks if all(task.effort_estimates[x] is not None for x in _estimate_types)]
+            if complete:
+                minutes = np.array([[task.effort_estimates[x] / timedelta(minutes=1) for x in _estimate_types] for task in complete])
+                predictions = dict(zip(complete, self._predict(minutes)))
+        for task in tasks:
+            task._set_predicted_effort(predictions[task] if task in predictions else self.predict(task.effort_estimates))
+
+def _sums(x, y):
+    return np.array([len(x), x.sum(), y.sum(), (x * x).sum(), (x * y).sum()])
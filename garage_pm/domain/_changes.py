@@ -0,0 +1,228 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+from ._signal import Signal
+from collections import namedtuple
+
+Change = namedtuple('Change', 'kind task args old')
+Change.__new__.__defaults__ = ((),)
+Change.__doc__ = '''
+Edit of the persistent state of a project
+
+Attributes
+----------
+kind : str
+    What changed, see `Changes`
+task : Task or None
+    Task which changed. ``None`` for ``stop_tracking`` and changes to the
+    project itself, such as ``project_start``.
+args : tuple
+    New value(s), see `Changes`
+old : tuple
+    What the change lost, to revert it with (see `UndoStack`). Empty for
+    changes which can be reverted from their args alone.
+'''
+
+class Changes(object):
+    
+    '''
+    Feed of edits to the persistent state of a project
+    
+    Each successful edit is reported right away, in order, as a `Change` through
+    ``events.changed``. Derived attributes, such as the schedule, are not
+    reported. Repeating the changes in order on the project as it was
+    reproduces the project (see `garage_pm.store.Journal`). Changes and their
+    args:
+    
+    ``new``: (creator :: Task, name :: str)
+        ``creator.append_new_task(name)`` created ``task``
+    ``move``: (parent :: Task, index :: int, old_parent :: Task, old_index :: int)
+    ``dispose``: (parent :: Task, index :: int)
+        ``task`` was removed from ``parent.children[index]``. Old: (Subtree,)
+        of ``task``.
+    ``restore``: (parent :: Task, index :: int, Subtree)
+        ``task`` was added back as ``parent.children[index]``, see
+        `Subtree.restore`
+    ``name``, ``description``: (str,)
+    ``planning_state``: (PlanningState,)
+    ``duration``: (datetime.timedelta or None,)
+    ``planned_start_override``: (datetime.datetime or None,)
+        Old: the previous value, for each of the above
+    ``delegated``: (bool,)
+        Old: (duration,) if it was delegated, else ({EstimateType => datetime.timedelta or None},)
+    ``effort_estimate``: (EstimateType, datetime.timedelta or None)
+        Old: (previous estimate,)
+    ``insert_effort_spent``: (index :: int, Interval)
+    ``update_effort_spent``: (old :: Interval, new :: Interval)
+    ``remove_effort_spent``: (Interval,)
+        Old: (index :: int,) it was at
+    ``add_dependency``, ``remove_dependency``: (dependency :: Task,)
+    ``start_tracking``: (start :: datetime.datetime,)
+    ``stop_tracking``: ()
+    ``archive``: ()
+        ``task.archive()`` moved the subtree of ``task`` to cold storage
+    ``project_start``: (datetime.datetime,)
+        `Scheduler.project_start` changed. Old: the previous value.
+    ``weekly_hours``: (weekly hours,)
+        `WorkingCalendar.weekly_hours` changed. Old: the previous value.
+    ``add_holiday``, ``remove_holiday``: (datetime.date,)
+    ``set_exception``: (datetime.date, spans)
+        Old: (previous spans or None,)
+    ``remove_exception``: (datetime.date,)
+        Old: (spans,) it had
+    
+    It also hands out task ids, and finds tasks by id.
+    
+    Parameters
+    ----------
+    context : Context
+    '''
+    
+    class _Events(object):
+        
+        changed = Signal(object)  # Change
+    
+    def __init__(self, context):
+        self.events = self._Events()
+        self._next_id = 1  # the root task is 0
+        self._tasks = {}  # {id => Task}, of the tasks in memory
+        
+    def _new_id(self, task, is_root=False):
+        if is_root:
+            id_ = 0
+        else:
+            id_ = self._next_id
+            self._next_id += 1
+        self._tasks[id_] = task
+        return id_
+    
+    def _assign_id(self, task, id_):
+        '''
+        Change the id of a new task, e.g. to the id it was stored with
+        '''
+        self._forget(task)
+        task._common.id = id_
+        self._tasks[id_] = task
+        self._next_id = max(self._next_id, id_ + 1)
+        
+    def _task(self, id_):
+        '''
+        Get task by id
+        
+        Raises
+        ------
+        KeyError
+            If no such task is in memory
+        '''
+        return self._tasks[id_]
+    
+    def _forget(self, task):
+        if self._tasks.get(task.id) is task:
+            del self._tasks[task.id]
+        
+    def _record(self, kind, task, *args, old=()):
+        self.events.changed.emit(Change(kind, task, args, old))
+
+class DirtyTasks(object):
+    
+    '''
+    Tasks whose persistent state changed since the last `clear`
+    
+    Follows `Changes`, taking constant time per change, and records which parts
+    of a task changed so only those need to be saved.
+    
+    Tasks may have been disposed since they were marked dirty. Descendants of
+    disposed tasks are disposed as well, but only the disposed task itself is
+    in `disposed`.
+    
+    Parameters
+    ----------
+    changes : Changes
+    
+    Attributes
+    ----------
+    tasks : {Task}
+        Tasks whose attributes changed
+    parents : {Task}
+        Tasks whose children changed, changing the parent or position of each
+        child
+    dependencies : {Task}
+        Tasks whose dependencies changed
+    effort_estimates : {Task}
+    effort_spent : {Task}
+    disposed : {Task}
+    '''
+    
+    def __init__(self, changes):
+        self.clear()
+        changes.events.changed.connect(self._on_changed)
+        
+    def clear(self):
+        '''
+        Mark all tasks clean
+        '''
+        self.tasks = set()
+        self.parents = set()
+        self.dependencies = set()
+        self.effort_estimates = set()
+        self.effort_spent = set()
+        self.disposed = set()
+        
+    def _on_changed(self, change):
+        kind = change.kind
+        task = change.task
+        if kind in ('new', 'move', 'dispose', 'restore'):
+            if kind == 'new':
+                parents = (task.parent,)
+            elif kind == 'move':
+                parents = (change.args[0], change.args[2])
+            elif kind == 'dispose':
+                parents = (change.args[0],)
+                self.disposed.add(task)
+            else:
+                parents = (change.args[0],)
+                self._on_restored(task)
+            for parent in parents:
+                # Positions of siblings shift and the parent may have changed
+                # between leaf and branch
+                self.parents.add(parent)
+                self.effort_estimates.add(parent)
+                self.effort_spent.add(parent)
+        elif kind == 'delegated':
+            self.tasks.add(task)
+            self.effort_estimates.add(task)
+            self.effort_spent.add(task)
+        elif kind == 'effort_estimate':
+            self.effort_estimates.add(task)
+        elif kind.endswith('effort_spent'):
+            self.effort_spent.add(task)
+        elif kind.endswith('dependency'):
+            self.dependencies.add(task)
+        elif task is not None and kind not in ('start_tracking', 'stop_tracking', 'archive'):  # project changes have no task
+            self.tasks.add(task)
+            
+    def _on_restored(self, task):
+        # The former task of its id may be disposed, its rows must stay
+        self.disposed = {disposed for disposed in self.disposed if disposed.id != task.id}
+        tasks = [task]
+        tasks.extend(task.descendants)
+        for task_ in tasks:
+            self.tasks.add(task_)
+            self.dependencies.add(task_)
+            self.dependencies.update(task_._dependers)
+            self.effort_estimates.add(task_)
+            self.effort_spent.add(task_)
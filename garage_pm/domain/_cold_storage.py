@@ -0,0 +1,73 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from ._subtree import _record
+
+class ColdStorage(object):
+    
+    '''
+    Storage of the subtrees of archived tasks, see `Task.archive`
+    
+    By default subtrees are kept in memory as plain records, which take far
+    less memory than tasks and stay out of the dependency graph. A persistent
+    store takes over by setting `backend`, e.g. an open
+    `garage_pm.store.Journal` keeps them in the project database instead.
+    
+    Attributes
+    ----------
+    backend : object or None
+        If not ``None``, ``backend.store(task)`` saves the subtree of a task
+        instead; it has the same signature as `store`.
+    '''
+    
+    def __init__(self):
+        self.backend = None
+        
+    def store(self, task):
+        '''
+        Save the subtree of a task which is about to be archived
+        
+        Parameters
+        ----------
+        task : Task
+            Branch task whose descendants are about to be removed from memory
+        
+        Returns
+        -------
+        load : (TaskTreeBuilder, Task) -> None
+            Add the saved descendants back as children of the task
+        '''
+        if self.backend is not None:
+            return self.backend.store(task)
+        
+        descendants = list(task.descendants)
+        positions = {task_: i for i, task_ in enumerate(descendants)}
+        records = [(positions.get(task_.parent), _record(task_)) for task_ in descendants]  # parents precede their children
+        dependencies = [
+            (positions[task_], positions[dependency])
+            for task_ in descendants
+            for dependency in task_.dependencies
+        ]
+        
+        def load(builder, task):
+            tasks = []
+            for parent, kwargs in records:
+                tasks.append(builder.add_task(task if parent is None else tasks[parent], **kwargs))
+            for task_, dependency in dependencies:
+                builder.add_dependency(tasks[task_], tasks[dependency])
+        return load
@@ -27,6 +27,9 @@ class Interval(object):
     
     Finest granularity is minutes (seconds, ... ignored)
     
+    Intervals are immutable, to replace an interval of effort spent, use
+    `Task.update_effort_spent`.
+    
     Parameters
     ----------
     start : datetime.datetime
@@ -42,19 +45,9 @@ class Interval(object):
     def begin(self):
         return self._begin
     
-    @begin.setter
-    def begin(self, value):
-        self._validate(value, self._end)
-        self._begin = value
-    
     @property
     def end(self):
         return self._end
-    
-    @end.setter
-    def end(self, value):
-        self._validate(self._begin, value)
-        self._end = value
         
     def _validate(self, begin, end):
         if begin > end:
@@ -17,6 +17,7 @@
 
 from chicken_turtle_util.exceptions import InvalidOperationError
 from ._leaf_task_state import LeafTaskState
+from ._recomputation import edit
 from garage_pm.domain._common import PlanningState
 
 class DelegatedTaskState(LeafTaskState):
@@ -36,7 +37,12 @@ class DelegatedTaskState(LeafTaskState):
         return self._duration
     
     @duration.setter
+    @edit
     def duration(self, value):
         if self.planning_state == PlanningState.finished:
             raise InvalidOperationError('Cannot change duration on finished task')
-        self._duration = value
\ No newline at end of file
+        old = self._duration
+        if old != value:
+            self._duration = value
+            self._context.scheduler._invalidate(self._task)
+            self._context.changes._record('duration', self._task, value, old=(old,))
\ No newline at end of file
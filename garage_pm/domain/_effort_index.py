@@ -0,0 +1,300 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime, timedelta, time
+from bisect import bisect_left, insort
+from ._common import Interval
+
+class EffortIndex(object):
+    
+    '''
+    Index of effort spent over time, in per day buckets
+    
+    Keeps a prefix sum tree of effort spent per day for each task's subtree, so
+    that range totals, overall or per subtree, take O(log(n)) time with n the
+    number of days in the calendar. Efforts are kept up to date by the tasks
+    as intervals are inserted, removed or grown by the time tracker.
+    
+    It also keeps the effort intervals of all tasks sorted by time, so that
+    overlap with a new interval is checked against its neighbours only. The
+    intervals of archived tasks are only summarized, by their per day effort
+    and the time span they cover; an archived task whose span overlaps a new
+    interval is loaded to check it. The spans are sorted by their begin as
+    well, so that only those near a new interval are checked.
+    
+    Parameters
+    ----------
+    context : Context
+    '''
+    
+    def __init__(self, context):
+        self._context = context
+        self._trees = {}  # {Task => _SparseFenwickTree}, effort spent on the task's subtree
+        self._intervals = []  # [Interval], sorted, of all tasks, excluding the interval currently being time tracked
+        self._archived = {}  # {Task => Interval}, span of the effort spent on the subtree of an archived task
+        self._archived_spans = []  # [(datetime, int, Task)], begin of the span and id of each archived task, sorted
+        self._longest_archived_span = timedelta()  # no archived span is longer, though it may have been removed since
+        
+    def total(self, begin=None, end=None, task=None):
+        '''
+        Get total effort spent in [begin, end)
+        
+        Parameters
+        ----------
+        begin : datetime.date or None
+            First day to include. If ``None``, include everything before `end`.
+        end : datetime.date or None
+            Day after the last day to include. If ``None``, include everything
+            since `begin`.
+        task : Task or None
+            Subtree to total. If ``None``, the whole project.
+            
+        Returns
+        -------
+        datetime.timedelta
+        '''
+        tree = self._trees.get(self._subtree_root(task))
+        if not tree:
+            return timedelta()
+        end = tree.size - 1 if end is None else end.toordinal() - 1
+        begin = 0 if begin is None else begin.toordinal() - 1
+        return timedelta(minutes=tree.prefix_sum(end) - tree.prefix_sum(begin))
+    
+    def per_day(self, begin, end, task=None):
+        '''
+        Get effort spent on each day in [begin, end)
+        
+        Parameters
+        ----------
+        begin : datetime.date
+        end : datetime.date
+        task : Task or None
+            Subtree to total. If ``None``, the whole project.
+            
+        Yields
+        ------
+        (datetime.date, datetime.timedelta)
+            Each day and the effort spent on it, in order
+        '''
+        tree = self._trees.get(self._subtree_root(task))
+        previous = tree.prefix_sum(begin.toordinal() - 1) if tree else 0
+        for day in range(begin.toordinal(), end.toordinal()):
+            current = tree.prefix_sum(day) if tree else 0
+            yield datetime.fromordinal(day).date(), timedelta(minutes=current - previous)
+            previous = current
+            
+    def _insert(self, interval):
+        insort(self._intervals, interval)
+        
+    def _extend(self, intervals):
+        '''
+        Insert many intervals at once
+        '''
+        self._intervals.extend(intervals)
+        self._intervals.sort()
+        
+    def _add_archived(self, task, intervals):
+        '''
+        Add effort spent on the subtree of an archived task
+        
+        Only per day totals and the span of the intervals are kept.
+        '''
+        begin = end = None
+        for interval in intervals:
+            self._add_interval(task, interval)
+            begin = interval.begin if begin is None else min(begin, interval.begin)
+            end = interval.end if end is None else max(end, interval.end)
+        if begin is not None:
+            self._set_archived(task, Interval(begin, end))
+        
+    def _archive(self, task, descendants):
+        '''
+        Summarize the effort spent on the subtree of a task being archived
+        
+        The per day totals of the task already include its descendants', only
+        the span of their intervals is added. Call before the descendants are
+        forgotten.
+        '''
+        spans = [self._archived[task_] for task_ in descendants if task_ in self._archived]
+        spans.extend(
+            interval
+            for task_ in descendants if task_.is_leaf and not task_.delegated
+            for interval in task_.effort_spent
+        )
+        if spans:
+            self._set_archived(task, Interval(min(span.begin for span in spans), max(span.end for span in spans)))
+            
+    def _set_archived(self, task, span):
+        self._discard_archived(task)
+        self._archived[task] = span
+        insort(self._archived_spans, (span.begin, task.id, task))
+        self._longest_archived_span = max(self._longest_archived_span, span.duration)
+        
+    def _discard_archived(self, task):
+        span = self._archived.pop(task, None)
+        if span is not None:
+            spans = self._archived_spans
+            del spans[bisect_left(spans, (span.begin, task.id))]
+        
+    def _discard(self, interval):
+        i = bisect_left(self._intervals, interval)
+        if i < len(self._intervals) and self._intervals[i] == interval:
+            del self._intervals[i]
+            
+    def _find_overlap(self, interval, ignore=None):
+        '''
+        Get an interval overlapping with given interval
+        
+        As the intervals do not overlap each other, only the neighbours of
+        `interval` need to be checked. Archived tasks whose span may overlap
+        are loaded first, any other span begins too early or too late.
+        
+        Parameters
+        ----------
+        interval : Interval
+        ignore : Interval or None
+            Interval to pretend is not in the index
+            
+        Returns
+        -------
+        Interval or None
+        '''
+        spans = self._archived_spans
+        first = bisect_left(spans, (interval.begin - self._longest_archived_span,))
+        last = bisect_left(spans, (interval.end,))
+        overlapping = [task for _, _, task in spans[first:last] if self._archived[task].intersects(interval)]
+        for task in overlapping:
+            task.children  # load its intervals
+        intervals = self._intervals
+        i = bisect_left(intervals, interval)
+        previous = i - 1
+        if ignore is not None and previous >= 0 and intervals[previous] == ignore:
+            previous -= 1
+        next_ = i
+        if ignore is not None and next_ < len(intervals) and intervals[next_] == ignore:
+            next_ += 1
+        for j in (previous, next_):
+            if 0 <= j < len(intervals) and intervals[j].intersects(interval):
+                return intervals[j]
+        return None
+        
+    def _subtree_root(self, task):
+        return self._context.root_task if task is None else task
+    
+    def _tree(self, task):
+        if task not in self._trees:
+            self._trees[task] = _SparseFenwickTree()
+        return self._trees[task]
+            
+    def _add_interval(self, task, interval, sign=1):
+        '''
+        Add (sign=1) or subtract (sign=-1) an effort interval of task
+        '''
+        tasks = [task] + list(task.ancestors)
+        for day, minutes in _minutes_per_day(interval):
+            for task_ in tasks:
+                self._tree(task_).add(day, sign * minutes)
+    
+    def _remove_interval(self, task, interval):
+        self._add_interval(task, interval, sign=-1)
+        
+    def _on_child_inserted(self, child, sign=1):
+        '''
+        Add child's subtree effort to its (new) ancestors
+        '''
+        tree = self._trees.get(child)
+        if tree:
+            for ancestor in child.ancestors:
+                self._tree(ancestor).merge(tree, sign)
+                
+    def _on_child_removed(self, child):
+        '''
+        Subtract child's subtree effort from its (old) ancestors
+        
+        Call before the child is detached from its parent.
+        '''
+        self._on_child_inserted(child, sign=-1)
+        
+    def _forget(self, task):
+        self._trees.pop(task, None)
+        self._discard_archived(task)
+        
+def _minutes_per_day(interval):
+    '''
+    Split interval in days
+    
+    Yields
+    ------
+    (int, int)
+        Day ordinal and minutes of interval on that day
+    '''
+    begin = interval.begin
+    while begin < interval.end:
+        midnight = datetime.combine(begin.date() + timedelta(days=1), time())
+        end = min(midnight, interval.end)
+        yield begin.toordinal(), (end - begin) // timedelta(minutes=1)
+        begin = end
+    
+class _SparseFenwickTree(object):
+    
+    '''
+    Fenwick tree (binary indexed tree) over day ordinals
+    
+    Only non-zero nodes are stored, so an empty tree is cheap regardless of the
+    span of days it covers.
+    '''
+    
+    size = 1 << 22  # > date.max.toordinal()
+    
+    def __init__(self):
+        self._nodes = {}
+        
+    def __bool__(self):
+        return bool(self._nodes)
+        
+    def add(self, index, value):
+        nodes = self._nodes
+        while index < self.size:
+            self._set_node(index, nodes.get(index, 0) + value)
+            index += index & -index
+            
+    def prefix_sum(self, index):
+        '''
+        Get sum of values at 1..index
+        '''
+        nodes = self._nodes
+        total = 0
+        while index > 0:
+            total += nodes.get(index, 0)
+            index &= index - 1
+        return total
+    
+    def merge(self, other, sign=1):
+        '''
+        Add (sign=1) or subtract (sign=-1) all values of other tree
+        
+        Takes time linear in the number of nodes of `other`.
+        '''
+        nodes = self._nodes
+        for index, value in other._nodes.items():
+            self._set_node(index, nodes.get(index, 0) + sign * value)
+            
+    def _set_node(self, index, value):
+        if value:
+            self._nodes[index] = value
+        else:
+            self._nodes.pop(index, None)
@@ -15,11 +15,12 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
 
-from PyQt5.QtCore import QObject, pyqtSignal
 from datetime import timedelta
 from chicken_turtle_util.exceptions import InvalidOperationError
 from ._common import EstimateType, PlanningState
+from ._signal import Signal
 from ._leaf_task_state import LeafTaskState
+from ._recomputation import edit
 from datetime import datetime
     
 class EffortTaskState(LeafTaskState):
@@ -27,21 +28,21 @@ class EffortTaskState(LeafTaskState):
     def __init__(self, common_data):
         super().__init__(common_data)
         self._effort_estimates = _EffortEstimates(self._task, self._context)
-        self._events = _EffortTaskStateEvents(self._context.qt_parent)
+        self._events = _EffortTaskStateEvents()
         
         # predicted effort
         self._predicted_effort = None
         for estimate_type in EstimateType:
-            self.effort_estimates.changed[estimate_type].connect(self._update_predicted_effort)
+            self.effort_estimates.changed[estimate_type].connect(self._on_effort_estimate_changed)
+        self._context.estimate_calibration._register(self._task)
 
         # effort spent
         self.__effort_spent = []
         self._effort_spent = ()
-        self._context.time_tracker.events.current_interval_changed.connect(self._update_effort_spent)
+        self._context.time_tracker.events.current_interval_changed.connect(self._on_current_interval_changed)
             
         # actual effort
         self._actual_effort = timedelta()
-        self._events.effort_spent_changed.connect(self._update_actual_effort)
     
         # planning state
         if self._planning_state == PlanningState.finished:  # we have no effort spent yet, can't be finished, revert to being planned
@@ -56,23 +57,28 @@ class EffortTaskState(LeafTaskState):
         '''
         Get predicted required effort
         
-        E.g. based on discrepancies between a user's estimates and actual effort spent on tasks
+        Based on the effort estimates, corrected for discrepancies between the
+        user's estimates and actual effort spent on finished tasks. See
+        `EstimateCalibration`.
+        
+        Returns
+        -------
+        datetime.timedelta or None
+            ``None`` if any of the effort estimates is missing
         '''
         return self._predicted_effort
         
+    def _on_effort_estimate_changed(self, task):
+        self._update_predicted_effort()
+        
     def _update_predicted_effort(self):
-        old_value = self._predicted_effort
-        if any(self._effort_estimates[x] is None for x in EstimateType):
-            self._predicted_effort = None
-        else:
-            weights = {
-                EstimateType.optimistic: 1,
-                EstimateType.likely: 4,
-                EstimateType.pessimistic: 1,
-            }
-            self._predicted_effort = sum((weight * self._effort_estimates[estimate_type] for estimate_type, weight in weights.items()), timedelta()) / sum(weights.values())
-        if old_value != self._predicted_effort:
-            self.events.predicted_effort_changed.emit(self._task)
+        self._context.recomputation.mark_dirty('predicted_effort', self._task)
+        
+    def _set_predicted_effort(self, value):
+        if self._predicted_effort != value:
+            self._predicted_effort = value
+            self._context.scheduler._invalidate(self._task)
+            self._context.recomputation.emit(self._task, 'predicted_effort_changed')
     
     @property
     def actual_effort(self):
@@ -85,11 +91,15 @@ class EffortTaskState(LeafTaskState):
         '''
         return self._actual_effort
     
-    def _update_actual_effort(self):
+    def _update_actual_effort(self, added, removed):
+        '''
+        Adjust actual effort to intervals added to and removed from effort_spent
+        '''
         old_value = self._actual_effort
-        self._actual_effort = sum((x.duration for x in self.effort_spent), timedelta())
+        self._actual_effort += sum((x.duration for x in added), timedelta()) - sum((x.duration for x in removed), timedelta())
         if old_value != self._actual_effort:
-            self.events.actual_effort_changed.emit(self._task)
+            self._context.scheduler._invalidate(self._task)
+            self._context.recomputation.emit(self._task, 'actual_effort_changed')
     
     @property
     def effort_spent(self):
@@ -103,6 +113,9 @@ class EffortTaskState(LeafTaskState):
         '''
         return self._effort_spent
     
+    def _on_current_interval_changed(self, time_tracker):
+        self._update_effort_spent()
+        
     def _update_effort_spent(self):
         old = self._effort_spent
         self._effort_spent = list(self.__effort_spent)
@@ -111,8 +124,27 @@ class EffortTaskState(LeafTaskState):
             self._effort_spent.append(time_tracker.current_interval)
         self._effort_spent = tuple(self._effort_spent)
         if self._effort_spent != old:
+            effort_index = self._context.effort_index
+            old, new = set(old), set(self._effort_spent)
+            removed = old - new
+            added = new - old
+            for interval in removed:
+                effort_index._remove_interval(self._task, interval)
+            for interval in added:
+                effort_index._add_interval(self._task, interval)
+            self._update_actual_effort(added, removed)
             self.events.effort_spent_changed.emit(self._task)
     
+    def _load_effort_spent(self, intervals):
+        '''
+        Set effort spent without validation, see `TaskTreeBuilder`
+        
+        The intervals are not added to the sorted intervals of the effort index.
+        '''
+        self.__effort_spent = list(intervals)
+        self._update_effort_spent()
+        
+    @edit
     def insert_effort_spent(self, index, effort):
         '''
         Parameters
@@ -124,15 +156,48 @@ class EffortTaskState(LeafTaskState):
             raise InvalidOperationError('Cannot spend effort on task before its end_dependencies have finished')
         if self.planning_state == PlanningState.finished:
             raise InvalidOperationError('Cannot insert effort into finished task')
-        if effort.end > datetime.now():
-            raise ValueError('Effort spent may not lie in the future: {}'.format(effort))
-        for interval in self._context.effort_intervals:
-            if effort.intersects(interval):
-                raise ValueError('Effort intervals may not overlap: {} and {}'.format(interval, effort))
+        self._validate_effort(effort)
         self.__effort_spent.insert(index, effort)
-        self._context.effort_intervals.add(effort)
+        self._context.effort_index._insert(effort)
+        self._update_effort_spent()
+        self._context.changes._record('insert_effort_spent', self._task, index, effort)
+        
+    @edit
+    def update_effort_spent(self, old, new):
+        '''
+        Replace an interval of effort spent
+        
+        Only the intervals neighbouring `new` in time are checked for overlap.
+        
+        Parameters
+        ----------
+        old : Interval
+            Interval of effort spent to replace
+        new : Interval
+            Interval to replace it with
+        '''
+        if self.planning_state == PlanningState.finished:
+            raise InvalidOperationError('Cannot edit effort of finished task')
+        if old not in self.__effort_spent:
+            raise ValueError('Interval is not part of the effort spent on the task: {}'.format(old))
+        if old == new:
+            return
+        self._validate_effort(new, ignore=old)
+        self.__effort_spent[self.__effort_spent.index(old)] = new
+        effort_index = self._context.effort_index
+        effort_index._discard(old)
+        effort_index._insert(new)
         self._update_effort_spent()
+        self._context.changes._record('update_effort_spent', self._task, old, new)
+        
+    def _validate_effort(self, effort, ignore=None):
+        if effort.end > datetime.now():
+            raise ValueError('Effort spent may not lie in the future: {}'.format(effort))
+        overlap = self._context.effort_index._find_overlap(effort, ignore)
+        if overlap:
+            raise ValueError('Effort intervals may not overlap: {} and {}'.format(overlap, effort))
         
+    @edit
     def remove_effort_spent(self, effort):
         '''
         Parameters
@@ -141,9 +206,17 @@ class EffortTaskState(LeafTaskState):
         '''
         if self.planning_state == PlanningState.finished:
             raise InvalidOperationError('Cannot remove effort from finished task')
-        self.__effort_spent.remove(effort)
-        self._context.effort_intervals.remove(effort)
+        index = self.__effort_spent.index(effort)
+        del self.__effort_spent[index]
+        self._context.effort_index._discard(effort)
         self._update_effort_spent()
+        self._context.changes._record('remove_effort_spent', self._task, effort, old=(index,))
+        
+    def _set_planning_state(self, value):
+        was_finished = self._planning_state == PlanningState.finished
+        super()._set_planning_state(value)
+        if was_finished != (self._planning_state == PlanningState.finished):
+            self._context.estimate_calibration._on_finished_changed(self._task)
         
     def validate_set_planning_state(self, state):
         ex = super().validate_set_planning_state(state)
@@ -162,10 +235,12 @@ class EffortTaskState(LeafTaskState):
             return ValueError('Cannot delegate task that already has effort spent on it')
         return None
     
-    def dispose(self):
-        super().dispose()
-        self._context.effort_intervals -= set(self.effort_spent)
-        self._context.time_tracker.events.current_interval_changed.disconnect(self._update_effort_spent)
+    def _drop(self):
+        super()._drop()
+        for effort in self.__effort_spent:
+            self._context.effort_index._discard(effort)
+        self._context.estimate_calibration._forget(self._task)
+        self._context.time_tracker.events.current_interval_changed.disconnect(self._on_current_interval_changed)
             
 from ._task import Task
 
@@ -175,14 +250,13 @@ class _EffortEstimates(object):
     Effort estimates given by user
     '''
     
-    class _Events(QObject):
+    class _Events(object):
         
-        optimistic_effort_changed = pyqtSignal(Task)
-        likely_effort_changed = pyqtSignal(Task)
-        pessimistic_effort_changed = pyqtSignal(Task)
+        optimistic_effort_changed = Signal(Task)
+        likely_effort_changed = Signal(Task)
+        pessimistic_effort_changed = Signal(Task)
         
-        def __init__(self, parent=None):
-            super().__init__(parent)
+        def __init__(self):
             self._signals = {
                 EstimateType.optimistic: self.optimistic_effort_changed,
                 EstimateType.likely: self.likely_effort_changed,
@@ -193,7 +267,8 @@ class _EffortEstimates(object):
             return self._signals[key]
     
     def __init__(self, task, context):
-        self.changed = self._Events(context.qt_parent)
+        self.changed = self._Events()
+        self._context = context
         self._task = task
         self._estimates = {x: None for x in EstimateType}
         
@@ -213,6 +288,7 @@ class _EffortEstimates(object):
         '''
         return self._estimates[key]
     
+    @edit
     def __setitem__(self, key, value):
         '''
         Parameters
@@ -224,16 +300,15 @@ class _EffortEstimates(object):
             raise InvalidOperationError('Cannot edit effort estimates on finished task')
         if value is not None and value <= timedelta():
             raise ValueError('Effort estimate must be > timedelta(0)')
-        if self._estimates[key] != value:
+        old = self._estimates[key]
+        if old != value:
             self._estimates[key] = value
             self.changed[key].emit(self._task)
+            self._context.changes._record('effort_estimate', self._task, key, value, old=(old,))
             
-class _EffortTaskStateEvents(QObject):
-    predicted_effort_changed = pyqtSignal(Task)
-    actual_effort_changed = pyqtSignal(Task)
-    effort_spent_changed = pyqtSignal(Task) #TODO add a test for time tracking hitting 1 minute, at that point, and every tick from then on, an event should be sent out as effort spent will have changed. If we added a cancel, that affects it too (if >=1min)
-    
-    def __init__(self, parent=None):
-        super().__init__(parent)
+class _EffortTaskStateEvents(object):
+    predicted_effort_changed = Signal(Task)
+    actual_effort_changed = Signal(Task)
+    effort_spent_changed = Signal(Task) #TODO add a test for time tracking hitting 1 minute, at that point, and every tick from then on, an event should be sent out as effort spent will have changed. If we added a cancel, that affects it too (if >=1min)
         
         
\ No newline at end of file
@@ -33,7 +33,8 @@ class LeafTaskState(TaskState):
             raise ex
         if self._planning_state != value:
             self._planning_state = value
-            self._task.events.planning_state_changed.emit(self._task)
+            self._context.scheduler._invalidate(self._task)
+            self._on_planning_state_changed()
     
     def validate_set_planning_state(self, state):
         if state == PlanningState.finished and self._has_unfinished_dependencies:
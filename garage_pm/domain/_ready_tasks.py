@@ -0,0 +1,149 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+from ._signal import Signal
+from ._common import PlanningState
+import itertools
+import heapq
+
+class ReadyTasks(object):
+    
+    '''
+    Planned leaf tasks which can be worked on now
+    
+    A task is ready when it is a planned leaf task in the task tree and the
+    dependencies of it and of its ancestors have all finished. The set is
+    maintained incrementally: edits only recheck the leaf tasks they can affect,
+    once per edit (see `Recomputation`).
+    
+    Ready tasks are ordered by total slack, least first, then by planned start
+    (see `Task.slack`). They are kept in a heap from which outdated entries are
+    dropped lazily. Getting the top n tasks takes O(n log(m)) time, with m the
+    number of ready tasks, plus O(log(m)) per ready task whose slack changed
+    since the previous query. The heap is compacted once outdated entries
+    outnumber current ones.
+    
+    Parameters
+    ----------
+    context : Context
+    '''
+    
+    class _Events(object):
+        
+        changed = Signal(object)  # ReadyTasks, emitted when the ready tasks or their order changed
+    
+    def __init__(self, context):
+        self._context = context
+        self.events = self._Events()
+        self._ready = set()
+        self._heap = []  # [((slack, planned start), id, Task)], including outdated entries
+        self._entries = {}  # {Task => id of its current heap entry}
+        self._stale = set()  # ready tasks without a current heap entry
+        self._ids = itertools.count()
+        context.recomputation.register('ready', self._recompute)
+        
+    def __len__(self):
+        return len(self._ready)
+    
+    def __contains__(self, task):
+        return task in self._ready
+    
+    def __iter__(self):
+        '''
+        Iterate over ready tasks, in no particular order
+        '''
+        return iter(self._ready)
+    
+    def top(self, n):
+        '''
+        Get the ready tasks with least slack
+        
+        Parameters
+        ----------
+        n : int
+            Maximum number of tasks to return
+        
+        Returns
+        -------
+        [Task]
+            Least slack first
+        '''
+        self._refresh()
+        top = []
+        popped = []
+        while self._heap and len(top) < n:
+            entry = heapq.heappop(self._heap)
+            if self._entries.get(entry[2]) == entry[1]:
+                top.append(entry[2])
+                popped.append(entry)
+        for entry in popped:
+            heapq.heappush(self._heap, entry)
+        return top
+    
+    def _refresh(self):
+        scheduler = self._context.scheduler
+        for task in self._stale:
+            id_ = next(self._ids)
+            self._entries[task] = id_
+            heapq.heappush(self._heap, ((scheduler.slack(task).total, task.planned_start), id_, task))
+        self._stale.clear()
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [entry for entry in self._heap if self._entries.get(entry[2]) == entry[1]]
+            heapq.heapify(self._heap)
+        
+    def _invalidate(self, *tasks):
+        '''
+        Recheck whether tasks and their leaf descendants are ready, at the end of the edit
+        '''
+        self._context.recomputation.mark_dirty('ready', *itertools.chain.from_iterable(
+            itertools.chain((task,), task._loaded_descendants) for task in tasks
+        ))
+        
+    def _invalidate_order(self, tasks=None):
+        '''
+        Reorder ready tasks on the next query, all of them if ``None``
+        '''
+        stale = self._ready if tasks is None else self._ready.intersection(tasks)
+        if stale:
+            for task in stale:
+                self._entries.pop(task, None)
+            self._stale.update(stale)
+            self._context.recomputation.emit(self, 'changed')
+        
+    def _recompute(self, tasks):
+        graph = self._context.task_dependency_graph
+        changed = False
+        for task in tasks:
+            ready = (
+                task.start_node in graph and task.parent and task.is_leaf and
+                task.planning_state == PlanningState.planned and
+                not task._has_unfinished_dependencies
+            )
+            if ready != (task in self._ready):
+                changed = True
+                if ready:
+                    self._ready.add(task)
+                    self._stale.add(task)
+                else:
+                    self._forget(task)
+        if changed:
+            self._context.recomputation.emit(self, 'changed')
+            
+    def _forget(self, task):
+        self._ready.discard(task)
+        self._entries.pop(task, None)
+        self._stale.discard(task)
@@ -0,0 +1,186 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+from contextlib import contextmanager
+from functools import wraps
+import heapq
+
+attributes = ('predicted_effort', 'planning_state', 'schedule', 'ready')
+'''
+Derived attributes, in the order they are recomputed in
+
+Each derives only from attributes before it (and from itself on other tasks).
+'''
+
+class Recomputation(object):
+    
+    '''
+    Recomputes derived task attributes once per edit
+    
+    When something a derived attribute of a task derives from changes, the
+    attribute is marked dirty instead of recomputed right away. When the
+    outermost `edit` ends, dirty attributes are recomputed in the order of
+    `attributes` and, for each attribute, in the order of its key (e.g. children
+    before their parents). This way, each dirty attribute of a task is
+    recomputed once per edit, after everything it derives from.
+    
+    Change signals of derived attributes are queued with `emit` and emitted
+    after recomputation, at most once per task and signal per edit.
+    
+    Marking attributes dirty outside of an edit recomputes them right away.
+    
+    Parameters
+    ----------
+    context : Context
+    '''
+    
+    def __init__(self, context):
+        self._context = context
+        self._recomputers = {}  # {attribute => (rank, key, recompute)}
+        self._dirty = {}  # {(rank, key, attribute) => {Task => None}}
+        self._heap = []  # [(rank, key, attribute)], keys of self._dirty
+        self._signals = {}  # {(Task, signal name) => None}
+        self._depth = 0  # number of edits in progress
+        self._edits = 0  # number of outermost edits started, identifies the current edit
+        self.register('planning_state', _recompute_planning_state, key=_depth_first)
+        
+    def register(self, attribute, recompute, key=None):
+        '''
+        Register how to recompute a derived attribute
+        
+        Parameters
+        ----------
+        attribute : str
+            One of `attributes`
+        recompute : (tasks :: [Task]) -> None
+            Recompute the attribute of each task. Tasks are passed in batches of
+            tasks with an equal key.
+        key : ((task :: Task) -> int) or None
+            Order in which to recompute tasks, lowest key first. If ``None``,
+            all dirty tasks are recomputed in a single batch.
+        '''
+        self._recomputers[attribute] = (attributes.index(attribute), key, recompute)
+        
+    @contextmanager
+    def edit(self):
+        '''
+        Context manager of an edit
+        
+        Edits may be nested, recomputation happens when the outermost edit
+        exits, even when it exits with an exception.
+        '''
+        self._depth += 1
+        if self._depth == 1:
+            self._edits += 1
+        try:
+            yield
+        finally:
+            if self._depth == 1:
+                try:
+                    self._flush()
+                finally:
+                    self._depth -= 1
+            else:
+                self._depth -= 1
+            
+    def mark_dirty(self, attribute, *tasks):
+        '''
+        Mark derived attribute of tasks dirty
+        
+        Parameters
+        ----------
+        attribute : str
+            One of `attributes`
+        tasks : Task
+        '''
+        rank, key, _ = self._recomputers[attribute]
+        with self.edit():
+            for task in tasks:
+                entry = (rank, key(task) if key else 0, attribute)
+                dirty = self._dirty.get(entry)
+                if dirty is None:
+                    dirty = self._dirty[entry] = {}
+                    heapq.heappush(self._heap, entry)
+                dirty[task] = None
+                
+    def emit(self, task, signal):
+        '''
+        Emit change signal of task when the current edit ends
+        
+        Parameters
+        ----------
+        task : Task
+            Or any other object with ``events``, e.g. `ReadyTasks`
+        signal : str
+            Name of signal of ``task.events``, it is emitted with ``task`` as argument
+        '''
+        with self.edit():
+            self._signals[task, signal] = None
+            
+    def _forget_all(self, tasks):
+        '''
+        Stop recomputing and signalling disposed tasks
+        
+        Takes time linear in the number of dirty entries and signals, call it
+        once for all tasks disposed of together.
+        
+        Parameters
+        ----------
+        tasks : {Task}
+        '''
+        for dirty in self._dirty.values():
+            for task in [task for task in dirty if task in tasks]:
+                del dirty[task]
+        self._signals = {key: None for key in self._signals if key[0] not in tasks}
+        
+    def _flush(self):
+        while self._heap or self._signals:
+            while self._heap:
+                entry = heapq.heappop(self._heap)
+                tasks = list(self._dirty.pop(entry))
+                if tasks:
+                    self._recomputers[entry[2]][2](tasks)
+            signals = self._signals
+            self._signals = {}
+            for task, signal in signals:
+                signal = getattr(task.events, signal, None)  # the signal may belong to a former state of the task
+                if signal:
+                    signal.emit(task)  # handlers may edit, any recomputation they cause is flushed in the next iteration
+                    
+def edit(method):
+    '''
+    Decorate method to run it as a single edit, see `Recomputation`
+    
+    The object the method is called on must have a ``_context``.
+    '''
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._context.recomputation.edit():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def _depth_first(task):
+    depth = 0
+    while task.parent:
+        task = task.parent
+        depth += 1
+    return -depth
+
+def _recompute_planning_state(tasks):
+    for task in tasks:
+        if not task.is_leaf:
+            task._update_planning_state()
@@ -0,0 +1,488 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+from chicken_turtle_util.exceptions import InvalidOperationError
+from collections import ChainMap
+from datetime import timedelta
+from ._common import PlanningState, EstimateType
+from ._scheduler import Scheduler
+import networkx as nx
+
+class Sandbox(object):
+    
+    '''
+    What-if sandbox: a copy-on-write overlay of the task tree and dependency graph
+    
+    Edits made through the sandbox are recorded as deltas, they do not touch the
+    tasks of the context. Queries return the sandbox's version of a task's
+    attribute, reading through to the context when the sandbox did not change
+    it. The schedule too is only recomputed in the sandbox for the downstream
+    cone of its edits, the other times are read from the context's schedule.
+    
+    Creating a sandbox takes constant time, discarding one is dropping the
+    reference to it. `commit` applies its edits to the context in a single edit.
+    
+    Supported edits are moving tasks, editing effort estimates, durations and
+    planned start overrides, and adding and removing dependencies. The planning
+    state of branch tasks is not rederived in the sandbox.
+    
+    Parameters
+    ----------
+    context : Context
+    '''
+    
+    def __init__(self, context):
+        self._context = context
+        self._graph = _OverlayGraph(context.task_dependency_graph)
+        self._parents = {}  # {Task => Task}
+        self._children = {}  # {Task => [Task]}
+        self._became_leaf = set()  # branch tasks which lost their children, i.e. new effort tasks
+        self._effort_estimates = {}  # {Task => {EstimateType => datetime.timedelta or None}}
+        self._durations = {}  # {Task => datetime.timedelta or None}
+        self._planned_start_overrides = {}  # {Task => datetime.datetime or None}
+        self._deltas = []  # [(str, tuple)], name of the edit and its arguments, in the order made
+        self._scheduler = _SandboxScheduler(self, context.scheduler)
+        self._committed = False
+        
+    @property
+    def task_dependency_graph(self):
+        '''
+        Get overlay of the dependency graph
+        
+        Supports the read-only part of the networkx DiGraph API used by
+        `Scheduler`: ``graph[node]``, ``graph.pred[node]``, ``successors``,
+        ``predecessors``, ``has_edge``, ``subgraph`` and iteration over nodes.
+        '''
+        return self._graph
+    
+    @property
+    def edit_count(self):
+        '''
+        Get number of edits made in the sandbox
+        '''
+        return len(self._deltas)
+    
+    def parent(self, task):
+        if task in self._parents:
+            return self._parents[task]
+        return task.parent
+    
+    def children(self, task):
+        if task in self._children:
+            return tuple(self._children[task])
+        return task.children
+    
+    def is_leaf(self, task):
+        return not task._is_root and not task.is_archived and not self.children(task)
+    
+    def delegated(self, task):
+        return self.is_leaf(task) and task not in self._became_leaf and task.delegated
+    
+    def effort_estimates(self, task):
+        '''
+        Get effort estimates of effort task
+        
+        Returns
+        -------
+        {EstimateType => datetime.timedelta or None}
+        '''
+        if task in self._effort_estimates:
+            return dict(self._effort_estimates[task])
+        elif task in self._became_leaf or not task.is_leaf or task.delegated:
+            return {x: None for x in EstimateType}
+        else:
+            return {x: task.effort_estimates[x] for x in EstimateType}
+        
+    def predicted_effort(self, task):
+        '''
+        Get predicted effort of effort task, see `Task.predicted_effort`
+        '''
+        if not self.is_leaf(task) or self.delegated(task):
+            return None
+        elif task in self._effort_estimates or task in self._became_leaf:
+            return self._context.estimate_calibration.predict(self.effort_estimates(task))
+        else:
+            return task.predicted_effort
+        
+    def duration(self, task):
+        '''
+        Get duration of delegated task
+        '''
+        if not self.delegated(task):
+            return None
+        return self._durations.get(task, task.duration)
+    
+    def planned_start_override(self, task):
+        if task in self._planned_start_overrides:
+            return self._planned_start_overrides[task]
+        return task.planned_start_override
+    
+    def planned_start(self, task):
+        return self._scheduler._planned[task.start_node]
+    
+    def planned_end(self, task):
+        return self._scheduler._planned[task.end_node]
+    
+    def predicted_start(self, task):
+        return self._scheduler._predicted[task.start_node]
+    
+    def predicted_end(self, task):
+        return self._scheduler._predicted[task.end_node]
+    
+    def slack(self, task):
+        '''
+        Get slack of task, see `Task.slack`
+        '''
+        return self._scheduler.slack(task)
+    
+    def critical_path(self):
+        '''
+        Get critical path, see `Context.critical_path`
+        '''
+        return self._scheduler.critical_path()
+    
+    def move(self, task, parent, index):
+        '''
+        Move task, see `Task.move`
+        '''
+        self._check_not_committed()
+        if task._is_root:
+            raise InvalidOperationError('Cannot move the root task')
+        if parent is task:
+            raise ValueError('Cannot move task to itself')
+        ancestor = parent
+        while ancestor:
+            if ancestor is task:
+                raise ValueError('Cannot move task to one of its descendants')
+            ancestor = self.parent(ancestor)
+        if self.is_leaf(parent):
+            if parent.planning_state == PlanningState.finished:
+                raise InvalidOperationError('Cannot insert children into finished task')
+            if self.delegated(parent):
+                raise InvalidOperationError('Cannot add child tasks to a delegated task')
+            if parent not in self._became_leaf and parent.actual_effort:
+                raise InvalidOperationError('Leaf task with effort spent on it cannot become a branch task')
+        old_parent = self.parent(task)
+        old_index = self.children(old_parent).index(task)
+        self._move(task, parent, index)
+        if self._graph.has_path(parent.start_node, task.start_node) or self._graph.has_path(task.end_node, parent.end_node):
+            self._move(task, old_parent, old_index)  # rollback
+            raise ValueError("Moving to '{}' would cause a dependency cycle".format(parent.name))
+        self._deltas.append(('move', (task, parent, index)))
+        self._scheduler._invalidate(task, old_parent, parent)
+        
+    def _move(self, task, parent, index):
+        graph = self._graph
+        
+        # Remove from old parent
+        old_parent = self.parent(task)
+        children = list(self.children(old_parent))
+        children.remove(task)
+        self._children[old_parent] = children
+        graph.remove_edge(task.start_node, old_parent.start_node)
+        graph.remove_edge(old_parent.end_node, task.end_node)
+        if not children and not old_parent._is_root:
+            graph.add_edge(old_parent.end_node, old_parent.start_node, {'active': True})
+            self._became_leaf.add(old_parent)
+            
+        # Insert into new parent
+        children = list(self.children(parent))
+        if self.is_leaf(parent):
+            graph.remove_edge(parent.end_node, parent.start_node)
+            self._became_leaf.discard(parent)
+        children.insert(index, task)
+        self._children[parent] = children
+        self._parents[task] = parent
+        graph.add_edge(task.start_node, parent.start_node, {'active': True})
+        graph.add_edge(parent.end_node, task.end_node, {'active': task.is_active})
+        
+    def set_effort_estimate(self, task, estimate_type, value):
+        '''
+        Set effort estimate of effort task, see `Task.effort_estimates`
+        
+        Parameters
+        ----------
+        task : Task
+        estimate_type : EstimateType
+        value : datetime.timedelta or None
+        '''
+        self._check_not_committed()
+        if not self.is_leaf(task) or self.delegated(task):
+            raise InvalidOperationError('Only effort tasks have effort estimates')
+        if task.planning_state == PlanningState.finished:
+            raise InvalidOperationError('Cannot edit effort estimates on finished task')
+        if value is not None and value <= timedelta():
+            raise ValueError('Effort estimate must be > timedelta(0)')
+        estimates = self.effort_estimates(task)
+        estimates[estimate_type] = value
+        self._effort_estimates[task] = estimates
+        self._deltas.append(('effort_estimate', (task, estimate_type, value)))
+        self._scheduler._invalidate(task)
+        
+    def set_duration(self, task, value):
+        '''
+        Set duration of delegated task, see `Task.duration`
+        '''
+        self._check_not_committed()
+        if not self.delegated(task):
+            raise InvalidOperationError('Only delegated tasks have a duration')
+        if task.planning_state == PlanningState.finished:
+            raise InvalidOperationError('Cannot change duration on finished task')
+        self._durations[task] = value
+        self._deltas.append(('duration', (task, value)))
+        self._scheduler._invalidate(task)
+        
+    def set_planned_start_override(self, task, value):
+        '''
+        Set planned start override, see `Task.planned_start_override`
+        '''
+        self._check_not_committed()
+        if value is not None:
+            value = value.replace(second=0, microsecond=0)
+        self._planned_start_overrides[task] = value
+        self._deltas.append(('planned_start_override', (task, value)))
+        self._scheduler._invalidate(task)
+        
+    def add_dependency(self, task, dependency):
+        '''
+        Make task depend on another, see `Task.add_dependency`
+        '''
+        self._check_not_committed()
+        if task.planning_state == PlanningState.finished:
+            raise InvalidOperationError('Cannot add dependency to finished task')
+        if self._graph.has_path(dependency.end_node, task.start_node):
+            raise ValueError("Depending on '{}' would cause a dependency cycle".format(dependency.name))
+        self._graph.add_edge(task.start_node, dependency.end_node, {'active': True})
+        self._deltas.append(('add_dependency', (task, dependency)))
+        self._scheduler._invalidate(task)
+        
+    def remove_dependency(self, task, dependency):
+        '''
+        Remove dependency, see `Task.remove_dependency`
+        '''
+        self._check_not_committed()
+        if task.planning_state == PlanningState.finished:
+            raise InvalidOperationError('Cannot remove dependency from finished task')
+        if not self._graph.has_edge(task.start_node, dependency.end_node):
+            raise ValueError("'{}' does not depend on '{}'".format(task.name, dependency.name))
+        self._graph.remove_edge(task.start_node, dependency.end_node)
+        self._deltas.append(('remove_dependency', (task, dependency)))
+        self._scheduler._invalidate(task, dependency)
+        
+    def commit(self):
+        '''
+        Apply the edits of the sandbox to the context, as a single edit
+        
+        Edits are validated anew, against the current state of the context. If
+        any fails, the edits applied so far are undone and the exception is
+        raised. Once committed, the sandbox can no longer be used.
+        '''
+        self._check_not_committed()
+        undo = []
+        with self._context.recomputation.edit():
+            try:
+                for name, args in self._deltas:
+                    undo.append(getattr(self, '_apply_' + name)(*args))
+            except Exception:
+                for undo_ in reversed(undo):
+                    undo_()
+                raise
+        self._committed = True
+        
+    def _check_not_committed(self):
+        if self._committed:
+            raise InvalidOperationError('Sandbox has already been committed')
+        
+    # Apply a delta to the context, returning a function which undoes it
+    
+    def _apply_move(self, task, parent, index):
+        old_parent = task.parent
+        old_index = old_parent.children.index(task)
+        task.move(parent, index)
+        return lambda: task.move(old_parent, old_index)
+    
+    def _apply_effort_estimate(self, task, estimate_type, value):
+        old = task.effort_estimates[estimate_type]
+        task.effort_estimates[estimate_type] = value
+        return lambda: task.effort_estimates.__setitem__(estimate_type, old)
+    
+    def _apply_duration(self, task, value):
+        old = task.duration
+        task.duration = value
+        return lambda: setattr(task, 'duration', old)
+    
+    def _apply_planned_start_override(self, task, value):
+        old = task.planned_start_override
+        task.planned_start_override = value
+        return lambda: setattr(task, 'planned_start_override', old)
+    
+    def _apply_add_dependency(self, task, dependency):
+        task.add_dependency(dependency)
+        return lambda: task.remove_dependency(dependency)
+    
+    def _apply_remove_dependency(self, task, dependency):
+        task.remove_dependency(dependency)
+        return lambda: task.add_dependency(dependency)
+    
+class _SandboxScheduler(Scheduler):
+    
+    '''
+    Schedule of a sandbox
+    
+    Times of nodes outside the downstream cone of the sandbox's edits are read
+    from the base scheduler.
+    '''
+    
+    def __init__(self, sandbox, base):  # not calling super, the context's recomputation is not ours
+        self._context = base._context
+        self._sandbox = sandbox
+        self._project_start = base.project_start
+        self._planned = ChainMap({}, base._planned)
+        self._predicted = ChainMap({}, base._predicted)
+        self._latest = {}
+        self._slack = {}
+        self._critical_path = None
+        self._root_end = base._root_end
+        
+    @property
+    def _graph(self):
+        return self._sandbox.task_dependency_graph
+    
+    def _invalidate(self, *tasks):
+        self._update([node for task in tasks for node in (task.start_node, task.end_node)])
+        
+    def _update(self, nodes):
+        self._forward(self._downstream_cone(nodes))
+        self._latest.clear()
+        self._slack.clear()
+        self._critical_path = None
+        
+    def _is_leaf(self, task):
+        return self._sandbox.is_leaf(task)
+    
+    def _is_delegated(self, task):
+        return self._sandbox.delegated(task)
+    
+    def _duration(self, task):
+        return self._sandbox.duration(task)
+    
+    def _predicted_effort(self, task):
+        return self._sandbox.predicted_effort(task)
+    
+    def _planned_start_override(self, task):
+        return self._sandbox.planned_start_override(task)
+    
+    def _effort_spent(self, task):
+        return () if task in self._sandbox._became_leaf else task.effort_spent
+    
+    def _actual_effort(self, task):
+        return timedelta() if task in self._sandbox._became_leaf else task.actual_effort
+    
+class _OverlayGraph(object):
+    
+    '''
+    Copy-on-write view of a directed graph with edges added and removed
+    
+    Nodes cannot be added or removed.
+    '''
+    
+    def __init__(self, base):
+        self._base = base
+        self._added = {}  # {u => {v => attributes}}
+        self._added_pred = {}  # {v => {u => attributes}}
+        self._removed = set()  # {(u, v)}, edges of base
+        self.pred = _OverlayPred(self)
+        
+    def __contains__(self, node):
+        return node in self._base
+    
+    def __iter__(self):
+        return iter(self._base)
+    
+    def __len__(self):
+        return len(self._base)
+    
+    def nodes(self):
+        return list(self._base)
+    
+    def __getitem__(self, u):
+        successors = {v: attributes for v, attributes in self._base[u].items() if (u, v) not in self._removed}
+        successors.update(self._added.get(u, {}))
+        return successors
+    
+    def _predecessors(self, v):
+        predecessors = {u: attributes for u, attributes in self._base.pred[v].items() if (u, v) not in self._removed}
+        predecessors.update(self._added_pred.get(v, {}))
+        return predecessors
+    
+    def successors(self, u):
+        return list(self[u])
+    
+    def predecessors(self, v):
+        return list(self._predecessors(v))
+    
+    def has_edge(self, u, v):
+        return v in self._added.get(u, ()) or (self._base.has_edge(u, v) and (u, v) not in self._removed)
+    
+    def add_edge(self, u, v, attributes):
+        if self._base.has_edge(u, v):
+            if (u, v) in self._removed and self._base[u][v] == attributes:
+                self._removed.discard((u, v))  # restore the base edge
+                return
+            self._removed.add((u, v))  # shadow the base edge
+        self._added.setdefault(u, {})[v] = attributes
+        self._added_pred.setdefault(v, {})[u] = attributes
+        
+    def remove_edge(self, u, v):
+        if v in self._added.get(u, ()):
+            del self._added[u][v]
+            del self._added_pred[v][u]
+        elif self._base.has_edge(u, v) and (u, v) not in self._removed:
+            self._removed.add((u, v))
+        else:
+            raise ValueError('Edge not in graph: {} -> {}'.format(u, v))
+        
+    def has_path(self, source, target):
+        seen = {source}
+        stack = [source]
+        while stack:
+            node = stack.pop()
+            if node == target:
+                return True
+            for successor in self[node]:
+                if successor not in seen:
+                    seen.add(successor)
+                    stack.append(successor)
+        return False
+    
+    def subgraph(self, nodes):
+        '''
+        Get subgraph induced by nodes, as a networkx DiGraph without edge attributes
+        '''
+        nodes = set(nodes)
+        graph = nx.DiGraph()
+        graph.add_nodes_from(nodes)
+        graph.add_edges_from((u, v) for u in nodes for v in self[u] if v in nodes)
+        return graph
+    
+class _OverlayPred(object):
+    
+    def __init__(self, graph):
+        self._graph = graph
+        
+    def __getitem__(self, v):
+        return self._graph._predecessors(v)
@@ -0,0 +1,404 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime, timedelta
+from collections import namedtuple
+from ._common import PlanningState, TaskNodeType
+import networkx as nx
+
+Slack = namedtuple('Slack', 'total free')
+Slack.__doc__ = '''
+Time by which a task can be delayed, in working time
+
+Attributes
+----------
+total : datetime.timedelta
+    Delay without delaying the end of the project
+free : datetime.timedelta
+    Delay without delaying any task depending on it
+'''
+
+class Scheduler(object):
+    
+    '''
+    Critical path method (CPM) scheduler of the task dependency graph
+    
+    Computes the earliest start and end of each task in a forward pass over the
+    dependency graph in topological order, using the predicted effort of effort
+    tasks and the duration of delegated tasks. Tasks which do not depend on each
+    other are scheduled in parallel. Inactive dependencies and inactive tasks
+    take no time. Effort is worked in the working hours of the context's
+    calendar, see `WorkingCalendar`; the duration of delegated tasks is not.
+    
+    Two schedules are kept:
+    
+    planned
+        From the project start, using the full predicted effort of each task.
+    predicted
+        From now, using the remaining effort of each task (predicted effort
+        minus actual effort). Finished effort tasks keep the start and end of
+        the effort spent on them.
+    
+    Edits invalidate the tasks they affect and only the nodes which (perhaps
+    indirectly) depend on those are recomputed, i.e. the downstream cone of the
+    edit. This happens once per edit, see `Recomputation`.
+    
+    The slack of tasks in the planned schedule follows from a backward pass
+    from the planned end of the project, computing the latest time of each node.
+    It is computed on demand and cached. Edits only drop the latest times of the
+    upstream cone of the edit, unless the end of the project moves.
+    
+    Parameters
+    ----------
+    context : Context
+    '''
+    
+    def __init__(self, context):
+        self._context = context
+        self._project_start = datetime.now().replace(second=0, microsecond=0)
+        self._planned = {}  # {node => datetime}
+        self._predicted = {}  # {node => datetime}
+        self._latest = {}  # {node => datetime}, latest time in the planned schedule
+        self._slack = {}  # {Task => Slack}
+        self._critical_path = None
+        self._root_end = None  # end node of the root task
+        context.recomputation.register('schedule', self._recompute)
+        
+    @property
+    def project_start(self):
+        '''
+        Start of the planned schedule, unless overridden on the root task
+        
+        Returns
+        -------
+        datetime.datetime
+        '''
+        return self._project_start
+    
+    @project_start.setter
+    def project_start(self, value):
+        old = self._project_start
+        with self._context.recomputation.edit():
+            self._set_project_start(value)
+            if self._project_start != old:
+                self._context.changes._record('project_start', None, self._project_start, old=(old,))
+                
+    def _set_project_start(self, value):
+        '''
+        Set project start without recording a change, e.g. when loading
+        '''
+        self._project_start = value.replace(second=0, microsecond=0)
+        self.reschedule()
+        
+    def reschedule(self):
+        '''
+        Recompute the whole schedule
+        
+        E.g. to move the predicted schedule along with the current time.
+        '''
+        with self._context.recomputation.edit():
+            self._update(self._graph.nodes())
+        
+    @property
+    def _graph(self):
+        return self._context.task_dependency_graph
+    
+    def _invalidate(self, *tasks):
+        '''
+        Recompute the schedule of tasks and their dependers, at the end of the edit
+        '''
+        self._context.recomputation.mark_dirty('schedule', *tasks)
+        
+    def _recompute(self, tasks):
+        self._update([node for task in tasks for node in (task.start_node, task.end_node)])
+        
+    def slack(self, task):
+        '''
+        Get slack of task in the planned schedule
+        
+        Parameters
+        ----------
+        task : Task
+        
+        Returns
+        -------
+        Slack
+        '''
+        slack = self._slack.get(task)
+        if slack is None:
+            calendar = self._context.calendar
+            end_node = task.end_node
+            end = self._planned[end_node]
+            total = calendar.working_time(end, self._latest_time(end_node))
+            free = None
+            for depender, attributes in self._graph.pred[end_node].items():
+                if attributes.get('active', True):
+                    free_ = calendar.working_time(end, self._planned[depender])
+                    if free is None or free_ < free:
+                        free = free_
+            if free is None:
+                free = calendar.working_time(end, self._planned[self._root_end])
+            slack = Slack(total, free)
+            self._slack[task] = slack
+        return slack
+    
+    def critical_path(self):
+        '''
+        Get tasks on the critical path of the planned schedule
+        
+        Returns
+        -------
+        [Task]
+            Active leaf tasks without total slack, ordered by planned start
+        '''
+        if self._critical_path is None:
+            tasks = [
+                task for task, node_type in self._graph
+                if node_type == TaskNodeType.end and self._is_leaf(task) and task.is_active and not self.slack(task).total
+            ]
+            tasks.sort(key=lambda task: self._planned[task.start_node])
+            self._critical_path = tasks
+        return list(self._critical_path)
+    
+    def _forget(self, task):
+        for node in (task.start_node, task.end_node):
+            self._planned.pop(node, None)
+            self._predicted.pop(node, None)
+            self._latest.pop(node, None)
+        self._slack.pop(task, None)
+        self._critical_path = None
+        
+    def _invalidate_slack(self, *tasks):
+        '''
+        Drop latest times and slack of tasks and their (indirect) dependencies
+        '''
+        graph = self._graph
+        cone = {node for task in tasks for node in (task.start_node, task.end_node) if node in graph}
+        stack = list(cone)
+        while stack:
+            for dependency in graph.successors(stack.pop()):
+                if dependency not in cone:
+                    cone.add(dependency)
+                    stack.append(dependency)
+        for node in cone:
+            self._latest.pop(node, None)
+        self._drop_slack({node[0] for node in cone})
+        
+    def _drop_slack(self, tasks):
+        for task in tasks:
+            self._slack.pop(task, None)
+        self._critical_path = None
+        self._context.ready_tasks._invalidate_order(tasks)
+        
+
+    def _update(self, nodes):
+        graph = self._graph
+        cone = self._downstream_cone(nodes)
+        if not cone:
+            return
+        changed = self._forward(cone)
+        
+        # Invalidate slack
+        if self._root_end is None:
+            self._root_end = next((node for node in cone if node[0]._is_root and node[1] == TaskNodeType.end), None)
+        if (self._root_end, 'planned') in changed:
+            self._latest.clear()
+            self._slack.clear()
+            self._critical_path = None
+            self._context.ready_tasks._invalidate_order()
+        else:
+            self._invalidate_slack(*{node[0] for node in nodes if node in graph})
+            dropped = set()
+            for node, schedule in changed:
+                if schedule == 'planned':
+                    dropped.add(node[0])  # total slack, free slack of task and its dependencies
+                    dropped.update(dependency[0] for dependency in graph.successors(node))
+            self._drop_slack(dropped)
+        
+        # Notify
+        recomputation = self._context.recomputation
+        for (task, node_type), schedule in changed:
+            recomputation.emit(task, '{}_{}_changed'.format(schedule, node_type.value))
+                
+    def _downstream_cone(self, nodes):
+        '''
+        Get nodes and all nodes (perhaps indirectly) depending on them
+        '''
+        graph = self._graph
+        cone = {node for node in nodes if node in graph}
+        stack = list(cone)
+        while stack:
+            for depender in graph.predecessors(stack.pop()):
+                if depender not in cone:
+                    cone.add(depender)
+                    stack.append(depender)
+        return cone
+    
+    def _forward(self, cone):
+        '''
+        Recompute times of nodes, dependencies before their dependers
+        
+        Returns
+        -------
+        [(node, str)]
+            Changed times, as (node, 'planned' or 'predicted')
+        '''
+        now = datetime.now().replace(second=0, microsecond=0)
+        changed = []
+        for node in reversed(list(nx.topological_sort(self._graph.subgraph(cone)))):
+            planned = self._planned_time(node)
+            predicted = self._predicted_time(node, now)
+            if self._planned.get(node) != planned:
+                self._planned[node] = planned
+                changed.append((node, 'planned'))
+            if self._predicted.get(node) != predicted:
+                self._predicted[node] = predicted
+                changed.append((node, 'predicted'))
+        return changed
+    
+    def _planned_time(self, node):
+        task = node[0]
+        return self._time(node, self._planned, self._planned_duration(task), self._project_start)
+    
+    def _predicted_time(self, node, now):
+        task, node_type = node
+        is_leaf = self._is_leaf(task)
+        if is_leaf and not self._is_delegated(task) and task.planning_state == PlanningState.finished:
+            effort_spent = self._effort_spent(task)
+            if effort_spent:
+                if node_type == TaskNodeType.start:
+                    return min(x.begin for x in effort_spent)
+                else:
+                    return max(x.end for x in effort_spent)
+        time = self._time(node, self._predicted, self._remaining_duration(task), now)
+        if is_leaf and node_type == TaskNodeType.start and task.planning_state != PlanningState.finished:
+            time = max(time, now)
+        return time
+    
+    def _time(self, node, times, duration, origin):
+        '''
+        Get earliest time of node
+        
+        Parameters
+        ----------
+        node : (Task, TaskNodeType)
+        times : {node => datetime.datetime}
+            Times of the dependencies of node
+        duration : datetime.timedelta
+            Duration of the node's task, if it is a leaf
+        origin : datetime.datetime
+            Time of nodes without dependencies
+        '''
+        task, node_type = node
+        time = None
+        for dependency, attributes in self._graph[node].items():
+            if not attributes.get('active', True):
+                continue
+            dependency_time = times[dependency]
+            if dependency == task.start_node:  # leaf end node depends on its start
+                if self._is_delegated(task):
+                    dependency_time += duration
+                else:
+                    dependency_time = self._context.calendar.add(dependency_time, duration)
+            if time is None or dependency_time > time:
+                time = dependency_time
+        if time is None:
+            time = origin
+        override = self._planned_start_override(task)
+        if node_type == TaskNodeType.start and override and override > time:
+            time = override
+        return time
+    
+    def _latest_time(self, node):
+        '''
+        Get latest time of node in the planned schedule
+        
+        I.e. the latest time at which the node can occur without delaying the
+        planned end of the project.
+        '''
+        if node in self._latest:
+            return self._latest[node]
+        graph = self._graph
+        
+        # Get the nodes depending on node of which the latest time is unknown
+        missing = {node}
+        stack = [node]
+        while stack:
+            for depender in graph.predecessors(stack.pop()):
+                if depender not in self._latest and depender not in missing:
+                    missing.add(depender)
+                    stack.append(depender)
+                    
+        # Backward pass, dependers before their dependencies
+        project_end = self._planned[self._root_end]
+        calendar = self._context.calendar
+        for node_ in nx.topological_sort(graph.subgraph(missing)):
+            task = node_[0]
+            time = None
+            for depender, attributes in graph.pred[node_].items():
+                if not attributes.get('active', True):
+                    continue
+                depender_time = self._latest[depender]
+                if depender == task.end_node:  # leaf start node is depended on by its end
+                    duration = self._planned_duration(task)
+                    if self._is_delegated(task):
+                        depender_time -= duration
+                    else:
+                        depender_time = calendar.add(depender_time, -duration)
+                if time is None or depender_time < time:
+                    time = depender_time
+            self._latest[node_] = project_end if time is None else time
+        return self._latest[node]
+    
+    def _planned_duration(self, task):
+        if not self._is_leaf(task) or not task.is_active:
+            return timedelta()
+        elif self._is_delegated(task):
+            return self._duration(task) or timedelta()
+        else:
+            return self._predicted_effort(task) or timedelta()
+        
+    def _remaining_duration(self, task):
+        if task.planning_state == PlanningState.finished:
+            return timedelta()
+        duration = self._planned_duration(task)
+        if self._is_leaf(task) and not self._is_delegated(task):
+            duration = max(duration - self._actual_effort(task), timedelta())
+        return duration
+    
+    # Task attributes the schedule derives from, overridden by `Sandbox`
+    
+    def _is_leaf(self, task):
+        return task.is_leaf
+    
+    def _is_delegated(self, task):
+        return task.delegated
+    
+    def _duration(self, task):
+        return task.duration
+    
+    def _predicted_effort(self, task):
+        return task.predicted_effort
+    
+    def _effort_spent(self, task):
+        return task.effort_spent
+    
+    def _actual_effort(self, task):
+        return task.actual_effort
+    
+    def _planned_start_override(self, task):
+        return task.planned_start_override
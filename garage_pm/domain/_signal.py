@@ -0,0 +1,97 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class Signal(object):
+    
+    '''
+    Signal which calls the functions connected to it when emitted
+    
+    A plain Python stand-in for ``pyqtSignal``, so that the domain needs no Qt.
+    Declare it on a class, each instance gets its own `BoundSignal`::
+    
+        class _Events(object):
+            changed = Signal(object)
+            
+        events = _Events()
+        events.changed.connect(print)
+        events.changed.emit(1)  # prints 1
+    
+    Unlike Qt signals, slots are called right away, in the emitting thread, and
+    a slot is connected at most once.
+    
+    Parameters
+    ----------
+    types : type
+        Types of the arguments it is emitted with, for documentation only
+    '''
+    
+    def __init__(self, *types):
+        self._types = types
+        self._attribute = '_signal_{}'.format(id(self))  # of instances, holding their BoundSignal
+        
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        signal = instance.__dict__.get(self._attribute)
+        if signal is None:
+            signal = instance.__dict__[self._attribute] = BoundSignal()
+        return signal
+    
+class BoundSignal(object):
+    
+    '''
+    Signal of an instance, see `Signal`
+    '''
+    
+    __slots__ = ('_slots',)
+    
+    def __init__(self):
+        self._slots = {}  # {slot => None}, in the order they were connected
+        
+    def connect(self, slot):
+        '''
+        Call slot on each emit, after the slots connected before it
+        
+        Connecting a slot which is already connected has no effect.
+        
+        Parameters
+        ----------
+        slot : callable
+        '''
+        self._slots[slot] = None
+        
+    def disconnect(self, slot):
+        '''
+        Stop calling slot
+        
+        Raises
+        ------
+        TypeError
+            If slot is not connected, like ``pyqtSignal.disconnect``
+        '''
+        try:
+            del self._slots[slot]
+        except KeyError:
+            raise TypeError('Slot is not connected: {!r}'.format(slot))
+        
+    def emit(self, *args):
+        '''
+        Call the connected slots with args
+        '''
+        for slot in tuple(self._slots):
+            slot(*args)
@@ -0,0 +1,407 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from threading import Lock
+from ._common import PlanningState, TaskNodeType, EstimateType
+from ._signal import Signal
+import multiprocessing
+import networkx as nx
+import numpy as np
+import os
+
+_minute = timedelta(minutes=1)
+
+def simulate(context, trials=1000, percentiles=(50, 80, 95), seed=None, executor=None):
+    '''
+    Monte Carlo simulation of the predicted schedule
+    
+    Samples the effort of each effort task with complete estimates from a
+    Beta-PERT distribution over its optimistic, likely and pessimistic estimate
+    and propagates finish times through the dependency graph, for all trials at
+    once. Otherwise tasks are scheduled as in the predicted schedule of
+    `Scheduler`: from now, using the remaining effort of each task, in the
+    working hours of the context's calendar.
+    
+    Parameters
+    ----------
+    context : Context
+    trials : int
+        Number of trials to simulate
+    percentiles : (number)
+        Percentiles of end dates to return
+    seed : int or None
+        Seed for the random number generator, for reproducible results
+    executor : concurrent.futures.Executor or None
+        If given, split the trials across its workers, see `simulate_async`.
+        Otherwise, simulate in the current process.
+    
+    Returns
+    -------
+    SimulationResult
+    '''
+    if executor:
+        return simulate_async(context, executor, trials, percentiles, seed).result()
+    snapshot, tasks = ScheduleSnapshot.from_context(context)
+    ends = _simulate_trials(snapshot, trials, seed)
+    return SimulationResult(context.calendar, snapshot.origin, tasks, percentiles, np.percentile(ends, percentiles, axis=1))
+
+def simulate_async(context, executor, trials=1000, percentiles=(50, 80, 95), seed=None, parts=None):
+    '''
+    Like `simulate`, but split trials across the workers of an executor
+    
+    The snapshot of the graph is taken in the calling thread, which should be
+    the thread owning the domain objects. Each part of the trials is then
+    simulated by a worker, which receives the snapshot once; the end times of
+    the parts are merged into percentiles when all have finished.
+    
+    Parameters
+    ----------
+    context : Context
+    executor : concurrent.futures.Executor
+        Typically a `concurrent.futures.ProcessPoolExecutor`
+    trials : int
+    percentiles : (number)
+    seed : int or None
+    parts : int or None
+        Number of parts to split trials in. Defaults to the number of CPUs.
+    
+    Returns
+    -------
+    concurrent.futures.Future
+        Future of the `SimulationResult`
+    '''
+    snapshot, tasks = ScheduleSnapshot.from_context(context)
+    parts = max(1, min(trials, parts or os.cpu_count() or 1))
+    part_trials = [trials // parts + (i < trials % parts) for i in range(parts)]
+    seeds = np.random.SeedSequence(seed).spawn(parts)
+    part_futures = [executor.submit(_simulate_trials, snapshot, trials_, seed_) for trials_, seed_ in zip(part_trials, seeds)]
+    
+    result = Future()
+    result.set_running_or_notify_cancel()
+    remaining = [len(part_futures)]
+    lock = Lock()
+    def on_part_done(part_future):
+        with lock:
+            remaining[0] -= 1
+            done = remaining[0] == 0
+        if not done:
+            return
+        try:
+            ends = np.concatenate([x.result() for x in part_futures], axis=1)
+            result.set_result(SimulationResult(context.calendar, snapshot.origin, tasks, percentiles, np.percentile(ends, percentiles, axis=1)))
+        except Exception as ex:
+            result.set_exception(ex)
+    for part_future in part_futures:
+        part_future.add_done_callback(on_part_done)
+    return result
+    
+class BackgroundSimulation(object):
+    
+    '''
+    Runs simulations in a pool of worker processes, off the calling thread
+    
+    The pool is started on first use. Results are delivered through the
+    `finished` and `failed` signals, emitted by `dispatch`.
+    
+    Parameters
+    ----------
+    context : Context
+    max_workers : int or None
+        Number of worker processes. Defaults to the number of CPUs.
+    dispatch : ((() -> None) -> None) or None
+        Calls the given function in the thread results should be delivered in,
+        e.g. by queueing it to the Qt event thread. Defaults to calling it right
+        away, in a worker thread of the pool.
+    '''
+    
+    finished = Signal(object)  # SimulationResult
+    failed = Signal(object)  # Exception
+    
+    def __init__(self, context, max_workers=None, dispatch=None):
+        self._context = context
+        self._dispatch = dispatch or _call
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+        
+    def start(self, trials=1000, percentiles=(50, 80, 95), seed=None):
+        '''
+        Start a simulation, see `simulate`
+        
+        Returns immediately after taking a snapshot of the graph.
+        
+        Returns
+        -------
+        concurrent.futures.Future
+            Future of the `SimulationResult`
+        '''
+        if not self._executor:
+            # spawn rather than fork, forking a process running Qt is unsafe
+            self._executor = ProcessPoolExecutor(self._max_workers, mp_context=multiprocessing.get_context('spawn'))
+        future = simulate_async(self._context, self._executor, trials, percentiles, seed, parts=self._max_workers)
+        future.add_done_callback(self._on_done)
+        return future
+    
+    def _on_done(self, future):
+        # Called in a worker thread of the executor
+        ex = future.exception()
+        if ex:
+            self._dispatch(partial(self.failed.emit, ex))
+        else:
+            self._dispatch(partial(self.finished.emit, future.result()))
+            
+    def shutdown(self):
+        '''
+        Stop the worker processes, waiting for running simulations to finish
+        '''
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+    
+def _call(function):
+    function()
+    
+class SimulationResult(object):
+    
+    '''
+    End date distributions of tasks, as simulated by `simulate`
+    '''
+    
+    def __init__(self, calendar, origin, tasks, percentiles, ends):
+        self._calendar = calendar
+        self._origin = origin  # working minutes
+        self._percentiles = tuple(percentiles)
+        self._rows = {task: i for i, task in enumerate(tasks)}
+        self._ends = ends  # percentiles x tasks, in working minutes since origin
+        
+    @property
+    def percentiles(self):
+        return self._percentiles
+    
+    def end(self, task):
+        '''
+        Get percentiles of the end date of a task
+        
+        Branch tasks end when all their descendants have ended.
+        
+        Parameters
+        ----------
+        task : Task
+        
+        Returns
+        -------
+        {number => datetime.datetime}
+            End date by percentile, e.g. ``result.end(task)[80]`` is the date by
+            which the task has finished in 80% of the trials.
+        '''
+        row = self._rows[task]
+        return {
+            percentile: self._calendar.from_working_minutes(self._origin + np.ceil(minutes))
+            for percentile, minutes in zip(self._percentiles, self._ends[:, row].tolist())
+        }
+    
+class ScheduleSnapshot(object):
+    
+    '''
+    Compact array representation of the dependency graph for simulation
+    
+    Contains no `Task` objects, so it is cheap to pickle. Nodes are ordered by
+    level: each node's dependencies are at a lower level. All times are in
+    working minutes (see `WorkingCalendar`) since `origin`.
+    
+    Attributes
+    ----------
+    origin : float
+        Now, in working minutes
+    level_bounds : np.array(int)
+        Nodes of level i are ``level_bounds[i]:level_bounds[i+1]``
+    dependency_pointers : np.array(int)
+    dependencies : np.array(int)
+        Active dependencies of node i are
+        ``dependencies[dependency_pointers[i]:dependency_pointers[i+1]]``
+    floors : np.array(float)
+        Earliest time of each node
+    duration_rows : np.array(int)
+        Row in the duration arrays of each leaf end node, -1 for other nodes
+    optimistic, likely, pessimistic : np.array(float)
+        Effort of each leaf, equal for fixed durations
+    actual : np.array(float)
+        Effort spent already, subtracted from the sampled effort
+    end_nodes : np.array(int)
+        End node of each task
+    '''
+    
+    @classmethod
+    def from_context(cls, context):
+        '''
+        Take snapshot of a context's dependency graph
+        
+        Returns
+        -------
+        (ScheduleSnapshot, [Task])
+            Snapshot and the task corresponding to each of its `end_nodes`
+        '''
+        self = cls()
+        graph = context.task_dependency_graph
+        calendar = context.calendar
+        now = datetime.now().replace(second=0, microsecond=0)
+        self.origin = calendar.to_working_minutes(now)
+        
+        def active_dependencies(node):
+            return [dependency for dependency, attributes in graph[node].items() if attributes.get('active', True)]
+        
+        # Order nodes by level
+        levels = {}
+        for node in reversed(list(nx.topological_sort(graph))):
+            levels[node] = 1 + max((levels[x] for x in active_dependencies(node)), default=-1)
+        nodes = sorted(levels, key=levels.get)
+        indices = {node: i for i, node in enumerate(nodes)}
+        level_counts = np.bincount(np.array([levels[node] for node in nodes], dtype=int))
+        self.level_bounds = np.concatenate(([0], np.cumsum(level_counts)))
+        
+        # Dependencies, floors and durations
+        pointers = [0]
+        dependencies = []
+        floors = np.full(len(nodes), -np.inf)
+        duration_rows = np.full(len(nodes), -1, dtype=int)
+        durations = []  # [(optimistic, likely, pessimistic, actual)]
+        for i, node in enumerate(nodes):
+            task, node_type = node
+            fixed = _fixed_time(task, node_type)
+            if fixed is not None:
+                floors[i] = calendar.to_working_minutes(fixed) - self.origin
+            else:
+                dependencies_ = active_dependencies(node)
+                dependencies.extend(indices[x] for x in dependencies_)
+                if not dependencies_:
+                    floors[i] = 0.0
+                if node_type == TaskNodeType.start:
+                    if task.is_leaf and task.planning_state != PlanningState.finished:
+                        floors[i] = max(floors[i], 0.0)
+                    if task.planned_start_override:
+                        floors[i] = max(floors[i], calendar.to_working_minutes(task.planned_start_override) - self.origin)
+                elif task.is_leaf:
+                    duration_rows[i] = len(durations)
+                    durations.append(_duration(task, calendar))
+            pointers.append(len(dependencies))
+        self.dependency_pointers = np.array(pointers, dtype=int)
+        self.dependencies = np.array(dependencies, dtype=int)
+        self.floors = floors
+        self.duration_rows = duration_rows
+        durations = np.array(durations, dtype=float).reshape(-1, 4)
+        self.optimistic, self.likely, self.pessimistic, self.actual = durations.T.copy()
+        
+        tasks = [task for task, node_type in nodes if node_type == TaskNodeType.end]
+        self.end_nodes = np.array([indices[task.end_node] for task in tasks], dtype=int)
+        return self, tasks
+    
+def _fixed_time(task, node_type):
+    '''
+    Get time of node which does not depend on the schedule, if any
+    '''
+    if task.is_leaf and not task.delegated and task.planning_state == PlanningState.finished and task.effort_spent:
+        if node_type == TaskNodeType.start:
+            return min(x.begin for x in task.effort_spent)
+        else:
+            return max(x.end for x in task.effort_spent)
+    return None
+    
+def _duration(task, calendar):
+    '''
+    Get (optimistic, likely, pessimistic, actual) effort of leaf task in working minutes
+    
+    The duration of a delegated task is not working time, it is converted to
+    working time from its predicted start.
+    '''
+    if not task.is_active or task.planning_state == PlanningState.finished:
+        return (0.0,) * 4
+    elif task.delegated:
+        start = task.predicted_start
+        duration = calendar.working_time(start, start + (task.duration or timedelta())) / _minute
+        return (duration,) * 3 + (0.0,)
+    else:
+        actual = task.actual_effort / _minute
+        estimates = [task.effort_estimates[x] for x in (EstimateType.optimistic, EstimateType.likely, EstimateType.pessimistic)]
+        if any(x is None for x in estimates):
+            effort = (task.predicted_effort or timedelta()) / _minute
+            return (effort,) * 3 + (actual,)
+        optimistic, likely, pessimistic = sorted(x / _minute for x in estimates)
+        return optimistic, likely, pessimistic, actual
+    
+def _sample_durations(snapshot, trials, rng):
+    '''
+    Sample remaining duration of each leaf from its Beta-PERT distribution
+    
+    Returns
+    -------
+    np.array
+        leaves x trials
+    '''
+    optimistic = snapshot.optimistic[:, np.newaxis]
+    likely = snapshot.likely[:, np.newaxis]
+    pessimistic = snapshot.pessimistic[:, np.newaxis]
+    span = pessimistic - optimistic
+    random = span[:, 0] > 0
+    durations = np.repeat(optimistic, trials, axis=1)
+    if random.any():
+        span_ = span[random]
+        alpha = 1 + 4 * (likely[random] - optimistic[random]) / span_
+        beta = 1 + 4 * (pessimistic[random] - likely[random]) / span_
+        durations[random] += span_ * rng.beta(alpha, beta, size=(int(random.sum()), trials))
+    durations -= snapshot.actual[:, np.newaxis]
+    return np.maximum(durations, 0, out=durations)
+    
+def _simulate_trials(snapshot, trials, seed=None, memory_budget=64 * 2**20):
+    '''
+    Simulate trials of a schedule snapshot
+    
+    Trials are simulated in chunks which fit in `memory_budget` bytes.
+    
+    Returns
+    -------
+    np.array(np.float32)
+        End time in working minutes since ``snapshot.origin`` of each end node
+        (rows) in each trial (columns)
+    '''
+    rng = np.random.default_rng(seed)
+    node_count = len(snapshot.floors)
+    ends = np.empty((len(snapshot.end_nodes), trials), dtype=np.float32)
+    chunk_size = max(1, min(trials, memory_budget // max(1, 4 * node_count)))
+    duration_rows = snapshot.duration_rows
+    pointers = snapshot.dependency_pointers
+    for chunk_start in range(0, trials, chunk_size):
+        chunk_trials = min(chunk_size, trials - chunk_start)
+        durations = _sample_durations(snapshot, chunk_trials, rng).astype(np.float32)
+        times = np.empty((node_count, chunk_trials), dtype=np.float32)
+        for level_begin, level_end in zip(snapshot.level_bounds[:-1], snapshot.level_bounds[1:]):
+            level_pointers = pointers[level_begin:level_end+1]
+            has_dependencies = level_pointers[1:] > level_pointers[:-1]
+            values = np.full((level_end - level_begin, chunk_trials), -np.inf, dtype=np.float32)
+            if has_dependencies.any():
+                gathered = times[snapshot.dependencies[level_pointers[0]:level_pointers[-1]]]
+                offsets = level_pointers[:-1][has_dependencies] - level_pointers[0]
+                values[has_dependencies] = np.maximum.reduceat(gathered, offsets, axis=0)
+            rows = duration_rows[level_begin:level_end]
+            has_duration = rows >= 0
+            if has_duration.any():
+                values[has_duration] += durations[rows[has_duration]]
+            np.maximum(values, snapshot.floors[level_begin:level_end, np.newaxis].astype(np.float32), out=values)
+            times[level_begin:level_end] = values
+        ends[:, chunk_start:chunk_start+chunk_trials] = times[snapshot.end_nodes]
+    return ends
@@ -0,0 +1,135 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from ._common import EstimateType
+
+class Subtree(object):
+    
+    '''
+    Copy of the subtree of a task as plain values
+    
+    It is added back in bulk with `restore`, e.g. to undo disposing the task.
+    Tasks are referred to by id, dependencies from and to tasks outside of the
+    subtree are included. Subtrees of archived tasks are loaded to copy them.
+    
+    Parameters
+    ----------
+    task : Task
+        Root of the subtree
+        
+    Attributes
+    ----------
+    tasks : [(int or None, dict)]
+        Per task, depth-first, the position of its parent in this list
+        (``None`` for the root of the subtree) and its
+        `TaskTreeBuilder.add_task` args
+    dependencies : [(int, int)]
+        Task id and dependency id of each dependency
+    '''
+    
+    def __init__(self, task):
+        tasks = [task]
+        tasks.extend(task.descendants)
+        positions = {task_: i for i, task_ in enumerate(tasks)}
+        self.tasks = [(positions.get(task_.parent), _record(task_)) for task_ in tasks]
+        self.tasks[0] = (None, self.tasks[0][1])
+        self.dependencies = [(task_.id, dependency.id) for task_ in tasks for dependency in task_.dependencies]
+        self.dependencies.extend(
+            (depender.id, task_.id)
+            for task_ in tasks
+            for depender in task_._dependers
+            if depender not in positions
+        )
+        
+    @classmethod
+    def _from_records(cls, tasks, dependencies):
+        '''
+        Create subtree from its `tasks` and `dependencies`, e.g. as stored
+        '''
+        subtree = cls.__new__(cls)
+        subtree.tasks = tasks
+        subtree.dependencies = dependencies
+        return subtree
+    
+    def __len__(self):
+        return len(self.tasks)
+    
+    def restore(self, parent, index):
+        '''
+        Add the subtree back in a single edit
+        
+        The tasks get their former ids. Dependencies are added without
+        validation, except for cycles. Tasks outside of the subtree which it
+        depends on, or which depend on it, must exist.
+        
+        Parameters
+        ----------
+        parent : Task
+        index : int
+            Position of the root of the subtree among the children of `parent`
+            
+        Returns
+        -------
+        Task
+            The root of the subtree
+            
+        Raises
+        ------
+        ValueError
+            If the dependencies would contain a cycle
+        '''
+        context = parent._context
+        with TaskTreeBuilder(context) as builder:
+            tasks = []
+            for parent_position, args in self.tasks:
+                if parent_position is None:
+                    task = builder.add_task(parent, index=index, **args)
+                else:
+                    task = builder.add_task(tasks[parent_position], **args)
+                tasks.append(task)
+            ids = {task.id: task for task in tasks}
+            def find(id_):
+                return ids[id_] if id_ in ids else context.changes._task(id_)
+            for task, dependency in self.dependencies:
+                builder.add_dependency(find(task), find(dependency))
+        context.changes._record('restore', tasks[0], parent, index, self)
+        return tasks[0]
+    
+def _record(task):
+    '''
+    Get the `TaskTreeBuilder.add_task` args to recreate a task with
+    '''
+    record = dict(
+        name=task.name,
+        description=task.description,
+        planning_state=task.planning_state,
+        planned_start_override=task.planned_start_override,
+        id_=task.id,
+    )
+    if task.is_leaf:
+        if task.delegated:
+            record.update(delegated=True, duration=task.duration)
+        else:
+            estimates = {x: task.effort_estimates[x] for x in EstimateType}
+            record.update(
+                effort_estimates={x: estimate for x, estimate in estimates.items() if estimate is not None},
+                effort_spent=tuple(task.effort_spent),
+            )
+    return record
+
+from ._builder import TaskTreeBuilder
@@ -25,19 +25,25 @@ class Task(object):
     Parameters
     ----------
     name : str
-    qt_parent : QObject
-        parent of self.events, do not confuse it with self.parent, the Task parent
+    context : Context
+    is_root : bool
+    load : callable or None
+        If set, the task is archived and loads its children with it, see
+        `ArchivedTaskState`
     '''
     
-    def __init__(self, name, context, is_root=False):
+    def __init__(self, name, context, is_root=False, load=None):
         self._common = TaskStateData(name, self, context, is_root)
         if is_root:
             self._state = BranchTaskState(self._common)
+        elif load:
+            self._become_archived_task(load)
         else:
             self._become_effort_task()
         
         # one time init (not to be repeated when changing state)
         self._dependency_graph.add_nodes_from([self.start_node, self.end_node])
+        context.scheduler._invalidate(self)
         
     def __getattr__(self, attr):
         return getattr(self._state, attr)
@@ -51,9 +57,13 @@ class Task(object):
     def _become_branch_task(self):
         self._state = BranchTaskState(self._common)
         self._dependency_graph.remove_edge(self.end_node, self.start_node)
+        self._context.scheduler._invalidate(self)
+        self._context.ready_tasks._invalidate(self)
         
     def __become_leaf_task(self):
         self._dependency_graph.add_edge(self.end_node, self.start_node, {'active': True})
+        self._context.scheduler._invalidate(self)
+        self._context.ready_tasks._invalidate(self)
         
     def _become_delegated_task(self):
         self._state = DelegatedTaskState(self._common)
@@ -63,10 +73,15 @@ class Task(object):
         self._state = EffortTaskState(self._common)
         self.__become_leaf_task()
         
+    def _become_archived_task(self, load):
+        self._state = ArchivedTaskState(self._common, load)
+        self.__become_leaf_task()  # in the schedule, its end follows its start like a leaf's
+        
     def __repr__(self):
         return 'Task({!r})'.format(self.name)
     
 from ._task_state import TaskStateData
 from ._effort_task_state import EffortTaskState
 from ._branch_task_state import BranchTaskState
+from ._archived_task_state import ArchivedTaskState
 from ._delegated_task_state import DelegatedTaskState
\ No newline at end of file
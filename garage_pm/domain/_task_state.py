@@ -17,34 +17,46 @@
 
 
 from chicken_turtle_util.exceptions import InvalidOperationError
-from PyQt5.QtCore import QObject, pyqtSignal
-from ._common import PlanningState, TaskNodeType, DependencyCycleError
+from ._common import PlanningState, TaskNodeType, DependencyCycleError, EstimateType
+from ._signal import Signal
 from ._task import Task
-import networkx as nx
+from ._recomputation import edit
+from ._subtree import Subtree
 
-class _Events(QObject):
-    
-    name_changed = pyqtSignal(Task)
-    description_changed = pyqtSignal(Task)
-    planning_state_changed = pyqtSignal(Task)
-    set_planning_state_validity_changed = pyqtSignal([Task, PlanningState])
-    
-    def __init__(self, task, parent=None):
-        super().__init__(parent)
+class _Events(object):
+    
+    name_changed = Signal(Task)
+    description_changed = Signal(Task)
+    planning_state_changed = Signal(Task)
+    planned_start_changed = Signal(Task)
+    planned_end_changed = Signal(Task)
+    predicted_start_changed = Signal(Task)
+    predicted_end_changed = Signal(Task)
+    set_planning_state_validity_changed = Signal(Task, PlanningState)
+    
+    def __init__(self, task):
         self._task = task
         
     def __getattr__(self, attr):
         return getattr(self._task._state._events, attr)
 
+class _NoEvents(object):
+    
+    '''
+    Events specific to a state, of a state which has none
+    '''
+    
 class TaskStateData(object):
     
     def __init__(self, name, task, context, is_root):
         self.context = context
-        self.events = _Events(task, context.qt_parent)
+        self.events = _Events(task)
         self.task = task
+        self.id = context.changes._new_id(task, is_root)
         self.name = name
         self.description = ''
         self.parent = None
+        self.planned_start_override = None
         if is_root:
             self.planning_state = PlanningState.finished
         else:
@@ -55,7 +67,7 @@ class TaskState(object):
     
     def __init__(self, task_state_data):
         self._common = task_state_data
-        self._events = QObject(self._context.qt_parent)
+        self._events = _NoEvents()
     
     @property
     def _is_root(self):
@@ -110,6 +122,18 @@ class TaskState(object):
     @property
     def events(self):
         return self._common.events
+    
+    @property
+    def id(self):
+        '''
+        Get id, unique within the project and kept when saved
+        
+        Returns
+        -------
+        int
+            0 for the root task
+        '''
+        return self._common.id
             
     @property
     def name(self):
@@ -117,9 +141,11 @@ class TaskState(object):
     
     @name.setter
     def name(self, value):
-        if self._common.name != value:
+        old = self._common.name
+        if old != value:
             self._common.name = value
             self.events.name_changed.emit(self._task)
+            self._context.changes._record('name', self._task, value, old=(old,))
             
     @property
     def description(self):
@@ -127,9 +153,91 @@ class TaskState(object):
     
     @description.setter
     def description(self, value):
-        if self._common.description != value:
+        old = self._common.description
+        if old != value:
             self._common.description = value
             self.events.description_changed.emit(self._task)
+            self._context.changes._record('description', self._task, value, old=(old,))
+        
+    @property
+    def planned_start(self):
+        '''
+        Get planned start, according to the planned schedule
+        
+        See `Scheduler`.
+        
+        Returns
+        -------
+        datetime.datetime
+        '''
+        return self._context.scheduler._planned[self.start_node]
+    
+    @property
+    def planned_end(self):
+        '''
+        Get planned end, according to the planned schedule
+        
+        Returns
+        -------
+        datetime.datetime
+        '''
+        return self._context.scheduler._planned[self.end_node]
+    
+    @property
+    def predicted_start(self):
+        '''
+        Get predicted start, according to the predicted schedule
+        
+        Returns
+        -------
+        datetime.datetime
+        '''
+        return self._context.scheduler._predicted[self.start_node]
+    
+    @property
+    def predicted_end(self):
+        '''
+        Get predicted end, according to the predicted schedule
+        
+        Returns
+        -------
+        datetime.datetime
+        '''
+        return self._context.scheduler._predicted[self.end_node]
+    
+    @property
+    def slack(self):
+        '''
+        Get total and free slack, according to the planned schedule
+        
+        Returns
+        -------
+        Slack
+        '''
+        return self._context.scheduler.slack(self._task)
+    
+    @property
+    def planned_start_override(self):
+        '''
+        Get datetime before which the task may not be scheduled to start
+        
+        Returns
+        -------
+        datetime.datetime or None
+            ``None`` if not overridden
+        '''
+        return self._common.planned_start_override
+    
+    @planned_start_override.setter
+    @edit
+    def planned_start_override(self, value):
+        if value is not None:
+            value = value.replace(second=0, microsecond=0)
+        old = self._common.planned_start_override
+        if old != value:
+            self._common.planned_start_override = value
+            self._context.scheduler._invalidate(self._task)
+            self._context.changes._record('planned_start_override', self._task, value, old=(old,))
         
     @property
     def is_active(self):
@@ -139,6 +247,7 @@ class TaskState(object):
     def parent(self):
         return self._parent
     
+    @edit
     def append_new_task(self, name='Task'):
         '''
         Insert new task after current.
@@ -157,13 +266,15 @@ class TaskState(object):
                     self._insert_child(len(self.children), task)
                 else:
                     self.parent._insert_child(self.parent.children.index(self._task)+1, task)
-                return task
             except ValueError as ex:
                 raise InvalidOperationError(*ex.args)
         except Exception:
-            task.dispose()
+            task._dispose()
             raise
+        self._context.changes._record('new', task, self._task, name)
+        return task
     
+    @edit
     def move(self, parent, index):
         '''
         Move task from current parent to new one and insert at given index
@@ -197,29 +308,125 @@ class TaskState(object):
         except Exception:
             old_parent._insert_child(old_index, self._task)  # rollback
             raise
+        self._context.changes._record('move', self._task, parent, index, old_parent, old_index)
     
+    @edit
     def dispose(self):
         '''
         Remove task from the task tree.
         
-        If the task has children, they are disposed as well.
+        If the task has children, they are disposed as well. If time is being
+        tracked on any of them, tracking stops without adding effort.
         
         Once disposed, a task should no longer be used.
         '''
         if self._is_root:
             raise InvalidOperationError('Cannot dispose the root task')
+        parent = self.parent
+        index = parent.children.index(self._task)
+        subtree = Subtree(self._task)
+        self._task._dispose()  # copying the subtree loads an archived task, changing its state
+        self._context.changes._record('dispose', self._task, parent, index, old=(subtree,))
         
-        # dispose children
-        for child in self.children:
-            child.dispose()
-            
-        # remove from parent
+    def _dispose(self):
+        # remove from parent, along with its descendants
+        tasks = [self._task]
+        tasks.extend(self._loaded_descendants)
         if self.parent:
             self.parent._remove_child(self._task)
         
-        # remove from dep graph
+        # remove each from dep graph, effort index and schedule
+        disposed = set(tasks)
+        time_tracker = self._context.time_tracker
+        if time_tracker.current_task in disposed:
+            time_tracker._stop()
+        dependers = {depender for task in tasks for depender in task._dependers if depender not in disposed}
+        for task in tasks:
+            task._drop()
+        self._context.recomputation._forget_all(disposed)
+        self._context.scheduler._invalidate(*dependers)
+        self._context.ready_tasks._invalidate(*dependers)
+        
+    def _drop(self):
+        '''
+        Remove task from dep graph, effort index and schedule
+        
+        Does not touch its parent or children. The caller makes recomputation
+        forget the dropped tasks, all at once.
+        '''
         self._dependency_graph.remove_nodes_from([self.start_node, self.end_node])
+        self._context.changes._forget(self._task)
+        self._context.effort_index._forget(self._task)
+        self._context.scheduler._forget(self._task)
+        self._context.ready_tasks._forget(self._task)
     
+    def validate_archive(self):
+        '''
+        Get whether may call `archive`
+        
+        Returns
+        -------
+        Exception or None
+            the exception that would be thrown, ``None`` otherwise
+        '''
+        if self._is_root:
+            return InvalidOperationError('Cannot archive the root task')
+        if self.is_leaf:
+            return InvalidOperationError('Cannot archive a leaf task')
+        descendants = set(self._loaded_descendants)
+        if self._context.time_tracker.current_task in descendants:
+            return InvalidOperationError('Cannot archive a task while tracking time on one of its descendants')
+        for task in descendants:
+            if task.is_leaf and task.planning_state not in (PlanningState.finished, PlanningState.cancelled):
+                return InvalidOperationError("Cannot archive a task with unfinished descendants, e.g. '{}'".format(task.name))
+            crossing = [other for other in task.dependencies if other not in descendants]
+            crossing += [other for other in task._dependers if other not in descendants]
+            if crossing:
+                return InvalidOperationError(
+                    "Cannot archive a task whose descendants have dependencies outside of it: '{}' and '{}'"
+                    .format(task.name, crossing[0].name)
+                )
+        return None
+    
+    @edit
+    def archive(self):
+        '''
+        Move the subtree of a finished branch task out of memory
+        
+        The descendants are handed to `Context.cold_storage` and removed from
+        the dependency graph, the task becomes an archived task (see
+        `ArchivedTaskState`). Only its own start and end node remain, so its
+        dependencies and dependers are kept. Effort spent and estimate
+        calibration remain unchanged. When its children are asked for, they
+        are loaded anew; tasks previously obtained from the subtree should no
+        longer be used.
+        
+        Does nothing if the task is already archived.
+        
+        Raises
+        ------
+        InvalidOperationError
+            If the task is the root or a leaf, if any leaf in its subtree is
+            unfinished or being time tracked, or if any of its descendants
+            depends on or is depended on by a task outside of its subtree.
+        '''
+        if self.is_archived:
+            return
+        ex = self.validate_archive()
+        if ex:
+            raise ex
+        task = self._task
+        context = self._context
+        load = context.cold_storage.store(task)
+        descendants = list(self._loaded_descendants)
+        context.effort_index._archive(task, descendants)
+        context.estimate_calibration._archive(task, descendants)
+        for descendant in descendants:
+            descendant._drop()
+        context.recomputation._forget_all(set(descendants))
+        task._become_archived_task(load)
+        context.changes._record('archive', task)
+        
     def _insert_child(self, index, child):
         '''
         Raises
@@ -255,6 +462,19 @@ class TaskState(object):
         '''
         raise NotImplementedError()
     
+    @property
+    def _loaded_children(self):
+        '''
+        Get children without loading those of an archived task
+        '''
+        return self.children
+    
+    @property
+    def _loaded_descendants(self):
+        for child in self._loaded_children:
+            yield child
+            yield from child._loaded_descendants
+    
     @property
     def ancestors(self):
         if self.parent:
@@ -274,6 +494,15 @@ class TaskState(object):
         '''
         raise NotImplementedError()
     
+    @property
+    def is_archived(self):
+        '''
+        Get whether the task is a finished branch whose subtree has not been loaded
+        
+        Its children are loaded when first asked for, see `ArchivedTaskState`.
+        '''
+        return False
+    
     @property
     def dependencies(self):
         '''
@@ -284,8 +513,11 @@ class TaskState(object):
         Task
             tasks that must be finished in addition to the parent task before this task can start
         '''
-        return iter(self._dependencies)
+        for task, node_type in self._dependency_graph.successors(self.start_node):
+            if node_type == TaskNodeType.end:
+                yield task
     
+    @edit
     def add_dependency(self, task):
         if self.planning_state == PlanningState.finished:
             raise InvalidOperationError('Cannot add dependency to finished task')
@@ -294,16 +526,25 @@ class TaskState(object):
         cycles = self._dependency_cycles
         if cycles:
             # rollback
-            self.remove_dependency(task)
+            self._dependency_graph.remove_edge(self.start_node, task.end_node)
             raise ValueError("Depending on '{}' would cause a dependency cycle: {}".format(task.name, cycles))
+        self._context.scheduler._invalidate(self._task)
+        self._context.ready_tasks._invalidate(self._task)
+        self._context.changes._record('add_dependency', self._task, task)
         
+    @edit
     def remove_dependency(self, task):
         if self.planning_state == PlanningState.finished:
             raise InvalidOperationError('Cannot remove dependency from finished task')
         self._dependency_graph.remove_edge(self.start_node, task.end_node)
+        self._context.scheduler._invalidate(self._task)
+        self._context.scheduler._invalidate_slack(task)
+        self._context.ready_tasks._invalidate(self._task)
+        self._context.changes._record('remove_dependency', self._task, task)
         
     @property
     def _dependency_cycles(self):
+        import networkx as nx
         cycles = list(nx.simple_cycles(self._dependency_graph))
         if cycles:
             cycles = ', '.join(' -> '.join('{}.{}'.format(task.name, node_type.value) for (task, node_type) in cycle) for cycle in cycles)
@@ -313,7 +554,7 @@ class TaskState(object):
     
     planning_state = property(
         fget=lambda self: self._get_planning_state(), 
-        fset=lambda self, value: self._set_planning_state(value),
+        fset=lambda self, value: self._edit_planning_state(value),
         doc='''
         Returns
         -------
@@ -321,6 +562,12 @@ class TaskState(object):
         '''
     )
     
+    @edit
+    def _edit_planning_state(self, value):
+        old = self.planning_state
+        self._set_planning_state(value)
+        self._context.changes._record('planning_state', self._task, value, old=(old,))
+    
     def validate_set_planning_state(self, state):
         '''
         Get whether may set given state
@@ -337,6 +584,22 @@ class TaskState(object):
         '''
         raise NotImplementedError()
     
+    def _on_planning_state_changed(self):
+        recomputation = self._context.recomputation
+        recomputation.emit(self._task, 'planning_state_changed')
+        if self.parent:
+            recomputation.mark_dirty('planning_state', self.parent)
+        self._context.ready_tasks._invalidate(self._task, *self._dependers)
+        
+    @property
+    def _dependers(self):
+        '''
+        Tasks which directly depend on this task, excluding its parent
+        '''
+        for task, node_type in self._dependency_graph.predecessors(self.end_node):
+            if node_type == TaskNodeType.start:
+                yield task
+    
     @property
     def _has_unfinished_dependencies(self):
         for task, node_type in self._dependency_graph[self.start_node]:
@@ -397,9 +660,21 @@ class TaskState(object):
     
     delegated = property(
         fget=lambda self: self._get_delegated(), 
-        fset=lambda self, value: self._set_delegated(value),
+        fset=lambda self, value: self._edit_delegated(value),
         doc='''
         Whether the task is delegated to someone else
         '''
     )
+    
+    @edit
+    def _edit_delegated(self, value):
+        # What is lost by switching: the duration or the effort estimates
+        if self.delegated:
+            old = self.duration
+        elif self.is_leaf:
+            old = {x: self.effort_estimates[x] for x in EstimateType}
+        else:
+            old = None
+        self._set_delegated(value)
+        self._context.changes._record('delegated', self._task, value, old=(old,))
     
\ No newline at end of file
@@ -15,10 +15,11 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
 
-from PyQt5.QtCore import QObject, pyqtSignal
 from datetime import datetime
 from chicken_turtle_util.exceptions import InvalidOperationError
+from ._signal import Signal
 from ._common import Interval, EmptyIntervalError
+from ._recomputation import edit
 import logging
 from datetime import datetime
 
@@ -26,15 +27,13 @@ logger = logging.getLogger(__name__)
 
 class TimeTracker(object):
     
-    class _Events(QObject):
+    class _Events(object):
         
-        current_interval_changed = pyqtSignal(object)
-        
-        def __init__(self, qt_parent):
-            super().__init__()
+        current_interval_changed = Signal(object)
     
     def __init__(self, context):
-        self.events = self._Events(context.qt_parent)
+        self._context = context
+        self.events = self._Events()
         self._current_task = None
         self._current_start = None
         self._current_interval = None
@@ -42,16 +41,56 @@ class TimeTracker(object):
     
     def start(self, task):
         if self._current_task:
-            raise InvalidOperationError('')
+            raise InvalidOperationError('Cannot start time tracking when already tracking')
+        self._start(task, datetime.now())
+        
+    def _start(self, task, start):
+        '''
+        Start time tracking as of start, e.g. to replay a journal
+        '''
         self._current_task = task
-        self._current_start = datetime.now()
+        self._current_start = start
+        self._context.changes._record('start_tracking', task, start)
     
+    @edit
     def stop(self):
+        '''
+        Stop time tracking, adding the tracked interval to the effort spent on
+        the task
+        
+        Less than a minute of tracking adds nothing.
+        
+        Returns
+        -------
+        Interval or None
+            Interval added, if any
+        '''
         if not self._current_task:
-            raise InvalidOperationError('')
+            raise InvalidOperationError('Cannot stop time tracking when already stopped')
+        task = self._current_task
+        start = self._current_start
+        try:
+            interval = Interval(start, datetime.now())
+        except EmptyIntervalError:
+            interval = None
+        self._stop()
+        if interval:
+            try:
+                task.insert_effort_spent(len(task.effort_spent), interval)
+            except Exception:
+                self._start(task, start)  # keep tracking, rather than losing the time tracked
+                raise
+        return interval
+            
+    @edit
+    def _stop(self):
+        '''
+        Stop time tracking without adding effort, e.g. to replay a journal
+        '''
         self._current_task = None
         self._current_start = None
         self._update_current_interval()
+        self._context.changes._record('stop_tracking', None)
     
     @property
     def current_task(self):
@@ -73,8 +112,9 @@ class TimeTracker(object):
         '''
         return self._current_interval
         
+    @edit
     def _update_current_interval(self):
-        logger.error(datetime.now())
+        logger.debug(datetime.now())
         old = self._current_interval
         if not self._current_start:
             self._current_interval = None
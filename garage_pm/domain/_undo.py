@@ -0,0 +1,302 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from chicken_turtle_util.exceptions import InvalidOperationError
+from ._signal import Signal
+from collections import deque
+import time
+
+_attributes = ('name', 'description', 'planned_start_override', 'duration', 'planning_state')
+_calendar_edits = ('add_holiday', 'remove_holiday', 'set_exception', 'remove_exception')  # methods of WorkingCalendar
+
+class UndoStack(object):
+    
+    '''
+    Undo and redo edits of the project
+    
+    Edits are recorded as the deltas which revert them, derived from the
+    `Changes` the domain emits, rather than as snapshots of the project. A
+    delta refers to tasks by id, so it still applies after the task it refers
+    to was disposed and restored. The changes of a single (outermost) edit form
+    a single step, which is undone in a single edit. E.g. undoing disposing a
+    task restores its whole subtree at once, see `Subtree`.
+    
+    Consecutive changes of the same attribute of the same task, each an edit of
+    its own, are coalesced into a single step while they follow each other
+    within `coalesce_interval`, e.g. typing a name. Changes which cannot be
+    undone (archiving a task) clear the stacks.
+    
+    Parameters
+    ----------
+    context : Context
+    
+    Attributes
+    ----------
+    max_size : int
+        Maximum size of the undo and redo stacks combined, oldest steps are
+        dropped to stay within it. The size of a step is its number of deltas,
+        plus the number of tasks in any subtrees it restores.
+    coalesce_interval : float
+        Seconds within which changes of the same attribute are coalesced
+    '''
+    
+    class _Events(object):
+        
+        changed = Signal(object)  # UndoStack, emitted when what can be undone or redone changed
+    
+    def __init__(self, context):
+        self._context = context
+        self.events = self._Events()
+        self.max_size = 100000
+        self.coalesce_interval = 1.0
+        self._undo = deque()  # [step], most recent last
+        self._redo = []  # [step], most recent last
+        self._size = 0
+        self._edit = None  # the edit the last step was recorded in
+        self._coalesce = None  # (key, time) of the last step, if it can be coalesced with
+        self._applying = None  # [delta], inverses of the changes made while applying a step
+        context.changes.events.changed.connect(self._on_changed)
+        
+    @property
+    def can_undo(self):
+        return bool(self._undo)
+    
+    @property
+    def can_redo(self):
+        return bool(self._redo)
+    
+    def undo(self):
+        '''
+        Undo the last step
+        
+        Raises
+        ------
+        InvalidOperationError
+            If there is nothing to undo
+        '''
+        if not self._undo:
+            raise InvalidOperationError('Nothing to undo')
+        self._redo.append(self._apply(self._undo[-1], self._undo.pop))
+        self._coalesce = None
+        self._trim()
+        self.events.changed.emit(self)
+        
+    def redo(self):
+        '''
+        Redo the last undone step
+        
+        Raises
+        ------
+        InvalidOperationError
+            If there is nothing to redo
+        '''
+        if not self._redo:
+            raise InvalidOperationError('Nothing to redo')
+        self._undo.append(self._apply(self._redo[-1], self._redo.pop))
+        self._coalesce = None
+        self._trim()
+        self.events.changed.emit(self)
+        
+    def clear(self):
+        '''
+        Forget all steps
+        '''
+        self._undo.clear()
+        self._redo.clear()
+        self._size = 0
+        self._edit = None
+        self._coalesce = None
+        self.events.changed.emit(self)
+        
+    def _apply(self, step, pop):
+        '''
+        Apply the deltas of a step in reverse, in a single edit
+        
+        On success, the step is popped and its inverse returned. On failure,
+        the deltas applied so far are reverted and the exception is raised.
+        '''
+        self._applying = inverse = []
+        try:
+            with self._context.recomputation.edit():
+                try:
+                    for delta in reversed(step):
+                        self._apply_delta(delta)
+                except Exception:
+                    self._applying = None
+                    for delta in reversed(inverse):
+                        self._apply_delta(delta)
+                    raise
+        finally:
+            self._applying = None
+        pop()
+        self._size += _size(inverse) - _size(step)
+        return inverse
+        
+    def _apply_delta(self, delta):
+        kind, id_, args = delta
+        find = self._context.changes._task
+        if kind == 'restore':
+            parent, index, subtree = args
+            subtree.restore(find(parent), index)
+            return
+        if kind == 'project_start':
+            self._context.scheduler.project_start = args[0]
+            return
+        if kind == 'weekly_hours':
+            self._context.calendar.weekly_hours = args[0]
+            return
+        if kind in _calendar_edits:
+            getattr(self._context.calendar, kind)(*args)
+            return
+        task = find(id_)
+        if kind == 'set':
+            setattr(task, *args)
+        elif kind == 'delegated':
+            value, old = args
+            task.delegated = value
+            if task.delegated:
+                task.duration = old
+            elif isinstance(old, dict):
+                for estimate_type, estimate in old.items():
+                    task.effort_estimates[estimate_type] = estimate
+        elif kind == 'effort_estimate':
+            task.effort_estimates[args[0]] = args[1]
+        elif kind == 'insert_effort_spent':
+            task.insert_effort_spent(*args)
+        elif kind == 'update_effort_spent':
+            task.update_effort_spent(*args)
+        elif kind == 'remove_effort_spent':
+            task.remove_effort_spent(*args)
+        elif kind == 'add_dependency':
+            task.add_dependency(find(args[0]))
+        elif kind == 'remove_dependency':
+            task.remove_dependency(find(args[0]))
+        elif kind == 'move':
+            task.move(find(args[0]), args[1])
+        elif kind == 'dispose':
+            task.dispose()
+        else:
+            assert False, kind
+            
+    def _on_changed(self, change):
+        if change.kind in ('start_tracking', 'stop_tracking'):
+            return
+        if change.kind == 'archive':
+            if self._applying is None:
+                self.clear()
+            return
+        delta = _inverse(change)
+        if self._applying is not None:
+            self._applying.append(delta)
+            return
+        
+        recomputation = self._context.recomputation
+        edit = recomputation._edits if recomputation._depth else None
+        if edit is not None and edit == self._edit and self._undo:
+            self._undo[-1].append(delta)  # same edit, same step
+            self._coalesce = None
+        else:
+            now = time.monotonic()
+            key = _coalesce_key(change)
+            if (
+                key is not None and self._coalesce and self._undo and
+                self._coalesce[0] == key and now - self._coalesce[1] < self.coalesce_interval
+            ):
+                # Coalesce, the older delta already reverts to before this change
+                self._coalesce = (key, now)
+                self._edit = edit
+                self._drop_redo()
+                return
+            self._undo.append([delta])
+            self._coalesce = (key, now) if key is not None else None
+            self._edit = edit
+        self._size += _size([delta])
+        self._drop_redo()
+        self._trim()
+        self.events.changed.emit(self)
+        
+    def _drop_redo(self):
+        if self._redo:
+            self._size -= sum(map(_size, self._redo))
+            self._redo.clear()
+            self.events.changed.emit(self)
+        
+    def _trim(self):
+        while self._size > self.max_size and self._undo:
+            self._size -= _size(self._undo.popleft())
+        if not self._undo:
+            self._edit = None
+            self._coalesce = None
+            
+def _inverse(change):
+    '''
+    Get the delta which reverts a change
+    
+    Returns
+    -------
+    (kind :: str, task id :: int or None, args :: tuple)
+    '''
+    kind, task, args, old = change
+    if kind in ('project_start', 'weekly_hours'):
+        return (kind, None, old)
+    elif kind == 'add_holiday':
+        return ('remove_holiday', None, args)
+    elif kind == 'remove_holiday':
+        return ('add_holiday', None, args)
+    elif kind in ('set_exception', 'remove_exception'):
+        if old[0] is None:
+            return ('remove_exception', None, args[:1])
+        return ('set_exception', None, (args[0], old[0]))
+    id_ = task.id
+    if kind in _attributes:
+        return ('set', id_, (kind, old[0]))
+    elif kind == 'delegated':
+        return ('delegated', id_, (not args[0], old[0]))
+    elif kind == 'effort_estimate':
+        return ('effort_estimate', id_, (args[0], old[0]))
+    elif kind == 'insert_effort_spent':
+        return ('remove_effort_spent', id_, (args[1],))
+    elif kind == 'update_effort_spent':
+        return ('update_effort_spent', id_, (args[1], args[0]))
+    elif kind == 'remove_effort_spent':
+        return ('insert_effort_spent', id_, (old[0], args[0]))
+    elif kind == 'add_dependency':
+        return ('remove_dependency', id_, (args[0].id,))
+    elif kind == 'remove_dependency':
+        return ('add_dependency', id_, (args[0].id,))
+    elif kind == 'move':
+        return ('move', id_, (args[2].id, args[3]))
+    elif kind in ('new', 'restore'):
+        return ('dispose', id_, ())
+    elif kind == 'dispose':
+        return ('restore', None, (args[0].id, args[1], old[0]))
+    else:
+        assert False, kind
+        
+def _coalesce_key(change):
+    if change.kind in ('project_start', 'weekly_hours'):
+        return (change.kind,)
+    elif change.kind in _attributes:
+        return (change.kind, change.task.id)
+    elif change.kind == 'effort_estimate':
+        return (change.kind, change.task.id, change.args[0])
+    else:
+        return None
+    
+def _size(step):
+    return sum(1 + (len(args[2]) if kind == 'restore' else 0) for kind, _, args in step)
@@ -0,0 +1,274 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Project import and export as JSON lines
+
+A project is exchanged as UTF-8 text with one JSON object per line: a header,
+then a record per task in depth-first order, so a parent always precedes its
+children. Export generates the records one at a time, import builds each task
+as its record is read. Neither holds the whole file in memory.
+
+The header is ``{"format": "garage-pm", "version": 1}`` along with the
+settings of the project:
+
+``project_start``: str
+    Datetime as ``YYYY-MM-DDTHH:MM``, see `Scheduler.project_start`. Optional.
+``calendar``: object
+    The `WorkingCalendar`. Optional. Working spans are given as ``[begin,
+    end]`` times ``HH:MM``, an end of ``00:00`` is midnight at the end of the
+    day. It has:
+    
+    ``weekly_hours``: [[[str, str]]]
+        Working spans of each day of the week, Monday first
+    ``holidays``: [str]
+        Dates as ``YYYY-MM-DD``
+    ``exceptions``: {str: [[str, str]]}
+        Working spans by date
+
+Task records have:
+
+``id``: int
+    Unique within the file. Need not match `Task.id`.
+``parent``: int or null
+    Id of the parent, ``null`` for children of the root task
+``name``, ``description``: str
+``planning_state``: str
+    Name of a `PlanningState`. Ignored for branch tasks.
+``planned_start_override``: str or null
+    Datetime as ``YYYY-MM-DDTHH:MM``
+``dependencies``: [int]
+    Ids of the tasks it depends on, which may appear later in the file
+``delegated``: bool
+    Leaf tasks only. If ``true``, ``duration`` follows, else
+    ``effort_estimates`` and ``effort_spent``.
+``duration``: int or null
+    Minutes
+``effort_estimates``: {str: int}
+    Minutes per name of `EstimateType`, missing estimates are left out
+``effort_spent``: [[str, str]]
+    Begin and end of each interval, as datetimes
+'''
+
+from garage_pm.domain import TaskTreeBuilder, PlanningState, EstimateType, Interval
+from datetime import datetime, timedelta
+import json
+
+_header = {'format': 'garage-pm', 'version': 1}
+_datetime_format = '%Y-%m-%dT%H:%M'
+_date_format = '%Y-%m-%d'
+_time_format = '%H:%M'
+
+def export_project(context):
+    '''
+    Generate the records of a project
+    
+    Subtrees of archived tasks are loaded as they are reached.
+    
+    Parameters
+    ----------
+    context : Context
+    
+    Yields
+    ------
+    dict
+        The header, then a record per task, see `garage_pm.exchange`
+    '''
+    calendar = context.calendar
+    yield dict(
+        _header,
+        project_start=_format_datetime(context.scheduler.project_start),
+        calendar={
+            'weekly_hours': [_format_spans(spans) for spans in calendar.weekly_hours],
+            'holidays': sorted(day.strftime(_date_format) for day in calendar.holidays),
+            'exceptions': {day.strftime(_date_format): _format_spans(spans) for day, spans in sorted(calendar.exceptions.items())},
+        },
+    )
+    root = context.root_task
+    for task in root.descendants:
+        yield _record(task, root)
+        
+def _record(task, root):
+    record = {
+        'id': task.id,
+        'parent': None if task.parent is root else task.parent.id,
+        'name': task.name,
+        'description': task.description,
+        'planning_state': task.planning_state.name,
+        'planned_start_override': _format_datetime(task.planned_start_override),
+        'dependencies': [dependency.id for dependency in task.dependencies],
+    }
+    if task.is_leaf:
+        record['delegated'] = task.delegated
+        if task.delegated:
+            record['duration'] = _minutes(task.duration)
+        else:
+            estimates = {x.name: _minutes(task.effort_estimates[x]) for x in EstimateType}
+            record['effort_estimates'] = {name: minutes for name, minutes in estimates.items() if minutes is not None}
+            record['effort_spent'] = [[_format_datetime(x.begin), _format_datetime(x.end)] for x in task.effort_spent]
+    return record
+
+def import_project(context, records):
+    '''
+    Build a project from records
+    
+    Tasks are built with a `TaskTreeBuilder` as their records arrive. Only
+    the dependencies are kept until the end, as they may refer to tasks
+    further on, and are checked for cycles once.
+    
+    Parameters
+    ----------
+    context : Context
+        Context which only contains the root task. After an error it may be
+        partially built, and should be discarded.
+    records : iterable(dict)
+        The header, then a record per task, e.g. from `read_json_lines`
+        
+    Raises
+    ------
+    ValueError
+        If the header or a record is invalid, or the dependencies contain a
+        cycle
+    '''
+    records = iter(records)
+    header = next(records, None)
+    if not isinstance(header, dict) or {key: header.get(key) for key in _header} != _header:
+        raise ValueError('Expected header {}, got: {}'.format(json.dumps(_header), header))
+    try:
+        if header.get('project_start') is not None:
+            context.scheduler.project_start = _parse_datetime(header['project_start'])
+        if header.get('calendar') is not None:
+            _import_calendar(context.calendar, header['calendar'])
+    except KeyError as ex:
+        raise ValueError('Header: missing or unknown {}'.format(ex)) from ex
+    except (AttributeError, TypeError, ValueError) as ex:
+        raise ValueError('Header: {}'.format(ex)) from ex
+    tasks = {}  # {id => Task}
+    dependencies = []  # [(Task, id)]
+    with TaskTreeBuilder(context) as builder:
+        for i, record in enumerate(records, 1):
+            try:
+                id_ = record['id']
+                if id_ in tasks:
+                    raise ValueError('Duplicate id: {}'.format(id_))
+                parent = record.get('parent')
+                parent = context.root_task if parent is None else tasks[parent]
+                task = builder.add_task(parent, **_task_args(record))
+            except KeyError as ex:
+                raise ValueError('Task record {}: missing or unknown {}'.format(i, ex)) from ex
+            except (TypeError, ValueError) as ex:
+                raise ValueError('Task record {}: {}'.format(i, ex)) from ex
+            tasks[id_] = task
+            dependencies.extend((task, dependency) for dependency in record.get('dependencies', ()))
+        for task, dependency in dependencies:
+            if dependency not in tasks:
+                raise ValueError("Task '{}' depends on unknown id: {}".format(task.name, dependency))
+            builder.add_dependency(task, tasks[dependency])
+            
+def _task_args(record):
+    '''
+    Get `TaskTreeBuilder.add_task` args from a record
+    '''
+    args = dict(
+        name=record['name'],
+        description=record.get('description', ''),
+        planning_state=PlanningState[record.get('planning_state', PlanningState.planned.name)],
+        planned_start_override=_parse_datetime(record.get('planned_start_override')),
+        delegated=bool(record.get('delegated', False)),
+    )
+    if args['delegated']:
+        args['duration'] = _timedelta(record.get('duration'))
+    else:
+        args['effort_estimates'] = {EstimateType[name]: _timedelta(minutes) for name, minutes in record.get('effort_estimates', {}).items()}
+        args['effort_spent'] = [Interval(_parse_datetime(begin), _parse_datetime(end)) for begin, end in record.get('effort_spent', ())]
+    return args
+
+def write_json_lines(records, file):
+    '''
+    Write records as JSON lines, one at a time
+    
+    Parameters
+    ----------
+    records : iterable(dict)
+    file : file-like
+        Text file to write to
+    '''
+    for record in records:
+        file.write(json.dumps(record, ensure_ascii=False))
+        file.write('\n')
+        
+def read_json_lines(file):
+    '''
+    Read records from JSON lines, one at a time
+    
+    Blank lines are skipped.
+    
+    Parameters
+    ----------
+    file : file-like
+        Text file to read from
+        
+    Yields
+    ------
+    dict
+    
+    Raises
+    ------
+    ValueError
+        If a line is not a JSON object
+    '''
+    for i, line in enumerate(file, 1):
+        if line.strip():
+            try:
+                record = json.loads(line)
+            except ValueError as ex:
+                raise ValueError('Line {}: {}'.format(i, ex)) from ex
+            if not isinstance(record, dict):
+                raise ValueError('Line {}: expected an object, got: {}'.format(i, line.strip()))
+            yield record
+            
+def _minutes(duration):
+    return None if duration is None else duration // timedelta(minutes=1)
+
+def _timedelta(minutes):
+    return None if minutes is None else timedelta(minutes=int(minutes))
+
+def _import_calendar(calendar, header):
+    calendar.weekly_hours = [_parse_spans(spans) for spans in header['weekly_hours']]
+    for day in header['holidays']:
+        calendar.add_holiday(_parse_date(day))
+    for day, spans in header['exceptions'].items():
+        calendar.set_exception(_parse_date(day), _parse_spans(spans))
+        
+def _format_spans(spans):
+    return [[begin.strftime(_time_format), end.strftime(_time_format)] for begin, end in spans]
+
+def _parse_spans(spans):
+    return [(_parse_time(begin), _parse_time(end)) for begin, end in spans]
+
+def _parse_date(text):
+    return datetime.strptime(text, _date_format).date()
+
+def _parse_time(text):
+    return datetime.strptime(text, _time_format).time()
+
+def _format_datetime(datetime_):
+    return None if datetime_ is None else datetime_.strftime(_datetime_format)
+
+def _parse_datetime(text):
+    return None if text is None else datetime.strptime(text, _datetime_format)
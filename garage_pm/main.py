@@ -15,65 +15,333 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
 
-from PyQt5.QtCore import QObject, QTimer
-from PyQt5.QtWidgets import QApplication
 from chicken_turtle_util import cli
-from garage_pm import __version__
-from garage_pm.domain import Task, TimeTracker
-from garage_pm.controllers import MainWindowController
-from garage_pm.views import MainWindow
-from datetime import datetime
-from math import ceil
-import networkx as nx
+from garage_pm import __version__, config
+from garage_pm import report as report_, exchange
+from garage_pm.store import Store
+from garage_pm.projects import Projects, ProjectContext, MinuteTimer
+from chicken_turtle_util.exceptions import InvalidOperationError
+from datetime import timedelta
+import click
 import sys
 import logging
 
 logger = logging.getLogger(__name__)
 
 class Context(cli.DataDirectoryMixin('garage_pm'), cli.BasicsMixin(__version__), cli.Context):
+    
+    '''
+    Application context
+    
+    Attributes not found on it are looked up on the context of the open
+    project (see `project`), e.g. ``context.root_task``.
+    '''
+    
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.qt_parent = QObject() #XXX if this ever gives trouble, try finding a better QObject as parent, e.g. the mainwindow. Or stop using qt signals in the domain, only use qt's existing signals.
+        self._minute_timer = MinuteTimer()
+        self._dispatch = None  # delivers background simulation results, set by the GUI
+        self._project = None
+        self._projects = None
         
-        # Our clock: ticks during the first second of every minute, fitting our granularity of just a minute
-        #
-        # Note: QTimer never emits early, but it can emit an ms late or much
-        # later (especially if the event loop gets clogged with computation
-        # (which doesn't belong on the event thread))
-        self._minute_timer = QTimer()
-        self._minute_timer.timeout.connect(self._on_first_minute_timeout)
-        now = datetime.now()
-        seconds_until_next_minute = 60 - (now.second + now.microsecond * 1e-6)
-        self._minute_timer.start(ceil(seconds_until_next_minute * 1000) + 500)  # + half a second or we likely emit when python time still reports 59 seconds. Double checked the initial start delay is correct. There must be some lack of accuracy in python's datetime.now
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.project, name)
         
-        self._task_dependency_graph = nx.DiGraph()
-        self.effort_intervals = set()
-        self._root_task = Task('Root task', self, is_root=True)
-        self._time_tracker = TimeTracker(self)
-        
-    def _on_first_minute_timeout(self):
-        self._minute_timer.setInterval(60000)
-    
     @property
     def minute_timer(self):
+        '''
+        Clock which ticks every minute, while the GUI runs
+        
+        Returns
+        -------
+        MinuteTimer
+        '''
         return self._minute_timer
     
     @property
-    def task_dependency_graph(self):
-        return self._task_dependency_graph
+    def projects(self):
+        '''
+        Projects of the data directory
+        
+        Returns
+        -------
+        Projects
+        '''
+        if self._projects is None:
+            self._projects = Projects(self.data_directory, self._new_project_context)
+        return self._projects
     
     @property
-    def root_task(self):
-        return self._root_task
+    def project(self):
+        '''
+        Context of the open project
+        
+        Until a project is opened with `projects`, an empty project which is
+        not stored.
+        
+        Returns
+        -------
+        ProjectContext
+        '''
+        if self._projects is not None and self._projects.context is not None:
+            return self._projects.context
+        if self._project is None:
+            self._project = self._new_project_context()
+        return self._project
     
-    @property
-    def time_tracker(self):
-        return self._time_tracker
+    def _new_project_context(self):
+        return ProjectContext(self._minute_timer, self._dispatch)
+    
+@click.group(invoke_without_command=True)
+@click.pass_context
+def main(click_context):
+    '''
+    Garage PM. Without a command, open the GUI.
+    '''
+    if click_context.invoked_subcommand is None:
+        click_context.invoke(gui)
+
+_project_option = click.option('--project', help='Project to open. Defaults to the project opened last.')
 
-@Context.command()    
-def main(context):
+@Context.command()
+@_project_option
+def gui(context, project):
+    '''
+    Open the GUI
+    '''
+    # Imported here, headless commands need no Qt
+    from PyQt5.QtWidgets import QApplication
+    from garage_pm.controllers import MainWindowController, EventThreadDispatch, start_minute_clock
+    from garage_pm.views import MainWindow
+    from garage_pm.store import BackgroundJournal
+    
     app = QApplication(sys.argv)
+    context._dispatch = EventThreadDispatch()
+    projects = context.projects
+    projects.journal_type = BackgroundJournal
+    _open(projects, project)
+    clock = start_minute_clock(context.minute_timer)
+    context.minute_timer.timeout.connect(projects.sync)
+    app.aboutToQuit.connect(projects.close)
     window = MainWindow()
     MainWindowController(context.root_task, window)
     window.show()
     sys.exit(app.exec_())
+
+main.add_command(gui)
+
+@Context.command()
+@click.option('--begin', type=click.DateTime([config.date_format]), required=True, help='First day to report on, e.g. 01-02-2016.')
+@click.option('--end', type=click.DateTime([config.date_format]), required=True, help='Last day to report on.')
+@click.option('--period', type=click.Choice([x.value for x in report_.Period]), default=report_.Period.week.value, show_default=True, help='Length of a timesheet period.')
+@click.option('--subtotals', is_flag=True, help='Report the total of each subtree, including branch tasks, instead of leaf tasks only.')
+@click.option('--format', 'format_', type=click.Choice(['csv', 'html']), default='csv', show_default=True, help='Output format.')
+@click.option('--output', type=click.File('w'), default='-', help='File to write to. Defaults to stdout.')
+@click.option('--project', 'project_names', multiple=True, help='Project to report on, may be repeated. Defaults to the project opened last. Of more than one project, report the total of each project.')
+@click.option('--all-projects', is_flag=True, help='Report the total of each project.')
+def report(context, begin, end, period, subtotals, format_, output, project_names, all_projects):
+    '''
+    Write timesheet, without opening the GUI
+    
+    A timesheet across projects totals the projects in parallel, without
+    loading them.
+    '''
+    projects = context.projects
+    begin = begin.date()
+    end = end.date() + timedelta(days=1)
+    period = report_.Period(period)
+    write = report_.write_csv if format_ == 'csv' else report_.write_html
+    if all_projects or len(project_names) > 1:
+        if subtotals:
+            raise click.UsageError('--subtotals only applies to a single project')
+        names = projects.names if all_projects else project_names
+        for name in names:
+            if name not in projects.names:
+                raise click.UsageError('No such project: {}'.format(name))
+        try:
+            rows = list(report_.project_timesheet([(name, projects.directory(name)) for name in names], begin, end, period))
+        except ValueError as ex:
+            raise click.ClickException(str(ex))
+        write(rows, output, config.date_format, subject='Project')
+    else:
+        project_context = _open(projects, project_names[0] if project_names else None)
+        try:
+            rows = report_.timesheet(project_context, begin, end, period, subtotals, projects.journal.effort_log)
+            write(rows, output, config.date_format)
+        finally:
+            projects.close()
+        
+main.add_command(report)
+
+@Context.command()
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='File to write to. Defaults to stdout.')
+@_project_option
+def export(context, output, project):
+    '''
+    Write project as JSON lines
+    '''
+    projects = context.projects
+    project_context = _open(projects, project)
+    try:
+        exchange.write_json_lines(exchange.export_project(project_context), output)
+    finally:
+        projects.close()
+        
+main.add_command(export)
+
+@Context.command('import')
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--project', default=Projects.default, show_default=True, help='Project to create.')
+@click.option('--replace', is_flag=True, help='Replace the project, if it exists.')
+def import_(context, file, project, replace):
+    '''
+    Create project from JSON lines
+    '''
+    projects = context.projects
+    if project not in projects.names:
+        try:
+            projects.create(project)
+        except ValueError as ex:
+            raise click.UsageError(str(ex))
+    store = Store(projects.directory(project) / 'project.sqlite')
+    if store.path.exists() and not replace:
+        raise click.UsageError('Project {} already exists. Use --replace to replace it.'.format(project))
+    project_context = context._new_project_context()
+    try:
+        exchange.import_project(project_context, exchange.read_json_lines(file))
+    except ValueError as ex:
+        raise click.ClickException('Invalid project file: {}'.format(ex))
+    
+    # Save as the next generation, the journal of the replaced project no longer applies
+    store.save(project_context, store.generation + 1)
+    
+main.add_command(import_)
+
+@Context.command('projects')
+def projects_(context):
+    '''
+    List projects, with a summary of each
+    '''
+    projects = context.projects
+    for name in projects.names:
+        summary = projects.summary(name)
+        if summary is None:
+            click.echo(name)
+        else:
+            click.echo('{}: {} spent, {} ready'.format(name, summary.effort_spent, summary.ready_count))
+            for _, task_name in summary.ready:
+                click.echo('  ' + task_name)
+    
+main.add_command(projects_)
+
+@Context.command('list')
+@_project_option
+def list_(context, project):
+    '''
+    List tasks with their id, without opening the GUI
+    
+    Archived tasks are listed without their descendants.
+    '''
+    projects = context.projects
+    project_context = _open(projects, project)
+    try:
+        _list(project_context.root_task, 0)
+    finally:
+        projects.close()
+        
+def _list(task, depth):
+    for child in task._loaded_children:
+        state = 'archived' if child.is_archived else child.planning_state.name
+        click.echo('{}{} {} ({})'.format('  ' * depth, child.id, child.name, state))
+        _list(child, depth + 1)
+        
+main.add_command(list_)
+
+@Context.command()
+@click.argument('name')
+@click.option('--parent', type=int, help='Id of the task to add it to. Defaults to the root task.')
+@_project_option
+def add(context, name, parent, project):
+    '''
+    Add task and print its id, without opening the GUI
+    '''
+    projects = context.projects
+    project_context = _open(projects, project)
+    try:
+        if parent is not None:
+            parent = _task(project_context, parent)
+        task = project_context.root_task.append_new_task(name)
+        if parent is not None:
+            try:
+                task.move(parent, len(parent.children))
+            except Exception:
+                task.dispose()
+                raise
+        click.echo(task.id)
+    except (ValueError, InvalidOperationError) as ex:
+        raise click.ClickException(str(ex))
+    finally:
+        projects.close()
+        
+main.add_command(add)
+
+@click.group()
+def track():
+    '''
+    Track time spent on a task, without opening the GUI
+    '''
+    
+@Context.command()
+@click.argument('id_', metavar='ID', type=int)
+@_project_option
+def start(context, id_, project):
+    '''
+    Start tracking time on task
+    '''
+    projects = context.projects
+    project_context = _open(projects, project)
+    try:
+        project_context.time_tracker.start(_task(project_context, id_))
+    except (ValueError, InvalidOperationError) as ex:
+        raise click.ClickException(str(ex))
+    finally:
+        projects.close()
+        
+track.add_command(start)
+
+@Context.command()
+@_project_option
+def stop(context, project):
+    '''
+    Stop tracking time, adding it to the effort spent on the task
+    '''
+    projects = context.projects
+    project_context = _open(projects, project)
+    try:
+        time_tracker = project_context.time_tracker
+        task = time_tracker.current_task
+        if not task:
+            raise click.UsageError('Not tracking time')
+        interval = time_tracker.stop()
+        click.echo('{} spent on {}'.format(interval.duration if interval else timedelta(), task.name))
+    except (ValueError, InvalidOperationError) as ex:
+        raise click.ClickException(str(ex))
+    finally:
+        projects.close()
+        
+track.add_command(stop)
+main.add_command(track)
+
+def _task(project_context, id_):
+    try:
+        return project_context.changes._task(id_)
+    except KeyError:
+        raise click.UsageError('No such task: {}. Tasks inside archived tasks cannot be used by id.'.format(id_))
+        
+def _open(projects, name):
+    try:
+        return projects.open(name)
+    except KeyError:
+        raise click.UsageError('No such project: {}'.format(name))
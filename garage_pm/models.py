@@ -19,12 +19,13 @@
 Qt models
 '''
 
-from PyQt5.QtCore import QAbstractItemModel, Qt, QModelIndex, QAbstractTableModel
+from PyQt5.QtCore import QAbstractItemModel, Qt, QModelIndex, QAbstractTableModel, QAbstractListModel
 from PyQt5.QtWidgets import QMessageBox
 from garage_pm import config
 from garage_pm.domain import Task, Interval
 from datetime import datetime, timedelta
 from chicken_turtle_util.pyqt import block_signals
+from chicken_turtle_util.exceptions import InvalidOperationError
 
 # About QAbstractItemModel: the root is QModelIndex()
 
@@ -89,6 +90,13 @@ class TaskTreeModel(QAbstractItemModel):
         else:  # root
             return 1
         
+    def hasChildren(self, parent=QModelIndex()):
+        if parent.isValid():
+            task = parent.internalPointer()
+            return task.is_archived or bool(task.children)  # archived tasks load their children on expand
+        else:  # root
+            return True
+        
     def columnCount(self, parent=QModelIndex()):
         return 1
         
@@ -216,13 +224,16 @@ class TaskEffortSpentModel(QAbstractTableModel):
             return False
         else:
             effort = self._task.effort_spent[index.row()]
+            self._ignore_task_events += 1
             try:
                 if index.column() == 0:
-                    effort.begin = value
+                    self._task.update_effort_spent(effort, Interval(value, effort.end))
                 else:
-                    effort.end = value
-            except ValueError as ex:
+                    self._task.update_effort_spent(effort, Interval(effort.begin, value))
+            except (ValueError, InvalidOperationError) as ex:
                 QMessageBox.warning(None, 'Invalid value', str(ex))
+            finally:
+                self._ignore_task_events -= 1
             self.dataChanged.emit(index, index)
             return True
         
@@ -249,4 +260,54 @@ class TaskEffortSpentModel(QAbstractTableModel):
         self._ignore_task_events -= 1
         self.endInsertRows()
         return True
-    
\ No newline at end of file
+    
+
+class ReadyTaskListModel(QAbstractListModel):
+    
+    '''
+    Ready tasks with least slack, least first
+    
+    Parameters
+    ----------
+    ready_tasks : ReadyTasks
+    parent : QObject
+    count : int
+        Maximum number of tasks to show
+    '''
+    
+    def __init__(self, ready_tasks, parent, count=20):
+        super().__init__(parent)
+        self._ready_tasks = ready_tasks
+        self._count = count
+        self._tasks = ready_tasks.top(count)
+        ready_tasks.events.changed.connect(self._on_ready_tasks_changed)
+        
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        else:
+            return len(self._tasks)
+        
+    def data(self, index, role=Qt.DisplayRole):
+        if index.isValid() and role == Qt.DisplayRole:
+            return self._tasks[index.row()].name
+        return None
+    
+    def task(self, index):
+        '''
+        Get task at index
+        
+        Parameters
+        ----------
+        index : QModelIndex
+        
+        Returns
+        -------
+        Task
+        '''
+        return self._tasks[index.row()]
+        
+    def _on_ready_tasks_changed(self, ready_tasks):
+        self.beginResetModel()
+        self._tasks = ready_tasks.top(self._count)
+        self.endResetModel()
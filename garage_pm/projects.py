@@ -0,0 +1,478 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Projects of a data directory
+'''
+
+from garage_pm.domain import Signal
+from garage_pm.store import Journal
+from collections import namedtuple
+from datetime import datetime, timedelta
+import json
+import os
+
+class MinuteTimer(object):
+    
+    '''
+    Clock which ticks every minute
+    
+    It does not tick by itself: the GUI calls `tick` every minute. Headless
+    commands need no clock.
+    '''
+    
+    timeout = Signal()
+    
+    def tick(self):
+        self.timeout.emit()
+        
+class ProjectContext(object):
+    
+    '''
+    Domain context of a single project
+    
+    Holds the task tree of the project and everything derived from it. Each
+    project has its own, see `Projects`.
+    
+    Parameters
+    ----------
+    minute_timer : MinuteTimer
+        Clock which ticks every minute, shared by all projects
+    dispatch : ((() -> None) -> None) or None
+        Delivers results of the background simulation, see
+        `BackgroundSimulation`
+    '''
+    
+    def __init__(self, minute_timer, dispatch=None):
+        # Imported here, commands which open no project need not load them
+        from garage_pm.domain import Task, TimeTracker, Recomputation, Changes, EffortIndex, EstimateCalibration, WorkingCalendar, Scheduler, ReadyTasks, ColdStorage, UndoStack, BackgroundSimulation
+        import networkx as nx
+        self._minute_timer = minute_timer
+        self._task_dependency_graph = nx.DiGraph()
+        self._recomputation = Recomputation(self)
+        self._changes = Changes(self)
+        self._effort_index = EffortIndex(self)
+        self._estimate_calibration = EstimateCalibration(self)
+        self._calendar = WorkingCalendar(self)
+        self._scheduler = Scheduler(self)
+        self._ready_tasks = ReadyTasks(self)
+        self._cold_storage = ColdStorage()
+        self._root_task = Task('Root task', self, is_root=True)
+        self._time_tracker = TimeTracker(self)
+        self._background_simulation = BackgroundSimulation(self, dispatch=dispatch)
+        self._undo_stack = UndoStack(self)
+        
+    @property
+    def minute_timer(self):
+        return self._minute_timer
+    
+    @property
+    def task_dependency_graph(self):
+        return self._task_dependency_graph
+    
+    @property
+    def recomputation(self):
+        return self._recomputation
+    
+    @property
+    def changes(self):
+        return self._changes
+    
+    @property
+    def effort_index(self):
+        return self._effort_index
+    
+    @property
+    def estimate_calibration(self):
+        return self._estimate_calibration
+    
+    @property
+    def calendar(self):
+        return self._calendar
+    
+    @property
+    def scheduler(self):
+        return self._scheduler
+    
+    def critical_path(self):
+        '''
+        Get tasks on the critical path of the planned schedule
+        
+        See `Scheduler.critical_path`.
+        '''
+        return self._scheduler.critical_path()
+    
+    @property
+    def ready_tasks(self):
+        '''
+        Planned leaf tasks which can be worked on now
+        
+        Returns
+        -------
+        ReadyTasks
+        '''
+        return self._ready_tasks
+    
+    @property
+    def cold_storage(self):
+        '''
+        Storage of the subtrees of archived tasks
+        
+        Returns
+        -------
+        ColdStorage
+        '''
+        return self._cold_storage
+    
+    @property
+    def root_task(self):
+        return self._root_task
+    
+    @property
+    def time_tracker(self):
+        return self._time_tracker
+    
+    @property
+    def background_simulation(self):
+        return self._background_simulation
+    
+    @property
+    def undo_stack(self):
+        '''
+        Undo and redo edits of the project
+        
+        Returns
+        -------
+        UndoStack
+        '''
+        return self._undo_stack
+    
+ProjectSummary = namedtuple('ProjectSummary', 'effort_spent predicted_end ready_count ready')
+ProjectSummary.__doc__ = '''
+What to show of a project without loading it
+
+Attributes
+----------
+effort_spent : datetime.timedelta
+    Total effort spent on the project
+predicted_end : datetime.datetime or None
+    Predicted end of the project
+ready_count : int
+    Number of ready tasks, see `ReadyTasks`
+ready : [(int, str)]
+    Id and name of the next ready tasks, those with least slack first
+'''
+
+def summarise(context, ready=5):
+    '''
+    Get summary of a loaded project
+    
+    Parameters
+    ----------
+    context : ProjectContext
+    ready : int
+        Maximum number of ready tasks to include
+        
+    Returns
+    -------
+    ProjectSummary
+    '''
+    return ProjectSummary(
+        effort_spent=context.effort_index.total(),
+        predicted_end=context.root_task.predicted_end,
+        ready_count=len(context.ready_tasks),
+        ready=[(task.id, task.name) for task in context.ready_tasks.top(ready)],
+    )
+
+class Projects(object):
+    
+    '''
+    Registry of the projects in a data directory
+    
+    Each project is stored in a directory of its own, ``projects/<name>``, see
+    `Journal`. At most one project is open: its `context` is fully loaded and
+    its changes are journaled. Of the other projects, only a `ProjectSummary`
+    is kept, cached in ``projects.json`` along with the name of the open
+    project. It is updated when a project is closed, e.g. when switching to
+    another project with `open`.
+    
+    A data directory holding a single project, from before projects existed,
+    has it moved to the ``default`` project.
+    
+    Parameters
+    ----------
+    directory : pathlib.Path
+        Data directory
+    new_context : () -> ProjectContext
+        Create an empty context to open a project in
+        
+    Attributes
+    ----------
+    journal_type : type
+        Type of `Journal` to open projects with, e.g. `BackgroundJournal`
+    '''
+    
+    class _Events(object):
+        
+        switched = Signal(object)  # Projects, emitted when another project was opened
+    
+    default = 'default'
+    
+    def __init__(self, directory, new_context):
+        self.journal_type = Journal
+        self.events = self._Events()
+        self._directory = directory
+        self._new_context = new_context
+        self._summaries = None  # {name => ProjectSummary}, read on first use
+        self._last = None  # name of the project opened last
+        self._current = None
+        self._context = None
+        self._journal = None
+        
+    @property
+    def names(self):
+        '''
+        Get names of the projects, sorted
+        
+        Returns
+        -------
+        [str]
+        '''
+        self._read()
+        return sorted(self._summaries)
+    
+    @property
+    def current(self):
+        '''
+        Get the name of the open project
+        
+        Returns
+        -------
+        str or None
+            ``None`` if none is open
+        '''
+        return self._current
+    
+    @property
+    def context(self):
+        '''
+        Get the context of the open project
+        
+        Returns
+        -------
+        ProjectContext or None
+            ``None`` if none is open
+        '''
+        return self._context
+    
+    @property
+    def journal(self):
+        '''
+        Get the journal of the open project
+        
+        Returns
+        -------
+        Journal or None
+            ``None`` if none is open
+        '''
+        return self._journal
+    
+    def summary(self, name):
+        '''
+        Get summary of a project
+        
+        Of the open project, it is up to date. Of others, it is as of when they
+        were last closed.
+        
+        Parameters
+        ----------
+        name : str
+        
+        Returns
+        -------
+        ProjectSummary or None
+            ``None`` if it has not been closed yet since it was created
+            
+        Raises
+        ------
+        KeyError
+            If there is no such project
+        '''
+        self._read()
+        if name == self._current:
+            return summarise(self._context)
+        return self._summaries[name]
+    
+    def directory(self, name):
+        '''
+        Get the directory a project is stored in
+        
+        Parameters
+        ----------
+        name : str
+        
+        Returns
+        -------
+        pathlib.Path
+        '''
+        return self._directory / 'projects' / name
+    
+    def create(self, name):
+        '''
+        Add an empty project
+        
+        Parameters
+        ----------
+        name : str
+        
+        Raises
+        ------
+        ValueError
+            If the name is invalid or already taken
+        '''
+        self._read()
+        if not name or name in ('.', '..') or '/' in name or os.sep in name:
+            raise ValueError('Invalid project name: {!r}'.format(name))
+        if name in self._summaries:
+            raise ValueError('Project already exists: {}'.format(name))
+        self.directory(name).mkdir(parents=True)
+        self._summaries[name] = None
+        self._write()
+        
+    def open(self, name=None):
+        '''
+        Open a project, closing the open one
+        
+        Parameters
+        ----------
+        name : str or None
+            Project to open. If ``None``, the project which was open last, or
+            the default project. The default project is created when missing.
+            
+        Returns
+        -------
+        ProjectContext
+            Context of the opened project
+            
+        Raises
+        ------
+        KeyError
+            If there is no such project
+        '''
+        self._read()
+        if name is None:
+            name = self._last if self._last in self._summaries else self.default
+            if name not in self._summaries:
+                self.create(name)
+        elif name not in self._summaries:
+            raise KeyError('No such project: {}'.format(name))
+        if name == self._current:
+            return self._context
+        self.close()
+        context = self._new_context()
+        journal = self.journal_type(self.directory(name))
+        journal.open(context)
+        self._current = self._last = name
+        self._context = context
+        self._journal = journal
+        self._write()
+        self.events.switched.emit(self)
+        return context
+    
+    def sync(self):
+        '''
+        Sync the journal of the open project, see `Journal.sync`
+        '''
+        if self._journal:
+            self._journal.sync()
+        
+    def close(self):
+        '''
+        Close the open project, if any, caching its summary
+        '''
+        if self._current is None:
+            return
+        self._summaries[self._current] = summarise(self._context)
+        self._journal.close()
+        self._context.background_simulation.shutdown()
+        self._current = None
+        self._context = None
+        self._journal = None
+        self._write()
+        
+    @property
+    def _path(self):
+        return self._directory / 'projects.json'
+    
+    def _read(self):
+        if self._summaries is not None:
+            return
+        if self._path.exists():
+            with self._path.open(encoding='utf-8') as file:
+                registry = json.load(file)
+            self._last = registry['open']
+            self._summaries = {name: _decode_summary(summary) for name, summary in registry['projects'].items()}
+        else:
+            self._summaries = {}
+            self._migrate()
+            
+    def _migrate(self):
+        '''
+        Move a project stored directly in the data directory to the default project
+        '''
+        files = [path for path in self._directory.glob('*') if path.name in ('project.sqlite', 'effort.log') or path.name.startswith('journal.')]
+        if files:
+            directory = self.directory(self.default)
+            directory.mkdir(parents=True)
+            for path in files:
+                path.rename(directory / path.name)
+            self._summaries[self.default] = None
+            self._write()
+            
+    def _write(self):
+        registry = {
+            'open': self._last,
+            'projects': {name: _encode_summary(summary) for name, summary in self._summaries.items()},
+        }
+        self._directory.mkdir(parents=True, exist_ok=True)
+        temporary = self._path.with_name(self._path.name + '.tmp')
+        with temporary.open('w', encoding='utf-8') as file:
+            json.dump(registry, file, ensure_ascii=False, indent=1)
+        os.replace(str(temporary), str(self._path))
+        
+_datetime_format = '%Y-%m-%dT%H:%M'
+
+def _encode_summary(summary):
+    if summary is None:
+        return None
+    return {
+        'effort_spent': summary.effort_spent // timedelta(minutes=1),
+        'predicted_end': None if summary.predicted_end is None else summary.predicted_end.strftime(_datetime_format),
+        'ready_count': summary.ready_count,
+        'ready': summary.ready,
+    }
+
+def _decode_summary(summary):
+    if summary is None:
+        return None
+    return ProjectSummary(
+        effort_spent=timedelta(minutes=summary['effort_spent']),
+        predicted_end=None if summary['predicted_end'] is None else datetime.strptime(summary['predicted_end'], _datetime_format),
+        ready_count=summary['ready_count'],
+        ready=[tuple(task) for task in summary['ready']],
+    )
@@ -0,0 +1,274 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Timesheet reports
+
+Rows are generated by walking the report periods in time order and, for each
+period, the task tree depth-first. Totals come from the context's effort index,
+or from a single pass over an effort log, and subtrees without effort in a
+period are skipped entirely, so memory use does not grow with the length of the
+effort history.
+
+A timesheet across projects reports the total of each project instead. It does
+not load the projects, it totals their effort logs in parallel.
+'''
+
+from enum import Enum
+from collections import namedtuple, defaultdict
+from itertools import chain
+from datetime import date, timedelta
+from html import escape
+from functools import partial
+from garage_pm.store import effort_totals
+import csv
+
+class Period(Enum):
+    
+    '''
+    Length of a timesheet period
+    '''
+    
+    day = 'day'
+    week = 'week'
+    month = 'month'
+    
+TimesheetRow = namedtuple('TimesheetRow', 'begin end task effort')
+TimesheetRow.__doc__ = '''
+Effort spent on a task (subtree) in [begin, end)
+
+Attributes
+----------
+begin : datetime.date
+end : datetime.date
+task : Task or str
+    Task, or name of the project in a timesheet across projects
+effort : datetime.timedelta
+'''
+
+def timesheet(context, begin, end, period=Period.week, subtotals=False, effort_log=None):
+    '''
+    Generate timesheet rows
+    
+    Parameters
+    ----------
+    context : Context
+    begin : datetime.date
+        First day to report on
+    end : datetime.date
+        Day after the last day to report on
+    period : Period
+        Length of each period. Periods are aligned to the start of the week
+        (Monday) or month, the first and last period are clipped to [begin,
+        end).
+    subtotals : bool
+        If ``False``, report the effort of leaf tasks. If ``True``, report the
+        total effort of each task's subtree instead, including branch tasks and
+        the root task. Either way an archived task is reported as a single row
+        with the total of its subtree, its subtree is not loaded.
+    effort_log : garage_pm.store.EffortLog or None
+        If given, total the effort of all periods in a single pass over the log
+        instead of querying the effort index per task and period.
+        
+    Yields
+    ------
+    TimesheetRow
+        Rows ordered by period, then depth-first by task. Rows with no
+        effort are omitted.
+    '''
+    index = context.effort_index
+    periods = list(_periods(begin, end, period))
+    if effort_log is not None:
+        root = context.root_task
+        tasks = {task.id: task for task in chain((root,), root._loaded_descendants)}
+        archived = [task for task in tasks.values() if task.is_archived]
+        efforts = effort_log.per_period(periods)
+    for i, (period_begin, period_end) in enumerate(periods):
+        if effort_log is None:
+            def total(task):
+                return index.total(period_begin, period_end, task)
+        else:
+            total = _subtree_totals(index, efforts[i], tasks, archived, period_begin, period_end).get
+        stack = [iter((context.root_task,))]
+        while stack:
+            task = next(stack[-1], None)
+            if task is None:
+                stack.pop()
+                continue
+            effort = total(task)
+            if not effort:
+                continue
+            if subtotals or task.is_leaf or task.is_archived:
+                yield TimesheetRow(period_begin, period_end, task, effort)
+            children = task._loaded_children
+            if children:
+                stack.append(iter(children))
+                
+def _subtree_totals(index, efforts, tasks, archived, begin, end):
+    '''
+    Get effort spent on each subtree in [begin, end) from the effort per task
+    
+    The descendants of archived tasks are not loaded, so these are totalled
+    by the effort index instead.
+    
+    Parameters
+    ----------
+    efforts : {int => datetime.timedelta}
+        Effort per task id in [begin, end), see `EffortLog.per_period`
+    
+    Returns
+    -------
+    {Task => datetime.timedelta}
+        Effort of subtrees with effort
+    '''
+    task_efforts = [(tasks.get(id_), effort) for id_, effort in efforts.items()]
+    task_efforts.extend((task, index.total(begin, end, task)) for task in archived)
+    totals = defaultdict(timedelta)
+    for task, effort in task_efforts:
+        if task is not None and effort:  # None when disposed or archived
+            totals[task] += effort
+            for ancestor in task.ancestors:
+                totals[ancestor] += effort
+    return totals
+
+def project_timesheet(projects, begin, end, period=Period.week, executor=None):
+    '''
+    Generate timesheet rows of the total of each project
+    
+    The effort of each project is totalled in a worker process, see
+    `garage_pm.store.effort_totals`, and the results are merged into rows.
+    
+    Parameters
+    ----------
+    projects : [(str, pathlib.Path)]
+        Name and directory of each project to report on
+    begin : datetime.date
+    end : datetime.date
+    period : Period
+        See `timesheet`
+    executor : concurrent.futures.Executor or None
+        Executor to total projects on. If ``None``, a process pool with a
+        worker per CPU.
+        
+    Yields
+    ------
+    TimesheetRow
+        Rows ordered by period, then by project in the given order. Rows with
+        no effort are omitted.
+        
+    Raises
+    ------
+    ValueError
+        If the effort of a project cannot be totalled without opening it
+    '''
+    periods = list(_periods(begin, end, period))
+    names, directories = zip(*projects) if projects else ((), ())
+    total = partial(effort_totals, periods=periods)
+    if executor is None:
+        from concurrent.futures import ProcessPoolExecutor  # imported here, loading multiprocessing slows down other commands
+        with ProcessPoolExecutor() as executor:
+            totals = list(executor.map(total, directories))
+    else:
+        totals = list(executor.map(total, directories))
+    for i, (period_begin, period_end) in enumerate(periods):
+        for name, project_totals in zip(names, totals):
+            effort = project_totals[i]
+            if effort:
+                yield TimesheetRow(period_begin, period_end, name, effort)
+                
+def _periods(begin, end, period):
+    '''
+    Yields
+    ------
+    (datetime.date, datetime.date)
+        [begin, end) of each period, clipped to the given begin and end
+    '''
+    current = begin
+    while current < end:
+        if period == Period.day:
+            next_ = current + timedelta(days=1)
+        elif period == Period.week:
+            next_ = current + timedelta(days=7 - current.weekday())
+        else:
+            next_ = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+        next_ = min(next_, end)
+        yield current, next_
+        current = next_
+        
+def task_path(task):
+    '''
+    Get name of task prefixed by the names of its ancestors
+    
+    Returns
+    -------
+    str
+        E.g. ``Root task/task1/task11``
+    '''
+    return '/'.join(x.name for x in tuple(task.ancestors) + (task,))
+
+def _hours(effort):
+    return '{:.2f}'.format(effort / timedelta(hours=1))
+
+def _header(subject):
+    return ('Begin', 'End', subject, 'Hours')
+
+def _row_fields(row, date_format):
+    task = row.task if isinstance(row.task, str) else task_path(row.task)
+    return (row.begin.strftime(date_format), (row.end - timedelta(days=1)).strftime(date_format), task, _hours(row.effort))
+
+def write_csv(rows, file, date_format='%Y-%m-%d', subject='Task'):
+    '''
+    Write timesheet rows as CSV, one row at a time
+    
+    Parameters
+    ----------
+    rows : iterable(TimesheetRow)
+    file : file-like
+        Text file to write to
+    date_format : str
+        Format of the first and last day of each period, as understood by
+        `datetime.date.strftime`
+    subject : str
+        Header of the task column, e.g. ``Project`` for `project_timesheet`
+    '''
+    writer = csv.writer(file)
+    writer.writerow(_header(subject))
+    for row in rows:
+        writer.writerow(_row_fields(row, date_format))
+        
+def write_html(rows, file, date_format='%Y-%m-%d', subject='Task'):
+    '''
+    Write timesheet rows as HTML table, one row at a time
+    
+    Parameters
+    ----------
+    rows : iterable(TimesheetRow)
+    file : file-like
+        Text file to write to
+    date_format : str
+        Format of the first and last day of each period, as understood by
+        `datetime.date.strftime`
+    subject : str
+        Header of the task column, see `write_csv`
+    '''
+    def write_row(fields, tag):
+        file.write('<tr>{}</tr>\n'.format(''.join('<{0}>{1}</{0}>'.format(tag, escape(field)) for field in fields)))
+    file.write('<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>Timesheet</title></head>\n<body>\n<table>\n')
+    write_row(_header(subject), 'th')
+    for row in rows:
+        write_row(_row_fields(row, date_format), 'td')
+    file.write('</table>\n</body>\n</html>\n')
@@ -0,0 +1,1471 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Project storage
+
+A project is stored as a snapshot, an SQLite database, plus a journal of the
+changes made since. The effort spent is also kept in a binary log for fast
+queries.
+'''
+
+from garage_pm.domain import TaskTreeBuilder, DirtyTasks, PlanningState, EstimateType, Interval, Task, Change, Subtree
+from datetime import datetime, date, timedelta, time as daytime  # the time module is imported as well
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby, chain
+from collections import defaultdict
+from functools import partial
+from operator import itemgetter
+from enum import Enum
+import numpy as np
+import threading
+import sqlite3
+import logging
+import mmap
+import json
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS meta (
+    generation INTEGER NOT NULL,  -- of the journal continuing the snapshot
+    project_start INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS weekly_hours (  -- WorkingCalendar.weekly_hours
+    weekday INTEGER NOT NULL,  -- 0 is Monday
+    begin INTEGER NOT NULL,  -- minutes since midnight
+    end INTEGER NOT NULL  -- minutes since midnight, 0 is midnight at the end of the day
+);
+CREATE TABLE IF NOT EXISTS holiday (
+    day INTEGER PRIMARY KEY  -- date.toordinal()
+);
+CREATE TABLE IF NOT EXISTS calendar_exception (
+    day INTEGER NOT NULL,  -- date.toordinal()
+    begin INTEGER,  -- NULL for a day without working time
+    end INTEGER
+);
+CREATE TABLE IF NOT EXISTS task (
+    id INTEGER PRIMARY KEY,  -- Task.id, the root task is not stored
+    parent INTEGER NOT NULL,
+    position INTEGER NOT NULL,  -- index in the children of the parent
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    planning_state TEXT NOT NULL,
+    delegated INTEGER NOT NULL,
+    duration INTEGER,
+    planned_start_override INTEGER
+);
+CREATE TABLE IF NOT EXISTS dependency (
+    task INTEGER NOT NULL,
+    dependency INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS estimate (
+    task INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    minutes INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS effort (
+    task INTEGER NOT NULL,
+    begin INTEGER NOT NULL,
+    end INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS task_parent ON task (parent);
+CREATE INDEX IF NOT EXISTS dependency_task ON dependency (task);
+CREATE INDEX IF NOT EXISTS dependency_dependency ON dependency (dependency);
+CREATE INDEX IF NOT EXISTS estimate_task ON estimate (task);
+CREATE INDEX IF NOT EXISTS effort_task ON effort (task);
+'''
+
+_tables = ('meta', 'weekly_hours', 'holiday', 'calendar_exception', 'task', 'dependency', 'estimate', 'effort')
+_calendar_tables = ('weekly_hours', 'holiday', 'calendar_exception')
+_inserts = {
+    'weekly_hours': 'INSERT INTO weekly_hours VALUES (?, ?, ?)',
+    'holiday': 'INSERT INTO holiday VALUES (?)',
+    'calendar_exception': 'INSERT INTO calendar_exception VALUES (?, ?, ?)',
+    'task': 'INSERT INTO task VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+    'dependency': 'INSERT INTO dependency VALUES (?, ?)',
+    'estimate': 'INSERT INTO estimate VALUES (?, ?, ?)',
+    'effort': 'INSERT INTO effort VALUES (?, ?, ?)',
+}
+
+class Store(object):
+    
+    '''
+    SQLite database of a project
+    
+    Saving writes all rows with bulk inserts in a single transaction, saving
+    changes writes only the rows of dirty tasks and the settings of the
+    project, such as its start and working calendar. Loading
+    reads each table with a single query and builds the task tree in one pass
+    with `TaskTreeBuilder`.
+    
+    Datetimes are stored as whole minutes since `datetime.min`, durations as
+    whole minutes.
+    
+    Parameters
+    ----------
+    path : pathlib.Path
+        Database file. It is created when missing.
+    '''
+    
+    def __init__(self, path):
+        self._path = path
+        
+    @property
+    def path(self):
+        return self._path
+    
+    @property
+    def generation(self):
+        '''
+        Get generation of the journal which continues the stored project
+        
+        Returns
+        -------
+        int
+            0 if nothing has been saved yet
+        '''
+        with closing(self._connect()) as connection:
+            row = connection.execute('SELECT generation FROM meta').fetchone()
+        return row[0] if row else 0
+        
+    @property
+    def saved(self):
+        '''
+        Get whether a project has been saved
+        '''
+        with closing(self._connect()) as connection:
+            return connection.execute('SELECT 1 FROM meta').fetchone() is not None
+        
+    def save(self, context, generation=0):
+        '''
+        Save project, replacing what was stored
+        
+        Parameters
+        ----------
+        context : Context
+        generation : int
+            Generation of the journal which continues the saved project
+        '''
+        self._write(self._rows(context), generation)
+        
+    def _rows(self, context):
+        '''
+        Get the rows to save, which no longer refer to the project
+        
+        Returns
+        -------
+        ([tuple], [tuple], [tuple], [tuple], (tuple, {str: [tuple]}))
+            Rows of the task, dependency, estimate and effort table, and the
+            settings of the project (see `_project_rows`)
+        '''
+        tasks = []
+        dependencies = []
+        estimates = []
+        efforts = []
+        for task, position in _depth_first(context.root_task):
+            tasks.append(_task_row(task, position))
+            dependencies.extend(_dependency_rows(task))
+            estimates.extend(_estimate_rows(task))
+            efforts.extend(_effort_rows(task))
+        return tasks, dependencies, estimates, efforts, _project_rows(context)
+    
+    def _write(self, rows, generation):
+        '''
+        Replace what was stored by rows from `_rows`
+        '''
+        tasks, dependencies, estimates, efforts, project = rows
+        with closing(self._connect()) as connection:
+            with connection:
+                for table in _tables:
+                    connection.execute('DELETE FROM {}'.format(table))
+                _insert_project(connection, project, generation)
+                connection.executemany(_inserts['task'], tasks)
+                connection.executemany(_inserts['dependency'], dependencies)
+                connection.executemany(_inserts['estimate'], estimates)
+                connection.executemany(_inserts['effort'], efforts)
+                
+    def save_changes(self, context, dirty, generation=0):
+        '''
+        Save the changes to a project, which was saved before
+        
+        Only the rows of dirty tasks are written, so this takes time
+        proportional to the changes, not to the project. The settings of the
+        project are small, they are always written.
+        
+        Parameters
+        ----------
+        context : Context
+        dirty : DirtyTasks
+            Changes since the project was saved. Cleared afterwards.
+        generation : int
+            Generation of the journal which continues the saved project
+        '''
+        self._update(self._changed_rows(context, dirty), generation)
+        dirty.clear()
+        
+    def _changed_rows(self, context, dirty):
+        '''
+        Get the rows to save the changes in dirty, which no longer refer to the project
+        
+        Returns
+        -------
+        ([tuple], {str: ([int], [tuple])}, [int], (tuple, {str: [tuple]}))
+            Rows of the task table to insert or replace; per other table, the
+            ids of the tasks whose rows to replace and their rows; ids of
+            disposed tasks; the settings of the project (see `_project_rows`)
+        '''
+        graph = context.task_dependency_graph
+        def stored(tasks):
+            return [task for task in tasks if task.start_node in graph and not task._is_root]
+        
+        tasks = {}
+        for parent in dirty.parents:
+            if parent.start_node in graph:
+                for position, child in enumerate(parent.children):
+                    tasks[child.id] = _task_row(child, position)
+        for task in stored(dirty.tasks):
+            if task.id not in tasks:
+                tasks[task.id] = _task_row(task, task.parent.children.index(task))
+        
+        replaced = {}
+        for table, dirty_tasks, rows in (
+            ('dependency', dirty.dependencies, _dependency_rows),
+            ('estimate', dirty.effort_estimates, _estimate_rows),
+            ('effort', dirty.effort_spent, _effort_rows),
+        ):
+            dirty_tasks = stored(dirty_tasks)
+            replaced[table] = ([task.id for task in dirty_tasks], list(chain.from_iterable(map(rows, dirty_tasks))))
+        return list(tasks.values()), replaced, [task.id for task in dirty.disposed], _project_rows(context)
+    
+    def _update(self, rows, generation):
+        '''
+        Update what was stored with rows from `_changed_rows`
+        '''
+        tasks, replaced, disposed, project = rows
+        with closing(self._connect()) as connection:
+            with connection:
+                for table in ('meta',) + _calendar_tables:
+                    connection.execute('DELETE FROM {}'.format(table))
+                _insert_project(connection, project, generation)
+                connection.executemany('INSERT OR REPLACE INTO task VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', tasks)
+                for table, (ids, rows_) in replaced.items():
+                    connection.executemany('DELETE FROM {} WHERE task = ?'.format(table), ((id_,) for id_ in ids))
+                    connection.executemany(_inserts[table], rows_)
+                
+                # Delete disposed tasks and their descendants. Tasks moved out
+                # of them have been updated above, so are not included.
+                connection.execute('CREATE TEMP TABLE disposed (id INTEGER PRIMARY KEY)')
+                connection.executemany('INSERT OR IGNORE INTO disposed VALUES (?)', ((id_,) for id_ in disposed))
+                connection.execute('''
+                    INSERT OR IGNORE INTO disposed
+                    WITH RECURSIVE descendant(id) AS (
+                        SELECT id FROM disposed
+                        UNION SELECT task.id FROM task JOIN descendant ON task.parent = descendant.id
+                    )
+                    SELECT id FROM descendant
+                ''')
+                connection.execute('DELETE FROM task WHERE id IN disposed')
+                connection.execute('DELETE FROM dependency WHERE task IN disposed OR dependency IN disposed')
+                connection.execute('DELETE FROM estimate WHERE task IN disposed')
+                connection.execute('DELETE FROM effort WHERE task IN disposed')
+        
+    def _effort_records(self, chunk_size=10000):
+        '''
+        Get all rows of the effort table in chunks
+        
+        Yields
+        ------
+        [(int, int, int)]
+            Task id, begin and end of effort intervals
+        '''
+        with closing(self._connect()) as connection:
+            cursor = connection.execute('SELECT task, begin, end FROM effort')
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        
+    def load(self, context):
+        '''
+        Load project into a context which only contains the root task
+        
+        The settings of the project are loaded first, e.g. the project start
+        and working calendar.
+        
+        Finished branches with only finished or cancelled tasks in their
+        subtree, which no dependency enters or leaves, are loaded as archived
+        tasks (see `ArchivedTaskState`). Of their subtree only the effort spent
+        and the samples to calibrate estimates with are read, it is loaded
+        when needed.
+        
+        Parameters
+        ----------
+        context : Context
+        
+        Raises
+        ------
+        ValueError
+            If the stored dependencies contain a cycle
+        '''
+        with closing(self._connect()) as connection:
+            row = connection.execute('SELECT project_start FROM meta').fetchone()
+            weekly_hours = connection.execute('SELECT weekday, begin, end FROM weekly_hours').fetchall()
+            holidays = connection.execute('SELECT day FROM holiday').fetchall()
+            exceptions = connection.execute('SELECT day, begin, end FROM calendar_exception').fetchall()
+        if weekly_hours:  # else saved before the calendar was stored, keep the default
+            context.calendar._load(*_calendar(weekly_hours, holidays, exceptions))
+        if row:
+            context.scheduler._set_project_start(_datetime(row[0]))
+        with TaskTreeBuilder(context) as builder:
+            self._load(builder, context.root_task)
+            
+    def _load(self, builder, root):
+        '''
+        Load the subtree of root, which has no children yet
+        '''
+        with closing(self._connect()) as connection:
+            connection.execute('''
+                CREATE TEMP TABLE subtree AS
+                WITH RECURSIVE subtree(id, parent, planning_state) AS (
+                    SELECT id, parent, planning_state FROM task WHERE parent = ?
+                    UNION ALL SELECT task.id, task.parent, task.planning_state FROM task JOIN subtree ON task.parent = subtree.id
+                )
+                SELECT * FROM subtree
+            ''', (root.id,))
+            dependencies = connection.execute('''
+                SELECT task, dependency FROM dependency
+                WHERE task IN (SELECT id FROM subtree) OR dependency IN (SELECT id FROM subtree)
+            ''').fetchall()
+            hidden = _hidden(root.id, connection.execute('SELECT * FROM subtree'), dependencies)
+            connection.execute('CREATE TEMP TABLE hidden (id INTEGER PRIMARY KEY, archived INTEGER NOT NULL)')
+            connection.executemany('INSERT INTO hidden VALUES (?, ?)', hidden.items())
+            connection.execute('CREATE TEMP TABLE loaded AS SELECT id FROM subtree WHERE id NOT IN (SELECT id FROM hidden)')
+            
+            # Loaded tasks
+            tasks = connection.execute('SELECT * FROM task WHERE id IN (SELECT id FROM loaded) ORDER BY parent, position').fetchall()
+            estimates = _group(connection.execute('SELECT task, type, minutes FROM estimate WHERE task IN (SELECT id FROM loaded) ORDER BY task'))
+            efforts = _group(connection.execute('SELECT task, begin, end FROM effort WHERE task IN (SELECT id FROM loaded) ORDER BY task, begin'))
+            
+            # Summaries of archived tasks
+            archived_efforts = _group(connection.execute('''
+                SELECT hidden.archived, begin, end FROM effort JOIN hidden ON effort.task = hidden.id
+                ORDER BY hidden.archived
+            '''))
+            actual_efforts = dict(connection.execute('''
+                SELECT task, sum(end - begin) FROM effort JOIN hidden ON effort.task = hidden.id
+                GROUP BY task
+            '''))
+            samples = defaultdict(list)
+            rows = connection.execute('''
+                SELECT hidden.archived, task, type, minutes FROM estimate JOIN hidden ON estimate.task = hidden.id
+                WHERE task IN (SELECT id FROM subtree WHERE planning_state = 'finished')
+                ORDER BY hidden.archived, task
+            ''')
+            for (archived, task), estimates_ in groupby(rows, itemgetter(0, 1)):
+                samples[archived].append((
+                    {EstimateType[type_]: _timedelta(minutes) for _, _, type_, minutes in estimates_},
+                    _timedelta(actual_efforts.get(task, 0))
+                ))
+        archived = set(hidden.values())
+        children = _group(tasks, 1)
+        
+        tasks_ = {root.id: root}
+        stack = list(reversed(children.get(root.id, ())))
+        while stack:
+            id_, parent, _, name, description, planning_state, delegated, duration, planned_start_override = stack.pop()
+            if id_ in archived:
+                tasks_[id_] = builder.add_archived_task(
+                    tasks_[parent], name, self._load, description,
+                    [Interval(_datetime(begin), _datetime(end)) for _, begin, end in archived_efforts.get(id_, ())],
+                    samples[id_], id_
+                )
+            else:
+                tasks_[id_] = builder.add_task(
+                    tasks_[parent], name, description, PlanningState[planning_state], bool(delegated),
+                    _timedelta(duration), _datetime(planned_start_override),
+                    {EstimateType[type_]: _timedelta(minutes) for _, type_, minutes in estimates.get(id_, ())},
+                    [Interval(_datetime(begin), _datetime(end)) for _, begin, end in efforts.get(id_, ())],
+                    id_
+                )
+                stack.extend(reversed(children.get(id_, ())))
+        del tasks_[root.id]  # its dependencies have been loaded already
+        for task, dependency in dependencies:
+            if task in tasks_ and dependency in tasks_:
+                builder.add_dependency(tasks_[task], tasks_[dependency])
+                
+    def _find(self, tasks, id_):
+        '''
+        Get task by id, loading the archived tasks it is in
+        
+        Parameters
+        ----------
+        tasks : {int => Task}
+            Loaded tasks by id, tasks loaded by this call are added
+        id_ : int
+        
+        Returns
+        -------
+        Task
+        '''
+        if id_ not in tasks:
+            with closing(self._connect()) as connection:
+                ancestors = [row[0] for row in connection.execute('''
+                    WITH RECURSIVE ancestor(id) AS (
+                        SELECT parent FROM task WHERE id = ?
+                        UNION ALL SELECT task.parent FROM task JOIN ancestor ON task.id = ancestor.id
+                    )
+                    SELECT id FROM ancestor
+                ''', (id_,))]
+            for ancestor in reversed(ancestors):
+                task = tasks[ancestor]
+                if task.is_archived:
+                    tasks.update((child.id, child) for child in task.children)
+        return tasks[id_]
+                
+    def _connect(self):
+        connection = sqlite3.connect(str(self._path))
+        connection.executescript(_schema)
+        return connection
+    
+_effort_record = np.dtype([('task', '<i8'), ('begin', '<i8'), ('end', '<i8')])
+_header_task = np.iinfo(np.int64).min  # task of the header record
+
+class EffortLog(object):
+    
+    '''
+    Binary log of effort spent, read through a memory map
+    
+    Each effort interval is a fixed-width record of task id, begin and end,
+    little-endian 64-bit integers with begin and end in minutes since
+    `datetime.min`. Removing an interval appends its record with the bitwise
+    complement of the task id, which cancels the earlier record in sums.
+    Appending records is a single write. Queries compute on a NumPy view of the
+    memory mapped file, so they read straight from the page cache without
+    creating `Interval` objects.
+    
+    The first record is a header: the generation of the snapshot the log
+    continues and the number of records it had at that snapshot, see
+    `Journal`. Disposing a task appends the removal of the effort of its
+    subtree, so the log totals to the effort spent on the project.
+    
+    Parameters
+    ----------
+    path : pathlib.Path
+        Log file. It is created when missing.
+    '''
+    
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()  # the journal may write on a worker thread
+        self._fd = None
+        self._size = 0  # of the file, in bytes
+        self._map = None
+        self._view = None  # array of the mapped records, including the header
+        self._open()
+        if self._size < _effort_record.itemsize:
+            self._write_header(-1, 0)  # matches no snapshot
+            
+    def _open(self):
+        self._fd = os.open(str(self._path), os.O_RDWR | os.O_CREAT)
+        self._size = os.fstat(self._fd).st_size
+        self._size -= self._size % _effort_record.itemsize  # drop a partial record
+        self._view = None
+        
+    @property
+    def path(self):
+        return self._path
+        
+    @property
+    def generation(self):
+        '''
+        Get the generation of the snapshot the log continues
+        '''
+        return int(self._records(header=True)[0]['begin'])
+    
+    @property
+    def start(self):
+        '''
+        Get the number of records in the log at the snapshot it continues
+        
+        The records after it are those of the journal.
+        '''
+        return int(self._records(header=True)[0]['end'])
+        
+    @property
+    def records(self):
+        '''
+        Get all records
+        
+        Returns
+        -------
+        np.array
+            Read-only view of the file with fields ``task``, ``begin`` and ``end``
+        '''
+        return self._records()
+    
+    def __len__(self):
+        return self._size // _effort_record.itemsize - 1
+    
+    def _records(self, header=False):
+        with self._lock:
+            if self._view is None or len(self._view) * _effort_record.itemsize != self._size:
+                # Remap. Views handed out earlier keep the old map alive.
+                self._map = mmap.mmap(self._fd, self._size, access=mmap.ACCESS_READ)
+                self._view = np.frombuffer(self._map, _effort_record)
+            return self._view if header else self._view[1:]
+        
+    def append(self, records):
+        '''
+        Append records
+        
+        Parameters
+        ----------
+        records : iterable((int, int, int))
+            Task id, begin and end. The task id of a removed interval is
+            complemented.
+        '''
+        data = np.array(list(records), dtype=_effort_record).tobytes()
+        with self._lock:
+            os.pwrite(self._fd, data, self._size)
+            self._size += len(data)
+            
+    def truncate(self, length):
+        '''
+        Drop all but the first `length` records
+        '''
+        with self._lock:
+            self._size = (length + 1) * _effort_record.itemsize
+            os.ftruncate(self._fd, self._size)
+            
+    def start_generation(self, generation):
+        '''
+        Mark the records so far as part of the snapshot of a generation
+        '''
+        self._write_header(generation, len(self))
+        
+    def _write_header(self, generation, start):
+        data = np.array([(_header_task, generation, start)], dtype=_effort_record).tobytes()
+        with self._lock:
+            os.pwrite(self._fd, data, 0)
+            self._size = max(self._size, len(data))
+            
+    def rebuild(self, chunks, generation):
+        '''
+        Replace the records by those of a snapshot
+        
+        Parameters
+        ----------
+        chunks : iterable([(int, int, int)])
+            Records of the snapshot, e.g. from `Store._effort_records`
+        generation : int
+            Generation of the snapshot
+        '''
+        temporary = self._path.with_name(self._path.name + '.new')
+        count = 0
+        with temporary.open('wb') as file:
+            file.write(bytes(_effort_record.itemsize))  # header, see below
+            for chunk in chunks:
+                file.write(np.array(chunk, dtype=_effort_record).tobytes())
+                count += len(chunk)
+            file.seek(0)
+            file.write(np.array([(_header_task, generation, count)], dtype=_effort_record).tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        with self._lock:
+            os.replace(str(temporary), str(self._path))
+            os.close(self._fd)
+            self._open()
+            
+    def total(self, begin=None, end=None, tasks=None):
+        '''
+        Get total effort spent in [begin, end)
+        
+        Parameters
+        ----------
+        begin : datetime.date or None
+            First day to include. If ``None``, include everything before `end`.
+        end : datetime.date or None
+            Day after the last day to include. If ``None``, include everything
+            since `begin`.
+        tasks : iterable(int) or None
+            Ids of the tasks to total. If ``None``, all tasks in the log.
+            
+        Returns
+        -------
+        datetime.timedelta
+        '''
+        ids, minutes = self._minutes(begin, end)
+        if tasks is not None:
+            minutes = minutes[np.isin(ids, np.fromiter(tasks, np.int64))]
+        return timedelta(minutes=int(minutes.sum()))
+    
+    def per_task(self, begin=None, end=None):
+        '''
+        Get effort spent in [begin, end) per task
+        
+        Parameters
+        ----------
+        begin : datetime.date or None
+        end : datetime.date or None
+            See `total`
+            
+        Returns
+        -------
+        {int => datetime.timedelta}
+            Effort per task id, of the tasks with effort in the range
+        '''
+        ids, minutes = self._minutes(begin, end)
+        ids, inverse = np.unique(ids, return_inverse=True)
+        totals = np.bincount(inverse, weights=minutes, minlength=len(ids)).round().astype(np.int64)
+        return {id_: timedelta(minutes=total) for id_, total in zip(ids.tolist(), totals.tolist()) if total}
+    
+    def per_period(self, periods):
+        '''
+        Get effort spent per task in each period, in a single pass over the log
+        
+        Parameters
+        ----------
+        periods : [(datetime.date, datetime.date)]
+            [begin, end) of each period, in order and not overlapping
+            
+        Returns
+        -------
+        [{int => datetime.timedelta}]
+            Per period, the effort per task id of the tasks with effort in it
+        '''
+        records = self.records
+        begins = np.array([_day_minutes(begin) for begin, _ in periods], dtype=np.int64)
+        ends = np.array([_day_minutes(end) for _, end in periods], dtype=np.int64)
+        
+        # Pair each record with each period it overlaps
+        first = np.searchsorted(ends, records['begin'], side='right')
+        counts = np.maximum(np.searchsorted(begins, records['end'], side='left') - first, 0)
+        record = np.repeat(np.arange(len(records)), counts)
+        period = first[record] + np.arange(len(record)) - np.repeat(np.cumsum(counts) - counts, counts)
+        
+        tasks = records['task'][record]
+        removed = tasks < 0
+        ids = np.where(removed, ~tasks, tasks)
+        minutes = np.minimum(records['end'][record], ends[period]) - np.maximum(records['begin'][record], begins[period])
+        stride = int(ids.max()) + 1 if len(ids) else 1
+        keys, inverse = np.unique(period * stride + ids, return_inverse=True)
+        totals = np.bincount(inverse, weights=np.where(removed, -minutes, minutes), minlength=len(keys)).round().astype(np.int64)
+        efforts = [{} for _ in periods]
+        for key, total in zip(keys.tolist(), totals.tolist()):
+            if total:
+                efforts[key // stride][key % stride] = timedelta(minutes=total)
+        return efforts
+    
+    def _minutes(self, begin, end):
+        '''
+        Get the task id and signed minutes in [begin, end) of each record
+        '''
+        records = self.records
+        tasks = records['task']
+        removed = tasks < 0
+        begin = records['begin'] if begin is None else np.maximum(records['begin'], _day_minutes(begin))
+        end = records['end'] if end is None else np.minimum(records['end'], _day_minutes(end))
+        minutes = np.maximum(end - begin, 0)
+        return np.where(removed, ~tasks, tasks), np.where(removed, -minutes, minutes)
+        
+    def close(self):
+        with self._lock:
+            self._view = None
+            self._map = None
+            os.close(self._fd)
+    
+def effort_totals(directory, periods):
+    '''
+    Get effort spent on a stored project per period, without loading it
+    
+    Totals come from the effort log of the project. Of a project which has
+    not been opened since its snapshot was saved, e.g. an imported project,
+    they come from the snapshot instead. Neither creates Qt objects, so this
+    can run in worker processes.
+    
+    Parameters
+    ----------
+    directory : pathlib.Path
+        Directory of the project, see `Journal`
+    periods : [(datetime.date, datetime.date)]
+        [begin, end) of each period
+        
+    Returns
+    -------
+    [datetime.timedelta]
+        Total of each period
+        
+    Raises
+    ------
+    ValueError
+        If the effort log is out of date with the journal, e.g. after a crash.
+        Opening the project repairs it.
+    '''
+    store_path = directory / 'project.sqlite'
+    if not store_path.exists():
+        return [timedelta()] * len(periods)
+    generation = Store(store_path).generation
+    log_path = directory / 'effort.log'
+    if log_path.exists():
+        log = EffortLog(log_path)
+        try:
+            if log.generation == generation and len(log) >= log.start:
+                return [log.total(begin, end) for begin, end in periods]
+        finally:
+            log.close()
+    journal_path = directory / 'journal.{}'.format(generation)
+    if journal_path.exists() and journal_path.stat().st_size:
+        raise ValueError('Effort log of project {} is out of date, open the project to repair it'.format(directory))
+    
+    # Only the snapshot
+    records = np.concatenate([np.array(chunk, dtype=_effort_record) for chunk in Store(store_path)._effort_records()] or [np.array([], dtype=_effort_record)])
+    totals = []
+    for begin, end in periods:
+        minutes = np.minimum(records['end'], _day_minutes(end)) - np.maximum(records['begin'], _day_minutes(begin))
+        totals.append(timedelta(minutes=int(np.maximum(minutes, 0).sum())))
+    return totals
+    
+class Journal(object):
+    
+    '''
+    Append-only journal of changes to a project on top of a snapshot
+    
+    Each `Change` is appended to the journal as a single JSON line, so saving
+    takes constant time. Appended changes are synced to disk in batches: when
+    `batch_size` changes are pending, or on the first change made
+    `batch_interval` after the oldest pending one. Opening the project loads the
+    snapshot and replays the journal in a single edit.
+    
+    When the journal grows longer than `compact_size` changes, `sync` compacts
+    it: the rows of the tasks it changed are saved to the snapshot and an empty
+    journal is started. While open, it is the backend of the context's
+    `ColdStorage`: archiving a task compacts the journal so that the subtree
+    is in the snapshot to load it from later.
+    
+    Effort spent is also appended to an `EffortLog`, ``effort.log``. It
+    holds the effort of the snapshot followed by that of the journal, so
+    opening checks its records of the journal against the replayed ones,
+    repairing the log after a crash. Compaction rebuilds it when tasks were
+    disposed. Snapshot and journal are
+    paired by generation: the snapshot stores its generation and the journal of
+    generation n is the file ``journal.n``. A crash during compaction therefore
+    leaves either the old snapshot and journal, or the new snapshot.
+    Opening a new project saves an empty snapshot first, so that its settings,
+    such as its start, stay as they were when it was created.
+    
+    Parameters
+    ----------
+    directory : pathlib.Path
+        Directory to store the project in
+    batch_size : int
+    batch_interval : datetime.timedelta
+    compact_size : int
+    '''
+    
+    def __init__(self, directory, batch_size=100, batch_interval=timedelta(seconds=1), compact_size=10000):
+        self._directory = directory
+        self._store = Store(directory / 'project.sqlite')
+        self._batch_size = batch_size
+        self._batch_interval = batch_interval.total_seconds()
+        self._compact_size = compact_size
+        self._context = None
+        self._dirty = None  # DirtyTasks since the snapshot
+        self._file = None
+        self._effort_log = None
+        self._generation = None
+        self._length = 0  # changes in the journal
+        self._pending = 0  # changes not yet synced
+        self._pending_since = None  # time.monotonic() of oldest pending change
+    
+    def open(self, context):
+        '''
+        Load project and start journaling its changes
+        
+        Parameters
+        ----------
+        context : Context
+            Context which only contains the root task
+        '''
+        self._context = context
+        self._store.load(context)
+        self._generation = self._store.generation
+        if not self._store.saved:
+            self._store.save(context, self._generation)  # a new project, fix its settings, e.g. its start, before the journal continues it
+        self._dirty = DirtyTasks(context.changes)
+        context.cold_storage.backend = self
+        path = self._path(self._generation)
+        efforts = []  # effort log records of the replayed changes
+        if path.exists():
+            self._length = self._replay(path, efforts)
+        self._open_effort_log(efforts)
+        context.undo_stack.clear()  # replayed edits are not for the user to undo
+        for stale in self._directory.glob('journal.*'):
+            if stale != path:
+                stale.unlink()
+        self._file = path.open('a', encoding='utf-8')
+        context.changes.events.changed.connect(self._on_changed)
+        
+    @property
+    def effort_log(self):
+        '''
+        Get the log of effort spent, while open
+        
+        Returns
+        -------
+        EffortLog
+        '''
+        return self._effort_log
+    
+    def _open_effort_log(self, efforts):
+        '''
+        Open the effort log, making it continue the snapshot with efforts
+        
+        After a crash it may have fewer or more records of the journal than
+        were replayed, as the log and the journal are not synced together.
+        '''
+        log = EffortLog(self._directory / 'effort.log')
+        if log.generation != self._generation or len(log) < log.start:
+            log.rebuild(self._store._effort_records(), self._generation)
+        written = len(log) - log.start
+        if written > len(efforts):
+            log.truncate(log.start + len(efforts))
+        elif written < len(efforts):
+            log.append(efforts[written:])
+        self._effort_log = log
+        
+    def sync(self):
+        '''
+        Sync pending changes to disk, compact the journal when it is long
+        '''
+        self._sync()
+        if self._length > self._compact_size:
+            self.compact()
+            
+    def compact(self):
+        '''
+        Save the changes to the snapshot and start an empty journal
+        '''
+        self._length = 0
+        self._generation += 1
+        self._switch(self._changed_rows(), self._generation)
+        self._continue_tracking()
+        
+    def store(self, task):
+        '''
+        Save the subtree of a task which is about to be archived
+        
+        See `ColdStorage.store`.
+        '''
+        if self._file is not None:  # when replaying, archiving had compacted already
+            self.compact()
+        return self._store._load
+        
+    def close(self):
+        '''
+        Sync pending changes and stop journaling
+        '''
+        self._context.changes.events.changed.disconnect(self._on_changed)
+        self._context.cold_storage.backend = None
+        self._sync()
+        self._file.close()
+        self._effort_log.close()
+        
+    def _path(self, generation):
+        return self._directory / 'journal.{}'.format(generation)
+    
+    def _changed_rows(self):
+        rows = self._store._changed_rows(self._context, self._dirty)
+        self._dirty.clear()
+        return rows
+    
+    def _switch(self, rows, generation):
+        '''
+        Save changed rows to the snapshot as generation and continue in its journal
+        '''
+        self._store._update(rows, generation)
+        if rows[2]:  # disposed tasks, drop their effort
+            self._effort_log.rebuild(self._store._effort_records(), generation)
+        else:
+            self._effort_log.start_generation(generation)
+        self._file.close()
+        self._path(generation - 1).unlink()
+        self._file = self._path(generation).open('a', encoding='utf-8')
+        self._pending = 0
+        
+    def _continue_tracking(self):
+        '''
+        Journal the time tracking in progress, which is not part of a snapshot
+        '''
+        time_tracker = self._context.time_tracker
+        if time_tracker.current_task:
+            self._on_changed(Change('start_tracking', time_tracker.current_task, (time_tracker._current_start,)))
+        
+    def _on_changed(self, change):
+        record = [change.kind, None if change.task is None else change.task.id]
+        record.extend(_encode(arg) for arg in change.args)
+        self._length += 1
+        if change.kind == 'dispose':
+            efforts = _subtree_effort_records(change.old[0], removed=True)
+        elif change.kind == 'restore':
+            efforts = _subtree_effort_records(change.args[2])
+        else:
+            efforts = _effort_records(record)
+        self._append(change, json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n', efforts)
+        
+    def _append(self, change, line, efforts):
+        '''
+        Append line of change to the journal, and its efforts to the effort log
+        '''
+        self._file.write(line)
+        if efforts:
+            self._effort_log.append(efforts)
+        self._pending += 1
+        now = time.monotonic()
+        if self._pending == 1:
+            self._pending_since = now
+        if self._pending >= self._batch_size or now - self._pending_since >= self._batch_interval:
+            self._sync()
+    
+    def _sync(self):
+        if self._pending:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending = 0
+            
+    def _replay(self, path, efforts):
+        '''
+        Replay journal, dropping an incomplete last line left by a crash
+        
+        Parameters
+        ----------
+        path : pathlib.Path
+        efforts : list
+            Effort log records of the replayed changes are appended to it
+        
+        Returns
+        -------
+        int
+            Number of changes replayed
+        '''
+        context = self._context
+        tasks = {task.id: task for task in chain((context.root_task,), context.root_task._loaded_descendants)}
+        find = partial(self._store._find, tasks)
+        length = 0
+        end = 0  # of the last complete line
+        with path.open('rb') as file, context.recomputation.edit():
+            for line in file:
+                if not line.endswith(b'\n'):
+                    logger.warning('Dropping incomplete last change of journal {}'.format(path))
+                    break
+                record = json.loads(line.decode('utf-8'))
+                kind, task_id, *args = record
+                args = [_decode(type_, arg, find) for type_, arg in zip(_arg_types[kind], args)]
+                task = None if task_id is None or kind in ('new', 'restore') else find(task_id)
+                if kind == 'dispose':
+                    efforts.extend(_subtree_effort_records(Subtree(task), removed=True))
+                elif kind == 'restore':
+                    efforts.extend(_subtree_effort_records(args[2]))
+                else:
+                    efforts.extend(_effort_records(record))
+                self._apply(kind, task, args, task_id, tasks)
+                end += len(line)
+                length += 1
+        os.truncate(str(path), end)
+        return length
+    
+    def _apply(self, kind, task, args, task_id, tasks):
+        context = self._context
+        if kind == 'new':
+            creator, name = args
+            task = creator.append_new_task(name)
+            context.changes._assign_id(task, task_id)
+            tasks[task_id] = task
+        elif kind == 'dispose':
+            for task_ in chain((task,), task._loaded_descendants):
+                del tasks[task_.id]
+            task.dispose()
+        elif kind == 'restore':
+            task = args[2].restore(*args[:2])
+            for task_ in chain((task,), task._loaded_descendants):
+                tasks[task_.id] = task_
+        elif kind == 'move':
+            task.move(*args[:2])
+        elif kind == 'archive':
+            if not task.is_archived:  # the snapshot may have it archived already
+                for task_ in task._loaded_descendants:
+                    del tasks[task_.id]
+                task.archive()
+        elif kind == 'effort_estimate':
+            task.effort_estimates[args[0]] = args[1]
+        elif kind == 'start_tracking':
+            context.time_tracker._start(task, args[0])
+        elif kind == 'stop_tracking':
+            context.time_tracker._stop()  # the effort tracked follows as a record of its own
+        elif kind == 'project_start':
+            context.scheduler.project_start = args[0]
+        elif kind == 'weekly_hours':
+            context.calendar.weekly_hours = args[0]
+        elif kind in _calendar_edits:
+            getattr(context.calendar, kind)(*args)
+        elif kind in _attributes:
+            setattr(task, kind, args[0])
+        else:
+            getattr(task, kind)(*args)
+            
+class BackgroundJournal(Journal):
+    
+    '''
+    Journal which writes on a worker thread, off the Qt event thread
+    
+    Changes are encoded on the event thread, which is cheap, and queued. When no
+    change has been made for `delay`, or `max_delay` after the oldest queued
+    change, the queue is handed to a worker thread which appends it to the
+    journal and syncs it once. Consecutive changes of the same attribute of a
+    task, e.g. typing a description, are coalesced into the last one.
+    Compaction takes the changed rows on the event thread and writes them on
+    the worker thread.
+    
+    Parameters
+    ----------
+    directory : pathlib.Path
+    delay : datetime.timedelta
+    max_delay : datetime.timedelta
+    compact_size : int
+    '''
+    
+    def __init__(self, directory, delay=timedelta(seconds=1), max_delay=timedelta(seconds=10), compact_size=10000):
+        from PyQt5.QtCore import QTimer  # only the GUI uses this journal, headless commands need no Qt
+        super().__init__(directory, compact_size=compact_size)
+        self._delay = delay
+        self._max_delay = max_delay.total_seconds()
+        self._executor = ThreadPoolExecutor(max_workers=1)  # a single thread keeps writes in order
+        self._queue = []  # [(kind, Task, line, efforts)]
+        self._queued_since = None  # time.monotonic() of oldest queued change
+        self._timer = QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._flush)
+        
+    def sync(self):
+        '''
+        Write queued changes, compact the journal when it is long
+        
+        Returns immediately, writing happens on the worker thread.
+        '''
+        self._flush()
+        if self._length > self._compact_size:
+            self.compact()
+            
+    def compact(self):
+        self._flush()
+        self._length = 0
+        self._generation += 1
+        self._submit(self._switch, self._changed_rows(), self._generation)
+        self._continue_tracking()
+        
+    def store(self, task):
+        '''
+        Save the subtree of a task which is about to be archived
+        
+        Waits for the compaction to be written. See `ColdStorage.store`.
+        '''
+        load = super().store(task)
+        self._executor.submit(lambda: None).result()
+        return load
+        
+    def close(self):
+        '''
+        Write queued changes and stop journaling, waiting for writes to finish
+        '''
+        self._context.changes.events.changed.disconnect(self._on_changed)
+        self._context.cold_storage.backend = None
+        self._timer.stop()
+        self._flush()
+        self._executor.shutdown()
+        self._file.close()
+        self._effort_log.close()
+        
+    def _append(self, change, line, efforts):
+        queue = self._queue
+        if queue and change.kind in _attributes and queue[-1][:2] == (change.kind, change.task):
+            queue[-1] = (change.kind, change.task, line, efforts)
+            self._length -= 1
+        else:
+            queue.append((change.kind, change.task, line, efforts))
+        now = time.monotonic()
+        if len(queue) == 1:
+            self._queued_since = now
+        if now - self._queued_since >= self._max_delay:
+            self._flush()
+        else:
+            self._timer.start(self._delay // timedelta(milliseconds=1))
+            
+    def _flush(self):
+        self._timer.stop()
+        if self._queue:
+            lines = [line for _, _, line, _ in self._queue]
+            efforts = list(chain.from_iterable(efforts for _, _, _, efforts in self._queue))
+            self._queue = []
+            self._submit(self._write, lines, efforts)
+            
+    def _write(self, lines, efforts):
+        self._file.writelines(lines)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        if efforts:
+            self._effort_log.append(efforts)
+        
+    def _submit(self, function, *args):
+        self._executor.submit(function, *args).add_done_callback(_log_failure)
+        
+def _log_failure(future):
+    ex = future.exception()
+    if ex:
+        logger.error('Failed to save project', exc_info=ex)
+        
+_attributes = {'name', 'description', 'planning_state', 'delegated', 'duration', 'planned_start_override'}
+_calendar_edits = {'add_holiday', 'remove_holiday', 'set_exception', 'remove_exception'}
+
+class _Spans(object):
+    '''
+    Type of working spans in `_arg_types`: ((datetime.time, datetime.time),)
+    '''
+    
+class _WeeklyHours(object):
+    '''
+    Type of `WorkingCalendar.weekly_hours` in `_arg_types`
+    '''
+    
+_arg_types = {
+    'new': (Task, str),
+    'move': (Task, int, Task, int),
+    'dispose': (Task, int),
+    'restore': (Task, int, Subtree),
+    'name': (str,),
+    'description': (str,),
+    'planning_state': (PlanningState,),
+    'delegated': (bool,),
+    'duration': (timedelta,),
+    'planned_start_override': (datetime,),
+    'effort_estimate': (EstimateType, timedelta),
+    'insert_effort_spent': (int, Interval),
+    'update_effort_spent': (Interval, Interval),
+    'remove_effort_spent': (Interval,),
+    'add_dependency': (Task,),
+    'remove_dependency': (Task,),
+    'start_tracking': (datetime,),
+    'stop_tracking': (),
+    'archive': (),
+    'project_start': (datetime,),
+    'weekly_hours': (_WeeklyHours,),
+    'add_holiday': (date,),
+    'remove_holiday': (date,),
+    'set_exception': (date, _Spans),
+    'remove_exception': (date,),
+}
+
+def _encode(value):
+    if isinstance(value, Task):
+        return value.id
+    elif isinstance(value, datetime):
+        return _minutes_since_min(value)
+    elif isinstance(value, date):
+        return value.toordinal()
+    elif isinstance(value, daytime):
+        return _daytime_minutes(value)
+    elif isinstance(value, timedelta):
+        return _minutes(value)
+    elif isinstance(value, Interval):
+        return [_minutes_since_min(value.begin), _minutes_since_min(value.end)]
+    elif isinstance(value, Enum):
+        return value.name
+    elif isinstance(value, Subtree):
+        return [
+            [[parent, {key: _encode(arg) for key, arg in args.items()}] for parent, args in value.tasks],
+            value.dependencies
+        ]
+    elif isinstance(value, dict):
+        return {_encode(key): _encode(value_) for key, value_ in value.items()}
+    elif isinstance(value, tuple):
+        return [_encode(value_) for value_ in value]
+    else:
+        return value
+    
+def _decode(type_, value, find):
+    if value is None:
+        return None
+    elif type_ is Task:
+        return find(value)
+    elif type_ is datetime:
+        return _datetime(value)
+    elif type_ is date:
+        return date.fromordinal(value)
+    elif type_ is _Spans:
+        return tuple((_daytime(begin), _daytime(end)) for begin, end in value)
+    elif type_ is _WeeklyHours:
+        return tuple(_decode(_Spans, spans, find) for spans in value)
+    elif type_ is timedelta:
+        return _timedelta(value)
+    elif type_ is Interval:
+        return Interval(_datetime(value[0]), _datetime(value[1]))
+    elif issubclass(type_, Enum):
+        return type_[value]
+    elif type_ is Subtree:
+        tasks, dependencies = value
+        return Subtree._from_records(
+            [(parent, _decode_add_task_args(args, find)) for parent, args in tasks],
+            [tuple(dependency) for dependency in dependencies]
+        )
+    else:
+        return value
+    
+_add_task_arg_types = {
+    'name': str,
+    'description': str,
+    'planning_state': PlanningState,
+    'delegated': bool,
+    'duration': timedelta,
+    'planned_start_override': datetime,
+    'id_': int,
+}
+
+def _decode_add_task_args(args, find):
+    '''
+    Decode the `TaskTreeBuilder.add_task` args of a task of a `Subtree`
+    '''
+    decoded = {key: _decode(_add_task_arg_types[key], arg, find) for key, arg in args.items() if key in _add_task_arg_types}
+    if 'effort_estimates' in args:
+        decoded['effort_estimates'] = {EstimateType[type_]: _timedelta(estimate) for type_, estimate in args['effort_estimates'].items()}
+    if 'effort_spent' in args:
+        decoded['effort_spent'] = tuple(_decode(Interval, effort, find) for effort in args['effort_spent'])
+    return decoded
+    
+def _depth_first(root):
+    '''
+    Yield (task, index in children of parent) for the descendants of root
+    '''
+    stack = [(root, 0)]
+    while stack:
+        task, position = stack.pop()
+        if task is not root:
+            yield task, position
+        stack.extend((child, position) for position, child in reversed(list(enumerate(task.children))))
+        
+def _hidden(root, structure, dependencies):
+    '''
+    Choose which tasks of a subtree to load as archived tasks
+    
+    Parameters
+    ----------
+    root : int
+    structure : iterable((int, int, str))
+        Id, parent and planning state of each task in the subtree of root
+    dependencies : [(int, int)]
+        Dependencies from or to the subtree
+    
+    Returns
+    -------
+    {int => int}
+        Per task to leave unloaded, the archived task it is in
+    '''
+    children = defaultdict(list)
+    unfinished = set()  # leaves which are not finished or cancelled
+    for id_, parent, planning_state in structure:
+        children[parent].append(id_)
+        if planning_state not in ('finished', 'cancelled'):
+            unfinished.add(id_)
+    
+    # Open tasks, those with an unfinished leaf in their subtree
+    open_ = set()
+    preorder = []
+    stack = [root]
+    while stack:
+        id_ = stack.pop()
+        preorder.append(id_)
+        stack.extend(children[id_])
+    for id_ in reversed(preorder):
+        if children[id_]:
+            is_open = any(child in open_ for child in children[id_])
+        else:
+            is_open = id_ in unfinished
+        if is_open:
+            open_.add(id_)
+    
+    # Archive the topmost finished branches, unless dependencies cross their
+    # subtree, in which case try their children
+    excluded = set()
+    while True:
+        hidden = {}
+        stack = list(children[root])
+        while stack:
+            id_ = stack.pop()
+            if id_ in open_ or id_ in excluded:
+                stack.extend(children[id_])
+            elif children[id_]:
+                descendants = list(children[id_])
+                while descendants:
+                    descendant = descendants.pop()
+                    hidden[descendant] = id_
+                    descendants.extend(children[descendant])
+        crossing = set()
+        for task, dependency in dependencies:
+            archived = hidden.get(task), hidden.get(dependency)
+            if archived[0] != archived[1]:
+                crossing.update(archived)
+        crossing.discard(None)
+        if not crossing:
+            return hidden
+        excluded |= crossing
+        
+def _project_rows(context):
+    '''
+    Get the settings of the project
+    
+    Returns
+    -------
+    (tuple, {str: [tuple]})
+        The meta row after the generation, and the rows of each calendar table
+    '''
+    calendar = context.calendar
+    exceptions = []
+    for day, spans in calendar.exceptions.items():
+        if spans:
+            exceptions.extend((day.toordinal(), _daytime_minutes(begin), _daytime_minutes(end)) for begin, end in spans)
+        else:
+            exceptions.append((day.toordinal(), None, None))
+    return (_minutes_since_min(context.scheduler.project_start),), {
+        'weekly_hours': [
+            (weekday, _daytime_minutes(begin), _daytime_minutes(end))
+            for weekday, spans in enumerate(calendar.weekly_hours)
+            for begin, end in spans
+        ],
+        'holiday': [(day.toordinal(),) for day in calendar.holidays],
+        'calendar_exception': exceptions,
+    }
+    
+def _insert_project(connection, project, generation):
+    '''
+    Insert rows from `_project_rows` into their emptied tables
+    '''
+    meta, calendar = project
+    connection.execute('INSERT INTO meta VALUES (?, ?)', (generation,) + meta)
+    for table, rows in calendar.items():
+        connection.executemany(_inserts[table], rows)
+        
+def _calendar(weekly_hours, holidays, exceptions):
+    '''
+    Get the `WorkingCalendar._load` args from the rows of the calendar tables
+    '''
+    weekly_hours_ = [[] for _ in range(7)]
+    for weekday, begin, end in weekly_hours:
+        weekly_hours_[weekday].append((_daytime(begin), _daytime(end)))
+    exceptions_ = defaultdict(list)
+    for day, begin, end in exceptions:
+        spans = exceptions_[date.fromordinal(day)]
+        if begin is not None:
+            spans.append((_daytime(begin), _daytime(end)))
+    return weekly_hours_, [date.fromordinal(day) for day, in holidays], exceptions_
+    
+    
+def _task_row(task, position):
+    delegated = task.is_leaf and task.delegated
+    return (
+        task.id, task.parent.id, position, task.name, task.description,
+        task.planning_state.name, delegated, _minutes(task.duration) if delegated else None,
+        _minutes_since_min(task.planned_start_override)
+    )
+    
+def _dependency_rows(task):
+    return [(task.id, dependency.id) for dependency in task.dependencies]
+
+def _estimate_rows(task):
+    if not task.is_leaf or task.delegated:
+        return []
+    return [
+        (task.id, estimate_type.name, _minutes(task.effort_estimates[estimate_type]))
+        for estimate_type in EstimateType
+        if task.effort_estimates[estimate_type] is not None
+    ]
+
+def _effort_rows(task):
+    if not task.is_leaf or task.delegated:
+        return []
+    return [(task.id, _minutes_since_min(interval.begin), _minutes_since_min(interval.end)) for interval in task.effort_spent]
+        
+def _group(rows, column=0):
+    '''
+    Group rows, ordered by a column, by that column
+    '''
+    return {key: list(group) for key, group in groupby(rows, itemgetter(column))}
+    
+def _day_minutes(day):
+    '''
+    Get minutes since `datetime.min` at the start of a day
+    '''
+    return (day.toordinal() - 1) * 24 * 60
+
+def _effort_records(record):
+    '''
+    Get the effort log records of a journal record
+    '''
+    kind, task = record[:2]
+    if kind == 'insert_effort_spent':
+        return [(task,) + tuple(record[3])]
+    elif kind == 'update_effort_spent':
+        return [(~task,) + tuple(record[2]), (task,) + tuple(record[3])]
+    elif kind == 'remove_effort_spent':
+        return [(~task,) + tuple(record[2])]
+    else:
+        return []
+    
+def _subtree_effort_records(subtree, removed=False):
+    '''
+    Get the effort log records of the effort spent in a subtree
+    
+    Parameters
+    ----------
+    subtree : Subtree
+    removed : bool
+        If ``True``, records of its removal instead
+    '''
+    return [
+        (~args['id_'] if removed else args['id_'], _minutes_since_min(effort.begin), _minutes_since_min(effort.end))
+        for _, args in subtree.tasks
+        for effort in args.get('effort_spent', ())
+    ]
+    
+def _minutes(duration):
+    return None if duration is None else duration // timedelta(minutes=1)
+
+def _timedelta(minutes):
+    return None if minutes is None else timedelta(minutes=minutes)
+    
+def _minutes_since_min(datetime_):
+    return None if datetime_ is None else _minutes(datetime_ - datetime.min)
+
+def _datetime(minutes):
+    return None if minutes is None else datetime.min + timedelta(minutes=minutes)
+
+def _daytime_minutes(daytime_):
+    return daytime_.hour * 60 + daytime_.minute
+
+def _daytime(minutes):
+    return daytime(*divmod(minutes, 60))
@@ -0,0 +1,104 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Test garage_pm.exchange
+'''
+
+import pytest
+from garage_pm.exchange import export_project, import_project, write_json_lines, read_json_lines
+from garage_pm.domain import Interval, EstimateType, PlanningState
+from garage_pm.tests.test_store import new_context, edit_calendar, assert_calendar
+from datetime import datetime, timedelta
+from io import StringIO
+
+def test_export_import(context, now):
+    hour = timedelta(hours=1)
+    root = context.root_task
+    task1 = root.append_new_task('task1')
+    task11 = task1.append_new_task('task11')
+    task11.move(task1, 0)
+    task11.description = 'déscription'
+    task2 = root.append_new_task('task2')
+    task2.delegated = True
+    task2.duration = 2 * hour
+    task2.planned_start_override = datetime(2000, 1, 2)
+    task3 = root.append_new_task('task3')
+    task2.add_dependency(task3)  # on a task further on
+    task11.effort_estimates[EstimateType.likely] = hour
+    task11.insert_effort_spent(0, Interval(datetime(1999, 12, 31, 10), datetime(1999, 12, 31, 11)))
+    task11.planning_state = PlanningState.finished
+    context.scheduler.project_start = datetime(1999, 12, 1, 9)
+    edit_calendar(context)
+    
+    file = StringIO()
+    write_json_lines(export_project(context), file)
+    file.seek(0)
+    context2 = new_context()
+    import_project(context2, read_json_lines(file))
+    
+    task1, task2, task3 = context2.root_task.children
+    task11, = task1.children
+    assert [task.name for task in (task1, task11, task2, task3)] == ['task1', 'task11', 'task2', 'task3']
+    assert task11.description == 'déscription'
+    assert task2.delegated
+    assert task2.duration == 2 * hour
+    assert task2.planned_start_override == datetime(2000, 1, 2)
+    assert list(task2.dependencies) == [task3]
+    assert task11.effort_estimates[EstimateType.likely] == hour
+    assert task11.effort_estimates[EstimateType.optimistic] is None
+    assert task11.effort_spent == (Interval(datetime(1999, 12, 31, 10), datetime(1999, 12, 31, 11)),)
+    assert task11.planning_state == PlanningState.finished
+    assert context2.effort_index.total() == hour
+    assert context2.scheduler.project_start == datetime(1999, 12, 1, 9)
+    assert_calendar(context2)
+    
+def test_import_invalid(context):
+    header = '{"format": "garage-pm", "version": 1}\n'
+    def import_(text):
+        import_project(context, read_json_lines(StringIO(text)))
+        
+    with pytest.raises(ValueError) as ex:
+        import_('{"format": "other"}\n')
+    assert 'Expected header' in str(ex.value)
+    
+    with pytest.raises(ValueError) as ex:
+        import_('{"format": "garage-pm", "version": 1, "project_start": "tomorrow"}\n')
+    assert 'Header:' in str(ex.value)
+    
+    with pytest.raises(ValueError) as ex:
+        import_('{"format": "garage-pm", "version": 1, "calendar": {"weekly_hours": [[["17:00", "09:00"]]]}}\n')
+    assert 'Header:' in str(ex.value)
+    
+    with pytest.raises(ValueError) as ex:
+        import_(header + '{"id": 1, "parent": 2, "name": "task1"}\n')
+    assert 'Task record 1: missing or unknown 2' in str(ex.value)
+    
+    with pytest.raises(ValueError) as ex:
+        import_(header + '{"id": 1, "name": "task1"\n')
+    assert 'Line 2' in str(ex.value)
+    
+def test_import_cycle(context):
+    text = '\n'.join((
+        '{"format": "garage-pm", "version": 1}',
+        '{"id": 1, "name": "task1", "dependencies": [2]}',
+        '{"id": 2, "name": "task2", "dependencies": [1]}',
+    ))
+    with pytest.raises(ValueError) as ex:
+        import_project(context, read_json_lines(StringIO(text)))
+    assert 'Dependencies contain a cycle' in str(ex.value)
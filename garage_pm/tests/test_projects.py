@@ -0,0 +1,108 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Test garage_pm.projects
+'''
+
+import pytest
+from garage_pm.projects import Projects, ProjectSummary, ProjectContext
+from garage_pm.store import Journal
+from garage_pm.domain import Interval
+from datetime import datetime, timedelta
+from pathlib import Path
+
+@pytest.fixture
+def directory(tmpdir):
+    return Path(str(tmpdir))
+
+@pytest.fixture
+def new_context(context):
+    return lambda: ProjectContext(context.minute_timer)
+
+@pytest.fixture
+def projects(new_context, directory):
+    projects = Projects(directory, new_context)
+    yield projects
+    projects.close()
+    
+def test_switch(projects, new_context, directory):
+    hour = timedelta(hours=1)
+    assert projects.names == []
+    assert projects.current is None
+    
+    # Opens the default project by default
+    context1 = projects.open()
+    assert projects.names == ['default']
+    assert projects.current == 'default'
+    task1 = context1.root_task.append_new_task('task1')
+    task1.insert_effort_spent(0, Interval(datetime(2000, 1, 1, 10), datetime(2000, 1, 1, 11)))
+    assert projects.summary('default') == ProjectSummary(hour, context1.root_task.predicted_end, 1, [(task1.id, 'task1')])
+    
+    # Each project has its own context
+    projects.create('client')
+    assert projects.summary('client') is None
+    context2 = projects.open('client')
+    assert context2 is not context1
+    assert context2.root_task.children == ()
+    assert projects.context is context2
+    context2.root_task.append_new_task('task2')
+    
+    # Of closed projects, the summary is cached
+    summary = projects.summary('default')
+    assert summary.effort_spent == hour
+    assert summary.ready == [(task1.id, 'task1')]
+    projects.close()
+    
+    # including in the registry file
+    projects = Projects(directory, new_context)
+    assert projects.names == ['client', 'default']
+    assert projects.summary('default') == summary
+    assert projects.summary('client').ready_count == 1
+    
+    # Reopens the project which was open last
+    context2 = projects.open()
+    assert projects.current == 'client'
+    assert [task.name for task in context2.root_task.children] == ['task2']
+    projects.close()
+    
+def test_create(projects):
+    for name in ('', '.', '..', 'a/b'):
+        with pytest.raises(ValueError):
+            projects.create(name)
+    projects.create('client')
+    with pytest.raises(ValueError):
+        projects.create('client')
+    with pytest.raises(KeyError):
+        projects.open('other')
+        
+def test_migrate(context, new_context, directory):
+    '''
+    A project stored in the data directory itself becomes the default project
+    '''
+    journal = Journal(directory)
+    journal.open(context)
+    context.root_task.append_new_task('task1')
+    journal.close()
+    
+    projects = Projects(directory, new_context)
+    assert projects.names == ['default']
+    assert not (directory / 'project.sqlite').exists()
+    context = projects.open()
+    assert [task.name for task in context.root_task.children] == ['task1']
+    projects.close()
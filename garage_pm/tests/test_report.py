@@ -0,0 +1,154 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test garage_pm.report
+'''
+
+from garage_pm.report import timesheet, project_timesheet, Period, TimesheetRow, write_csv
+from garage_pm.domain import Interval, PlanningState
+from garage_pm.store import Store, Journal
+from garage_pm.tests.test_store import new_context
+import pytest
+from datetime import datetime, timedelta, date
+from io import StringIO
+from pathlib import Path
+
+def test_timesheet(context, now):
+    root = context.root_task
+    task1 = root.append_new_task('task1')
+    task11 = task1.append_new_task('task11')
+    task11.move(task1, 0)
+    task2 = root.append_new_task('task2')
+    task11.insert_effort_spent(0, Interval(datetime(1999, 12, 26, 10), datetime(1999, 12, 26, 11)))  # a Sunday
+    task2.insert_effort_spent(0, Interval(datetime(1999, 12, 27, 10), datetime(1999, 12, 27, 10, 30)))
+    
+    begin = date(1999, 12, 20)
+    end = date(2000, 1, 1)
+    assert list(timesheet(context, begin, end, Period.week)) == [
+        TimesheetRow(date(1999, 12, 20), date(1999, 12, 27), task11, timedelta(hours=1)),
+        TimesheetRow(date(1999, 12, 27), end, task2, timedelta(minutes=30)),
+    ]
+    assert list(timesheet(context, begin, end, Period.month, subtotals=True)) == [
+        TimesheetRow(begin, end, root, timedelta(hours=1, minutes=30)),
+        TimesheetRow(begin, end, task1, timedelta(hours=1)),
+        TimesheetRow(begin, end, task11, timedelta(hours=1)),
+        TimesheetRow(begin, end, task2, timedelta(minutes=30)),
+    ]
+    
+    output = StringIO()
+    write_csv(timesheet(context, begin, end, Period.day), output)
+    assert output.getvalue().splitlines() == [
+        'Begin,End,Task,Hours',
+        '1999-12-26,1999-12-26,Root task/task1/task11,1.00',
+        '1999-12-27,1999-12-27,Root task/task2,0.50',
+    ]
+    
+def test_timesheet_effort_log(context, tmpdir, mocker):
+    journal = Journal(Path(str(tmpdir)))
+    journal.open(context)
+    root = context.root_task
+    task1 = root.append_new_task('task1')
+    task11 = task1.append_new_task('task11')
+    task11.move(task1, 0)
+    task2 = root.append_new_task('task2')
+    task11.insert_effort_spent(0, Interval(datetime(1999, 12, 26, 10), datetime(1999, 12, 26, 11)))
+    task2.insert_effort_spent(0, Interval(datetime(1999, 12, 27, 23), datetime(1999, 12, 28, 1)))
+    
+    begin = date(1999, 12, 20)
+    end = date(2000, 1, 1)
+    for period in Period:
+        for subtotals in (False, True):
+            expected = list(timesheet(context, begin, end, period, subtotals))
+            assert list(timesheet(context, begin, end, period, subtotals, journal.effort_log)) == expected
+            
+    # The log is read once, not per period
+    records = mocker.spy(journal.effort_log, '_records')
+    assert len(list(timesheet(context, begin, end, Period.day, effort_log=journal.effort_log))) == 3
+    assert records.call_count == 1
+    journal.close()
+    
+def test_timesheet_archived(context, tmpdir):
+    '''
+    An archived task is reported as a single row, without loading it
+    '''
+    directory = Path(str(tmpdir))
+    journal = Journal(directory)
+    journal.open(context)
+    root = context.root_task
+    branch = root.append_new_task('branch')
+    leaf = root.append_new_task('leaf')
+    leaf.move(branch, 0)
+    other = root.append_new_task('other')
+    leaf.insert_effort_spent(0, Interval(datetime(1999, 12, 26, 10), datetime(1999, 12, 26, 11)))
+    leaf.planning_state = PlanningState.finished
+    other.insert_effort_spent(0, Interval(datetime(1999, 12, 27, 10), datetime(1999, 12, 27, 10, 30)))
+    journal.compact()
+    journal.close()
+    
+    context = new_context()
+    journal = Journal(directory)
+    journal.open(context)
+    branch, other = context.root_task._loaded_children
+    assert branch.is_archived
+    begin = date(1999, 12, 20)
+    end = date(2000, 1, 1)
+    for period in Period:
+        for subtotals in (False, True):
+            actual = list(timesheet(context, begin, end, period, subtotals, journal.effort_log))  # first, in case the other loads the branch
+            assert actual == list(timesheet(context, begin, end, period, subtotals))
+    assert list(timesheet(context, begin, end, Period.month, effort_log=journal.effort_log)) == [
+        TimesheetRow(begin, end, branch, timedelta(hours=1)),
+        TimesheetRow(begin, end, other, timedelta(minutes=30)),
+    ]
+    assert branch.is_archived
+    journal.close()
+    
+def test_project_timesheet(context, tmpdir):
+    hour = timedelta(hours=1)
+    directory = Path(str(tmpdir))
+    
+    # Project with an effort log
+    (directory / 'project1').mkdir()
+    journal = Journal(directory / 'project1')
+    journal.open(context)
+    task1 = context.root_task.append_new_task('task1')
+    task1.insert_effort_spent(0, Interval(datetime(1999, 12, 26, 10), datetime(1999, 12, 26, 11)))
+    task1.insert_effort_spent(1, Interval(datetime(1999, 12, 27, 10), datetime(1999, 12, 27, 12)))
+    task2 = context.root_task.append_new_task('task2')
+    task2.insert_effort_spent(0, Interval(datetime(1999, 12, 27, 13), datetime(1999, 12, 27, 14)))
+    task2.dispose()
+    journal.close()
+    
+    # Project which has not been opened since it was saved
+    context2 = new_context()
+    task1 = context2.root_task.append_new_task('task1')
+    task1.insert_effort_spent(0, Interval(datetime(1999, 12, 28, 10), datetime(1999, 12, 28, 13)))
+    (directory / 'project2').mkdir()
+    Store(directory / 'project2' / 'project.sqlite').save(context2)
+    
+    projects = [('project1', directory / 'project1'), ('project2', directory / 'project2'), ('project3', directory / 'project3')]
+    assert list(project_timesheet(projects, date(1999, 12, 20), date(2000, 1, 1))) == [
+        TimesheetRow(date(1999, 12, 20), date(1999, 12, 27), 'project1', hour),
+        TimesheetRow(date(1999, 12, 27), date(2000, 1, 1), 'project1', 2 * hour),
+        TimesheetRow(date(1999, 12, 27), date(2000, 1, 1), 'project2', 3 * hour),
+    ]
+    
+    # Refuses a stale effort log
+    (directory / 'project1' / 'effort.log').unlink()
+    with pytest.raises(ValueError):
+        list(project_timesheet(projects, date(1999, 12, 20), date(2000, 1, 1)))
@@ -0,0 +1,70 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+Startup benchmark of the garage-pm command
+
+Each case runs a headless command in a fresh interpreter and times it from
+process start until it exits. The fastest of a few runs must stay within the
+budget.
+Raise the budget only along with a change which is worth the slower start.
+'''
+
+import pytest
+import subprocess
+import time
+import sys
+import os
+
+_budget = {  # {case => seconds}
+    'list': 0.5,
+}
+
+_runs = 3
+
+@pytest.fixture
+def env(tmpdir):
+    return dict(
+        os.environ,
+        XDG_DATA_HOME=str(tmpdir / 'data'),
+        XDG_CONFIG_HOME=str(tmpdir / 'config'),
+        XDG_CACHE_HOME=str(tmpdir / 'cache'),
+    )
+    
+def _garage_pm(*args):
+    return [sys.executable, '-c', 'from garage_pm.main import main; main()'] + list(args)
+
+def _time(args, env):
+    '''
+    Get fastest time of running args
+    '''
+    times = []
+    for _ in range(_runs):
+        start = time.perf_counter()
+        process = subprocess.run(args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60)
+        times.append(time.perf_counter() - start)
+        assert process.returncode == 0, process.stderr.decode()
+    return min(times)
+
+def test_list(env):
+    '''
+    Headless command on a small project
+    '''
+    subprocess.run(_garage_pm('add', 'task'), env=env, check=True, stdout=subprocess.DEVNULL)
+    assert _time(_garage_pm('list'), env) < _budget['list']
+
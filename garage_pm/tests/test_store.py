@@ -0,0 +1,481 @@
+# Copyright (C) 2016 Tim Diels <timdiels.m@gmail.com>
+# 
+# This file is part of Garage PM.
+# 
+# Garage PM is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Garage PM is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with Garage PM.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Test garage_pm.store
+'''
+
+import pytest
+from garage_pm.main import Context
+from garage_pm.store import Store, Journal, BackgroundJournal, EffortLog
+from garage_pm.domain import Interval, EstimateType, PlanningState, TaskTreeBuilder, DirtyTasks
+from click.testing import CliRunner
+from datetime import datetime, timedelta, date, time
+from pathlib import Path
+from contextlib import closing
+
+def new_context():
+    _context = []
+    
+    @Context.command()
+    def main(context):
+        _context.append(context)
+    
+    CliRunner().invoke(main, catch_exceptions=False)
+    
+    return _context[0]
+
+@pytest.fixture
+def context2(qapp):
+    return new_context()
+
+def edit_calendar(context):
+    '''
+    Give context a working calendar other than the default
+    '''
+    calendar = context.calendar
+    calendar.weekly_hours = [((time(9), time(12)), (time(13), time(17)))] * 5 + [(), ()]
+    calendar.add_holiday(date(2000, 1, 3))
+    calendar.set_exception(date(2000, 1, 4), [(time(10), time(0))])
+    calendar.set_exception(date(2000, 1, 5), [])
+    
+def assert_calendar(context):
+    '''
+    Assert context has the calendar of `edit_calendar`
+    '''
+    calendar = context.calendar
+    assert calendar.weekly_hours == (((time(9), time(12)), (time(13), time(17))),) * 5 + ((), ())
+    assert calendar.holidays == {date(2000, 1, 3)}
+    assert calendar.exceptions == {date(2000, 1, 4): ((time(10), time(0)),), date(2000, 1, 5): ()}
+
+def test_save_load(context, context2, now, tmpdir):
+    hour = timedelta(hours=1)
+    root = context.root_task
+    task1 = root.append_new_task('task1')
+    task11 = task1.append_new_task('task11')
+    task11.move(task1, 0)
+    task11.description = 'description'
+    task2 = root.append_new_task('task2')
+    task2.delegated = True
+    task2.duration = 2 * hour
+    task2.planned_start_override = datetime(2000, 1, 2)
+    task3 = root.append_new_task('task3')
+    task3.add_dependency(task2)
+    for estimate_type in EstimateType:
+        task11.effort_estimates[estimate_type] = hour
+    task11.insert_effort_spent(0, Interval(datetime(1999, 12, 31, 10), datetime(1999, 12, 31, 11)))
+    task11.planning_state = PlanningState.finished
+    context.scheduler.project_start = datetime(1999, 12, 1, 9)
+    
+    store = Store(tmpdir / 'project.sqlite')
+    store.save(context)
+    store.load(context2)
+    
+    task1, task2, task3 = context2.root_task.children
+    task11, = task1.children
+    assert [task.name for task in (task1, task11, task2, task3)] == ['task1', 'task11', 'task2', 'task3']
+    assert task11.description == 'description'
+    assert task11.effort_estimates[EstimateType.likely] == hour
+    assert task11.effort_spent == (Interval(datetime(1999, 12, 31, 10), datetime(1999, 12, 31, 11)),)
+    assert task11.planning_state == task1.planning_state == PlanningState.finished
+    assert task2.delegated
+    assert task2.duration == 2 * hour
+    assert task2.planned_start_override == datetime(2000, 1, 2)
+    assert list(task3.dependencies) == [task2]
+    assert context2.effort_index.total() == hour
+    assert task3.planned_start == task2.planned_end == datetime(2000, 1, 2, 2)
+    assert set(context2.ready_tasks) == {task2}
+    assert context2.scheduler.project_start == datetime(1999, 12, 1, 9)
+    
+def test_save_load_calendar(context, context2, tmpdir):
+    context.scheduler.project_start = datetime(2000, 1, 3)
+    task = context.root_task.append_new_task()
+    for estimate_type in EstimateType:
+        task.effort_estimates[estimate_type] = timedelta(hours=16)
+    edit_calendar(context)
+    
+    store = Store(tmpdir / 'project.sqlite')
+    store.save(context)
+    store.load(context2)
+    
+    assert_calendar(context2)
+    task, = context2.root_task.children
+    assert task.planned_end == datetime(2000, 1, 6, 11)  # skips the holiday and the day off
+    
+def test_save_changes(context, tmpdir):
+    hour = timedelta(hours=1)
+    root = context.root_task
+    task1 = root.append_new_task('task1')
+    task11 = root.append_new_task('task11')
+    task11.move(task1, 0)
+    task12 = task11.append_new_task('task12')
+    task2 = root.append_new_task('task2')
+    task2.effort_estimates[EstimateType.likely] = hour
+    store = Store(tmpdir / 'project.sqlite')
+    store.save(context)
+    
+    dirty = DirtyTasks(context.changes)
+    task1.name = 'renamed'
+    task12.move(root, 0)  # out of a task which is disposed next
+    task1.dispose()
+    task21 = task2.append_new_task('task21')
+    task21.move(task2, 0)  # task2 becomes a branch
+    task21.insert_effort_spent(0, Interval(datetime(1999, 12, 31, 10), datetime(1999, 12, 31, 11)))
+    task2.add_dependency(task12)
+    context.scheduler.project_start = datetime(1999, 12, 1, 9)
+    edit_calendar(context)
+    assert dirty.tasks == {task1}
+    assert dirty.disposed == {task1}
+    store.save_changes(context, dirty)
+    assert not dirty.tasks
+    
+    expected = Store(tmpdir / 'expected.sqlite')
+    expected.save(context)
+    with closing(store._connect()) as connection, closing(expected._connect()) as expected_connection:
+        for table in ('meta', 'weekly_hours', 'holiday', 'calendar_exception', 'task', 'dependency', 'estimate', 'effort'):
+            query = 'SELECT * FROM {} ORDER BY {}'.format(table, '1' if table == 'holiday' else '1, 2')
+            assert connection.execute(query).fetchall() == expected_connection.execute(query).fetchall()
+    
+def test_load_archived(context, context2, tmpdir):
+    hour = timedelta(hours=1)
+    root = context.root_task
+    task1 = root.append_new_task('task1')
+    task2 = root.append_new_task('task2')
+    task3 = root.append_new_task('task3')
+    task4 = root.append_new_task('task4')
+    for i in range(3):
+        task = root.append_new_task('task1{}'.format(i))
+        task.move(task1, i)
+        for estimate_type in EstimateType:
+            task.effort_estimates[estimate_type] = (i + 1) * hour
+        begin = datetime(2000, 1, 1 + i, 10)
+        task.insert_effort_spent(0, Interval(begin, begin + (i + 2) * hour))
+        task.planning_state = PlanningState.finished
+    task2.add_dependency(task1)
+    task31 = task4.append_new_task('task31')
+    task31.move(task3, 0)
+    task31.planning_state = PlanningState.cancelled
+    task4.add_dependency(task31)  # into the subtree of task3, so it is loaded
+    
+    store = Store(tmpdir / 'project.sqlite')
+    store.save(context)
+    store.load(context2)
+    task1, task2, task3, task4 = context2.root_task._loaded_children
+    assert task1.is_archived
+    assert not task3.is_archived
+    assert list(task2.dependencies) == [task1]
+    assert context2.effort_index.total() == context.effort_index.total() == 9 * hour
+    assert context2.effort_index.total(task=task1) == 9 * hour
+    assert context2.estimate_calibration.coefficients == pytest.approx(context.estimate_calibration.coefficients)
+    
+    assert [task.name for task in task1.children] == ['task10', 'task11', 'task12']
+    assert not task1.is_archived
+    assert task1.planning_state == PlanningState.finished
+    assert task1.children[2].effort_spent == (Interval(datetime(2000, 1, 3, 10), datetime(2000, 1, 3, 14)),)
+    assert context2.effort_index.total() == 9 * hour
+    assert context2.estimate_calibration.coefficients == pytest.approx(context.estimate_calibration.coefficients)
+    
+def test_builder_cycle(context):
+    with pytest.raises(ValueError):
+        with TaskTreeBuilder(context) as builder:
+            task1 = builder.add_task(context.root_task, 'task1')
+            task2 = builder.add_task(context.root_task, 'task2')
+            builder.add_dependency(task1, task2)
+            builder.add_dependency(task2, task1)
+    assert not list(task1.dependencies)
+
+class TestJournal(object):
+    
+    @pytest.fixture
+    def directory(self, tmpdir):
+        return Path(str(tmpdir))
+    
+    def reopen(self, directory, **kwargs):
+        context = new_context()
+        journal = Journal(directory, **kwargs)
+        journal.open(context)
+        return context, journal
+    
+    def test_replay(self, context, directory, now):
+        journal = Journal(directory)
+        journal.open(context)
+        root = context.root_task
+        task1 = root.append_new_task('task1')
+        task11 = task1.append_new_task('task11')
+        task11.move(task1, 0)
+        task2 = root.append_new_task('task2')
+        task2.add_dependency(task1)
+        task11.effort_estimates[EstimateType.likely] = timedelta(hours=1)
+        task11.insert_effort_spent(0, Interval(datetime(1999, 12, 31, 10), datetime(1999, 12, 31, 11)))
+        task1.name = 'renamed'
+        root.append_new_task('task3').dispose()
+        journal.close()
+        
+        context, journal = self.reopen(directory)
+        task1, task2 = context.root_task.children
+        task11, = task1.children
+        assert task1.name == 'renamed'
+        assert list(task2.dependencies) == [task1]
+        assert task11.effort_estimates[EstimateType.likely] == timedelta(hours=1)
+        assert task11.effort_spent == (Interval(datetime(1999, 12, 31, 10), datetime(1999, 12, 31, 11)),)
+        
+        # New tasks do not reuse ids
+        assert task2.append_new_task().id not in {task1.id, task11.id, task2.id}
+        journal.close()
+        
+    def test_new_project_start(self, context, directory, now):
+        '''
+        The start of a new project does not move when reopened later
+        '''
+        journal = Journal(directory)
+        journal.open(context)
+        start = context.scheduler.project_start
+        journal.close()
+        
+        now.tick(timedelta(days=1))
+        context, journal = self.reopen(directory)
+        assert context.scheduler.project_start == start
+        journal.close()
+        
+    def test_project_start(self, context, directory):
+        journal = Journal(directory)
+        journal.open(context)
+        context.scheduler.project_start = datetime(1999, 12, 1, 9)
+        journal.close()
+        
+        context, journal = self.reopen(directory)
+        assert context.scheduler.project_start == datetime(1999, 12, 1, 9)
+        journal.compact()
+        journal.close()
+        
+        context, journal = self.reopen(directory)
+        assert context.scheduler.project_start == datetime(1999, 12, 1, 9)
+        journal.close()
+        
+    def test_calendar(self, context, directory):
+        journal = Journal(directory)
+        journal.open(context)
+        context.calendar.add_holiday(date(2000, 1, 2))
+        edit_calendar(context)
+        context.calendar.remove_holiday(date(2000, 1, 2))
+        context.calendar.set_exception(date(2000, 1, 6), [])
+        context.calendar.remove_exception(date(2000, 1, 6))
+        journal.close()
+        
+        context, journal = self.reopen(directory)
+        assert_calendar(context)
+        journal.compact()
+        journal.close()
+        
+        context, journal = self.reopen(directory)
+        assert_calendar(context)
+        journal.close()
+        
+    def test_compact(self, context, directory):
+        journal = Journal(directory, compact_size=2)
+        journal.open(context)
+        for i in range(3):
+            context.root_task.append_new_task(str(i))
+        context.time_tracker.start(context.root_task.children[0])
+        journal.sync()
+        assert [path.name for path in directory.glob('journal.*')] == ['journal.1']
+        context.root_task.append_new_task('3')
+        journal.close()
+        
+        context, journal = self.reopen(directory)
+        assert [task.name for task in context.root_task.children] == ['0', '1', '2', '3']
+        assert context.time_tracker.current_task is context.root_task.children[0]
+        journal.close()
+        
+    def test_replay_archived(self, context, directory):
+        journal = Journal(directory)
+        journal.open(context)
+        task1 = context.root_task.append_new_task('task1')
+        task11 = task1.append_new_task('task11')
+        task11.move(task1, 0)
+        task11.insert_effort_spent(0, Interval(datetime(2000, 1, 1, 10), datetime(2000, 1, 1, 11)))
+        task11.planning_state = PlanningState.finished
+        journal.compact()
+        task11.name = 'renamed'
+        journal.close()
+        
+        context, journal = self.reopen(directory)
+        task1, = context.root_task.children
+        assert not task1.is_archived  # loaded to replay the rename
+        assert task1.children[0].name == 'renamed'
+        journal.close()
+        
+    def test_archive(self, context, directory):
+        journal = Journal(directory)
+        journal.open(context)
+        task1 = context.root_task.append_new_task('task1')
+        task11 = task1.append_new_task('task11')
+        task11.move(task1, 0)
+        task11.insert_effort_spent(0, Interval(datetime(2000, 1, 1, 10), datetime(2000, 1, 1, 11)))
+        task11.planning_state = PlanningState.finished
+        task1.archive()
+        task11, = task1.children  # loaded from the snapshot
+        assert task11.effort_spent == (Interval(datetime(2000, 1, 1, 10), datetime(2000, 1, 1, 11)),)
+        task11.name = 'renamed'
+        journal.close()
+        
+        context, journal = self.reopen(directory)
+        task1, = context.root_task.children
+        assert task1.children[0].name == 'renamed'
+        journal.close()
+        
+    def test_undo(self, context, directory):
+        '''
+        Undoing dispose is journaled as restoring the subtree
+        '''
+        hour = timedelta(hours=1)
+        effort = Interval(datetime(2000, 1, 1, 10), datetime(2000, 1, 1, 11))
+        journal = Journal(directory)
+        journal.open(context)
+        task1 = context.root_task.append_new_task('task1')
+        task11 = task1.append_new_task('task11')
+        task11.move(task1, 0)
+        task11.effort_estimates[EstimateType.likely] = hour
+        task11.insert_effort_spent(0, effort)
+        task2 = context.root_task.append_new_task('task2')
+        task2.add_dependency(task1)
+        ids = task1.id, task11.id
+        task1.dispose()
+        assert journal.effort_log.total() == timedelta()
+        context.undo_stack.undo()
+        assert journal.effort_log.total() == hour
+        journal.close()
+        
+        context, journal = self.reopen(directory)
+        assert not context.undo_stack.can_undo
+        task1, task2 = context.root_task.children
+        task11, = task1.children
+        assert (task1.id, task11.id) == ids
+        assert task11.effort_estimates[EstimateType.likely] == hour
+        assert task11.effort_spent == (effort,)
+        assert list(task2.dependencies) == [task1]
+        assert journal.effort_log.per_task() == {task11.id: hour}
+        journal.close()
+        
+    def test_dispose_tracked(self, context, directory, now):
+        '''
+        Disposing the tracked task journals stopping without effort
+        '''
+        journal = Journal(directory)
+        journal.open(context)
+        task = context.root_task.append_new_task('task')
+        context.time_tracker.start(task)
+        now.tick(timedelta(hours=1))
+        task.dispose()
+        assert journal.effort_log.total() == timedelta()
+        journal.close()
+        
+        context, journal = self.reopen(directory)
+        assert not context.root_task.children
+        assert context.time_tracker.current_task is None
+        assert journal.effort_log.total() == timedelta()
+        journal.close()
+        
+    def test_effort_log(self, context, directory):
+        hour = timedelta(hours=1)
+        day = datetime(2000, 1, 1)
+        journal = Journal(directory)
+        journal.open(context)
+        task1 = context.root_task.append_new_task('task1')
+        task2 = context.root_task.append_new_task('task2')
+        task3 = context.root_task.append_new_task('task3')
+        task1.insert_effort_spent(0, Interval(day + 10 * hour, day + 12 * hour))
+        task1.update_effort_spent(Interval(day + 10 * hour, day + 12 * hour), Interval(day + 9 * hour, day + 12 * hour))
+        task2.insert_effort_spent(0, Interval(day + 23 * hour, day + 26 * hour))  # into the next day
+        task3.insert_effort_spent(0, Interval(day + 13 * hour, day + 14 * hour))
+        task3.remove_effort_spent(Interval(day + 13 * hour, day + 14 * hour))
+        log = journal.effort_log
+        assert len(log) == 6
+        assert log.total() == 6 * hour
+        assert log.total(date(2000, 1, 2)) == 2 * hour
+        assert log.total(end=date(2000, 1, 2), tasks=[task2.id]) == hour
+        assert log.per_task() == {task1.id: 3 * hour, task2.id: 3 * hour}
+        assert log.per_period([(date(2000, 1, 1), date(2000, 1, 2)), (date(2000, 1, 2), date(2000, 1, 3)), (date(2000, 1, 3), date(2000, 1, 4))]) == [
+            {task1.id: 3 * hour, task2.id: hour},
+            {task2.id: 2 * hour},
+            {},
+        ]
+        expected = log.per_task()
+        journal.close()
+        
+        # A crash lost writes to the log
+        path = directory / 'effort.log'
+        with path.open('r+b') as file:
+            file.truncate(path.stat().st_size - 24)
+        context, journal = self.reopen(directory)
+        assert journal.effort_log.per_task() == expected
+        journal.close()
+        
+        # A crash lost writes to the journal
+        log = EffortLog(path)
+        log.append([(task1.id, 0, 60)])
+        log.close()
+        context, journal = self.reopen(directory)
+        assert len(journal.effort_log) == 6
+        assert journal.effort_log.per_task() == expected
+        
+        # Compaction after a dispose drops the effort of the disposed task
+        context.root_task.children[1].dispose()
+        journal.compact()
+        assert len(journal.effort_log) == 1
+        assert journal.effort_log.per_task() == {task1.id: 3 * hour}
+        journal.close()
+        
+        # A missing log is rebuilt
+        path.unlink()
+        context, journal = self.reopen(directory)
+        assert journal.effort_log.per_task() == {task1.id: 3 * hour}
+        journal.close()
+        
+    def test_incomplete_change(self, context, directory):
+        journal = Journal(directory)
+        journal.open(context)
+        context.root_task.append_new_task('task1')
+        journal.close()
+        with (directory / 'journal.0').open('a') as file:
+            file.write('["name",1,"ta')  # crashed while writing
+        
+        context, journal = self.reopen(directory)
+        assert [task.name for task in context.root_task.children] == ['task1']
+        context.root_task.children[0].name = 'renamed'
+        journal.close()
+        
+        context, journal = self.reopen(directory)
+        assert [task.name for task in context.root_task.children] == ['renamed']
+        journal.close()
+        
+def test_background_journal(context, qtbot, tmpdir):
+    directory = Path(str(tmpdir))
+    journal = BackgroundJournal(directory, delay=timedelta(milliseconds=10))
+    journal.open(context)
+    task = context.root_task.append_new_task('task')
+    for description in ('d', 'de', 'des'):  # typing
+        task.description = description
+    path = directory / 'journal.0'
+    qtbot.waitUntil(lambda: len(path.read_text().splitlines()) == 2)  # new, description
+    journal.close()
+    
+    context = new_context()
+    journal = Journal(directory)
+    journal.open(context)
+    assert context.root_task.children[0].description == 'des'
+    journal.close()
@@ -27,9 +27,11 @@ Test garage_pm.domain
 
 import pytest
 from chicken_turtle_util.exceptions import InvalidOperationError
-from garage_pm.domain import Interval, EstimateType, PlanningState
-from datetime import datetime, timedelta
+from garage_pm.domain import Interval, EstimateType, PlanningState, Sandbox, TaskTreeBuilder, Signal, simulate
+from garage_pm.controllers import start_minute_clock
+from datetime import datetime, timedelta, date, time
 from itertools import product
+from concurrent.futures import ThreadPoolExecutor
 
 @pytest.fixture
 def interval1(now):
@@ -81,6 +83,20 @@ def task2(root_task):
 def dep_graph(context):
     return context.task_dependency_graph
     
+@pytest.fixture
+def hour():
+    return timedelta(hours=1)
+
+@pytest.fixture
+def estimated(context, task11, task2, now, hour):
+    '''
+    Project starting now with task11 estimated at 2h and task2 at 3h
+    '''
+    context.scheduler.project_start = now()
+    for estimate_type in EstimateType:
+        task11.effort_estimates[estimate_type] = 2 * hour
+        task2.effort_estimates[estimate_type] = 3 * hour
+    
 # Note: time granularity is minutes, overall. E.g. intervals anything less than
 # minutes in their start and end. E.g. Interval(now, now+ 1 second) would raise
 # as it interprets it as Interval(now, now) and it can't be empty.
@@ -209,6 +225,31 @@ class TestEffort(object):
         task2.effort_estimates[EstimateType.pessimistic] = timedelta(minutes=18)
         assert task2.predicted_effort == timedelta(days=1, hours=8, minutes=3)
         
+    def test_calibrated_predicted(self, root_task, task2, now):
+        '''
+        Once enough tasks have finished, predicted_effort corrects for the
+        discrepancy between estimates and actual effort
+        '''
+        minute = timedelta(minutes=1)
+        for estimate_type in EstimateType:
+            task2.effort_estimates[estimate_type] = 60 * minute
+        
+        # Finish tasks which took twice as long as estimated
+        end = now()
+        for i, estimate in enumerate((10, 20, 40)):
+            assert task2.predicted_effort == 60 * minute  # not calibrated yet
+            task = root_task.append_new_task()
+            for estimate_type in EstimateType:
+                task.effort_estimates[estimate_type] = estimate * minute
+            task.insert_effort_spent(0, Interval(end - 2 * estimate * minute, end))
+            end -= 2 * estimate * minute
+            task.planning_state = PlanningState.finished
+        assert task2.predicted_effort == 120 * minute
+        
+        # Reopening a task makes it no longer count
+        task.planning_state = PlanningState.planned
+        assert task2.predicted_effort == 60 * minute
+        
     def test_actual_effort(self, task2, interval1):
         '''
         Test simple case for actual effort
@@ -294,6 +335,39 @@ class TestEffort(object):
             task2.insert_effort_spent(0, Interval(now(), future))
         assert 'Effort spent may not lie in the future: ' in str(ex.value)
         
+    def test_update_effort_spent(self, context, task2, task11, now):
+        minute = timedelta(minutes=1)
+        interval1 = Interval(now() - 10 * minute, now() - 8 * minute)
+        interval2 = Interval(now() - 5 * minute, now() - 4 * minute)
+        task2.insert_effort_spent(0, interval1)
+        task11.insert_effort_spent(0, interval2)
+        
+        # Can grow and shrink an interval, totals follow
+        interval1_ = Interval(interval1.begin, interval2.begin)
+        task2.update_effort_spent(interval1, interval1_)
+        assert task2.effort_spent == (interval1_,)
+        assert task2.actual_effort == 5 * minute
+        assert context.effort_index.total() == 6 * minute
+        
+        # May not overlap other intervals
+        with pytest.raises(ValueError) as ex:
+            task2.update_effort_spent(interval1_, Interval(interval1.begin, interval2.end))
+        assert 'Effort intervals may not overlap: ' in str(ex.value)
+        
+        # May not lie in the future
+        with pytest.raises(ValueError) as ex:
+            task2.update_effort_spent(interval1_, Interval(interval1.begin, now() + minute))
+        assert 'Effort spent may not lie in the future: ' in str(ex.value)
+        
+        # Can only replace effort spent on the task itself
+        with pytest.raises(ValueError) as ex:
+            task2.update_effort_spent(interval2, interval1)
+        assert 'Interval is not part of the effort spent on the task: ' in str(ex.value)
+        
+        # The old interval no longer blocks other tasks
+        task2.update_effort_spent(interval1_, interval1)
+        task11.insert_effort_spent(0, Interval(interval1.end, interval2.begin))
+        
 class TestDelegated(object):
     
     def test_leaf(self, task2, task11, interval1):
@@ -808,10 +882,226 @@ class TestDependencies(object):
                 assert task111.validate_set_planning_state(planning_state) is None
                 task111.planning_state = planning_state
             
+def test_archive(context, dep_graph, root_task, task1, task11, task111, task112, task2, interval1):
+    task111.insert_effort_spent(0, interval1)
+    task111.planning_state = PlanningState.finished
+    task112.delegated = True
+    task112.planning_state = PlanningState.cancelled
+    task112.add_dependency(task111)
+    
+    # Only finished branches without dependencies crossing their subtree
+    assert 'Cannot archive the root task' in str(root_task.validate_archive())
+    assert 'Cannot archive a leaf task' in str(task111.validate_archive())
+    task113 = task112.append_new_task('task113')
+    with pytest.raises(InvalidOperationError) as ex:
+        task1.archive()
+    assert 'Cannot archive a task with unfinished descendants' in str(ex.value)
+    task113.dispose()
+    task2.add_dependency(task112)
+    assert 'have dependencies outside of it' in str(task1.validate_archive())
+    task2.remove_dependency(task112)
+    
+    # Collapses the subtree to the task, keeping its dependers and effort
+    task2.add_dependency(task1)
+    nodes = dep_graph.number_of_nodes()
+    task1.archive()
+    assert task1.is_archived
+    assert task1.planning_state == PlanningState.finished
+    assert dep_graph.number_of_nodes() == nodes - 6
+    assert list(task2.dependencies) == [task1]
+    assert context.effort_index.total(task=task1) == interval1.duration
+    assert context.effort_index.total() == interval1.duration
+    
+    # Loads the subtree when needed
+    with pytest.raises(ValueError):
+        task2.insert_effort_spent(0, interval1)
+    task11, = task1.children
+    task111, task112 = task11.children
+    assert task111.effort_spent == (interval1,)
+    assert list(task112.dependencies) == [task111]
+    assert task112.planning_state == PlanningState.cancelled
+    assert dep_graph.number_of_nodes() == nodes
+    assert context.effort_index.total() == interval1.duration
+    
+class TestUndoStack(object):
+    
+    @pytest.fixture
+    def undo_stack(self, context, root_task):
+        undo_stack = context.undo_stack
+        undo_stack.clear()
+        return undo_stack
+    
+    def test_attributes(self, undo_stack, task1, task2):
+        assert not undo_stack.can_undo
+        with pytest.raises(InvalidOperationError):
+            undo_stack.undo()
+        with pytest.raises(InvalidOperationError):
+            undo_stack.redo()
+            
+        # Typing a name is a single step
+        for name in ('n', 'ne', 'new'):
+            task1.name = name
+        task1.description = 'description'
+        undo_stack.undo()
+        assert task1.description == ''
+        undo_stack.undo()
+        assert task1.name == 'task1'
+        assert not undo_stack.can_undo
+        undo_stack.redo()
+        assert task1.name == 'new'
+        
+        # Unless the changes are further apart
+        undo_stack.coalesce_interval = 0
+        task1.name = 'newer'
+        task1.name = 'newest'
+        undo_stack.undo()
+        assert task1.name == 'newer'
+        assert undo_stack.can_redo
+        
+        # A new edit drops what could be redone
+        task2.delegated = True
+        assert not undo_stack.can_redo
+        
+        # Reverts what a change lost along with it
+        task2.duration = timedelta(hours=1)
+        task2.delegated = False
+        task2.effort_estimates[EstimateType.optimistic] = timedelta(hours=2)
+        task2.delegated = True
+        undo_stack.undo()
+        assert task2.effort_estimates[EstimateType.optimistic] == timedelta(hours=2)
+        undo_stack.undo()
+        undo_stack.undo()
+        assert task2.duration == timedelta(hours=1)
+        
+    def test_project_start(self, context, undo_stack, now):
+        start = context.scheduler.project_start
+        context.scheduler.project_start = datetime(1999, 12, 1, 9)
+        undo_stack.undo()
+        assert context.scheduler.project_start == start
+        undo_stack.redo()
+        assert context.scheduler.project_start == datetime(1999, 12, 1, 9)
+        
+    def test_calendar(self, context, undo_stack):
+        calendar = context.calendar
+        weekly_hours = calendar.weekly_hours
+        calendar.weekly_hours = [((time(9), time(17)),)] * 7
+        calendar.add_holiday(date(2000, 1, 3))
+        calendar.set_exception(date(2000, 1, 4), [])
+        calendar.set_exception(date(2000, 1, 4), [(time(10), time(12))])
+        calendar.remove_exception(date(2000, 1, 4))
+        calendar.remove_holiday(date(2000, 1, 3))
+        for _ in range(6):
+            undo_stack.undo()
+        assert calendar.weekly_hours == weekly_hours
+        assert not calendar.holidays
+        assert not calendar.exceptions
+        for _ in range(4):
+            undo_stack.redo()
+        assert calendar.holidays == {date(2000, 1, 3)}
+        assert calendar.exceptions == {date(2000, 1, 4): ((time(10), time(12)),)}
+        
+    def test_edit(self, context, undo_stack, task1, task2, interval1):
+        '''
+        The changes of an edit are undone as a single step
+        '''
+        sandbox = Sandbox(context)
+        sandbox.move(task2, task1, 0)
+        sandbox.set_effort_estimate(task2, EstimateType.likely, timedelta(hours=1))
+        sandbox.commit()
+        task2.insert_effort_spent(0, interval1)
+        undo_stack.undo()
+        assert task2.effort_spent == ()
+        undo_stack.undo()
+        assert task2.parent is not task1
+        assert task2.effort_estimates[EstimateType.likely] is None
+        undo_stack.redo()
+        assert task2.parent is task1
+        
+    def test_dispose(self, context, dep_graph, undo_stack, root_task, task1, task2, interval1):
+        '''
+        Undoing dispose restores the whole subtree at once
+        '''
+        with TaskTreeBuilder(context) as builder:
+            tasks = [builder.add_task(task1, 'task{}'.format(i)) for i in range(5000)]
+            builder.add_dependency(tasks[0], tasks[1])
+            builder.add_dependency(task2, tasks[2])
+        tasks[1].insert_effort_spent(0, interval1)
+        ids = [task.id for task in task1.children]
+        nodes = dep_graph.number_of_nodes()
+        undo_stack.clear()
+        tasks[3].name = 'renamed'
+        task1.dispose()
+        
+        changes = []
+        context.changes.events.changed.connect(changes.append)
+        undo_stack.undo()
+        assert [change.kind for change in changes] == ['restore']
+        task1 = root_task.children[0]
+        assert [task.id for task in task1.children] == ids
+        task_0 = context.changes._task(tasks[0].id)
+        assert [task.id for task in task_0.dependencies] == [tasks[1].id]
+        assert context.changes._task(tasks[1].id).effort_spent == (interval1,)
+        assert [task.id for task in task2.dependencies] == [tasks[2].id]
+        assert dep_graph.number_of_nodes() == nodes
+        assert context.effort_index.total() == interval1.duration
+        
+        # Steps before it apply to the restored tasks
+        undo_stack.undo()
+        assert context.changes._task(tasks[3].id).name == 'task3'
+        undo_stack.redo()
+        undo_stack.redo()
+        assert root_task.children == (task2,)
+        
+    def test_max_size(self, undo_stack, root_task, task1):
+        task1.append_new_task('task')
+        undo_stack.max_size = 3
+        undo_stack.coalesce_interval = 0
+        for i in range(3):
+            task1.name = str(i)
+        for i in range(3):
+            undo_stack.undo()
+        assert not undo_stack.can_undo
+        assert task1.name == 'task1'
+        
+        # Disposing counts the tasks it can restore
+        undo_stack.clear()
+        undo_stack.max_size = 2
+        task1.dispose()
+        assert not undo_stack.can_undo
+        
+def test_signal(mocker):
+    class Events(object):
+        changed = Signal(object)
+    events = Events()
+    other = Events()
+    slot1 = mocker.Mock()
+    slot2 = mocker.Mock()
+    
+    # Slots are called in the order they were connected, once
+    events.changed.connect(slot1)
+    events.changed.connect(slot2)
+    events.changed.connect(slot1)
+    events.changed.emit(1)
+    slot1.assert_called_once_with(1)
+    slot2.assert_called_once_with(1)
+    
+    # Each instance has its own connections
+    other.changed.emit(2)
+    assert slot1.call_count == 1
+    
+    # When disconnected, not called
+    events.changed.disconnect(slot1)
+    events.changed.emit(3)
+    assert slot1.call_count == 1
+    slot2.assert_called_with(3)
+    with pytest.raises(TypeError):
+        events.changed.disconnect(slot1)
+    
 def test_minute_timer(context, qtbot):
+    clock = start_minute_clock(context.minute_timer)
     minute = datetime.now().minute
     for i in range(2):
-        with qtbot.waitSignal(context.minute_timer.timeout, timeout=60000, raising=True) as blocker:
+        with qtbot.waitSignal(clock.timeout, timeout=60000, raising=True) as blocker:
             blocker.wait()
         now = datetime.now()
         assert now.second == 0
@@ -980,10 +1270,21 @@ class TestTimeTracker(object):
             task2.move(task11, 0)
         assert 'Cannot move time tracked task' in str(ex.value)
         
-    def test_dispose_if_tracked(self, time_tracker, task2, task11):
+    def test_dispose_if_tracked(self, context, time_tracker, task1, task11, task2, now):
         time_tracker.start(task2)
+        now.tick(timedelta(hours=1))
         task2.dispose()
         assert time_tracker.current_task is None  # tracking has stopped
+        assert context.effort_index.total() == timedelta()  # without adding effort
+        with pytest.raises(InvalidOperationError):
+            time_tracker.stop()
+            
+        # Likewise when disposing an ancestor of the tracked task
+        time_tracker.start(task11)
+        now.tick(timedelta(hours=1))
+        task1.dispose()
+        assert time_tracker.current_task is None
+        assert context.effort_index.total() == timedelta()
         
     def test_other_interval_may_not_overlap_current_time_tracking_interval(self, time_tracker, task2, now):
         time_tracker.start(task2)
@@ -1003,6 +1304,349 @@ class TestTimeTracker(object):
         time_tracker.stop()
         assert set(task2.effort_spent) == {past_interval, Interval(past_interval.end, now())}
         
+class TestSchedule(object):
+    
+    def test_planned(self, root_task, task1, task11, task2, now, hour, estimated):
+        # Independent tasks are scheduled in parallel
+        assert task2.planned_start == now()
+        assert task2.planned_end == now() + 3 * hour
+        assert task1.planned_end == now() + 2 * hour
+        assert root_task.planned_end == now() + 3 * hour
+        
+        # Dependencies are scheduled before their dependers
+        task2.add_dependency(task1)
+        assert task2.planned_start == task1.planned_end == now() + 2 * hour
+        assert root_task.planned_end == now() + 5 * hour
+        
+        # Planned start can be overridden to a later time
+        task11.planned_start_override = now() + hour
+        assert task2.planned_end == now() + 6 * hour
+        
+        # Inactive tasks take no time
+        task11.planning_state = PlanningState.cancelled
+        assert task2.planned_end == now() + 3 * hour
+        
+    def test_predicted(self, task11, task2, now, hour, estimated):
+        # Without effort spent, the prediction matches the plan
+        assert task2.predicted_start == now()
+        assert task2.predicted_end == now() + 3 * hour
+        
+        # Only the remaining effort is scheduled
+        task2.insert_effort_spent(0, Interval(now() - hour, now()))
+        assert task2.predicted_end == now() + 2 * hour
+        
+        # Finished tasks keep the times of the effort spent on them
+        task2.planning_state = PlanningState.finished
+        assert task2.predicted_start == now() - hour
+        assert task2.predicted_end == now()
+        
+    def test_changed_events(self, task1, task2, hour, estimated, mocker):
+        planned_start_changed = mocker.Mock()
+        planned_end_changed = mocker.Mock()
+        task2.events.planned_start_changed.connect(planned_start_changed)
+        task2.events.planned_end_changed.connect(planned_end_changed)
+        
+        task2.add_dependency(task1)
+        planned_start_changed.assert_called_once_with(task2)
+        planned_end_changed.assert_called_once_with(task2)
+        planned_start_changed.reset_mock()
+        planned_end_changed.reset_mock()
+        
+        task2.effort_estimates[EstimateType.likely] = hour
+        planned_start_changed.assert_not_called()
+        planned_end_changed.assert_called_once_with(task2)
+        
+    def test_working_hours(self, context, task1, task2, now, hour, estimated):
+        '''
+        Effort is only worked during working hours
+        '''
+        # now() is Saturday 2000-1-1 00:00
+        context.calendar.weekly_hours = (((time(9), time(12)), (time(13), time(17))),) * 5 + ((), ())
+        assert task2.planned_start == now()
+        assert task2.planned_end == datetime(2000, 1, 3, 12)
+        
+        task2.add_dependency(task1)
+        assert task2.planned_start == datetime(2000, 1, 3, 11)
+        assert task2.planned_end == datetime(2000, 1, 3, 15)
+        
+        context.calendar.add_holiday(date(2000, 1, 3))
+        assert task2.planned_end == datetime(2000, 1, 4, 15)
+        
+        context.calendar.set_exception(date(2000, 1, 1), [(time(10), time(14))])
+        assert task1.planned_end == datetime(2000, 1, 1, 12)
+        assert task2.planned_end == datetime(2000, 1, 4, 10)
+        
+    def test_slack(self, context, task1, task11, task2, hour, estimated):
+        assert task11.slack == (hour, timedelta())  # its parent ends when it ends
+        assert task1.slack == (hour, hour)
+        assert task2.slack == (timedelta(), timedelta())
+        assert context.critical_path() == [task2]
+        
+        task2.add_dependency(task1)
+        assert task11.slack == task1.slack == task2.slack == (timedelta(), timedelta())
+        assert context.critical_path() == [task11, task2]
+        
+        task2.remove_dependency(task1)
+        for estimate_type in EstimateType:
+            task2.effort_estimates[estimate_type] = hour
+        assert task11.slack == (timedelta(), timedelta())
+        assert task2.slack == (hour, hour)
+        assert context.critical_path() == [task11]
+        
+class TestWorkingCalendar(object):
+    
+    def test_add(self, context):
+        calendar = context.calendar
+        hour = timedelta(hours=1)
+        monday = datetime(2000, 1, 3)
+        
+        # By default, all time is working time
+        assert calendar.add(monday, 30 * hour) == monday + 30 * hour
+        assert calendar.working_time(monday, monday + 30 * hour) == 30 * hour
+        
+        # Weekly hours
+        calendar.weekly_hours = (((time(9), time(17)),),) * 5 + ((), ())
+        assert calendar.add(monday, hour) == monday + 10 * hour
+        assert calendar.add(monday + 16 * hour, hour) == monday + 17 * hour  # ends at the end of the day
+        assert calendar.add(monday + 4 * 24 * hour + 16 * hour, 2 * hour) == monday + 7 * 24 * hour + 10 * hour  # skips the weekend
+        assert calendar.working_time(monday, monday + 7 * 24 * hour) == 40 * hour
+        assert calendar.working_time(monday - 5000 * 24 * hour, monday) == 5000 // 7 * 40 * hour  # far away from now
+        
+        with pytest.raises(ValueError):
+            calendar.weekly_hours = ((),) * 7
+        with pytest.raises(ValueError):
+            calendar.weekly_hours = (((time(9), time(13)), (time(12), time(17))),) * 7
+        
+class TestSimulation(object):
+    
+    def test_percentiles(self, context, root_task, task1, task11, task2, now):
+        hour = timedelta(hours=1)
+        for estimate_type in EstimateType:
+            task11.effort_estimates[estimate_type] = 2 * hour  # no uncertainty
+        task2.effort_estimates[EstimateType.optimistic] = hour
+        task2.effort_estimates[EstimateType.likely] = 2 * hour
+        task2.effort_estimates[EstimateType.pessimistic] = 6 * hour
+        task2.add_dependency(task1)
+        
+        result = simulate(context, trials=1000, seed=0)
+        assert result.percentiles == (50, 80, 95)
+        assert result.end(task11) == {percentile: now() + 2 * hour for percentile in result.percentiles}
+        assert result.end(task1) == result.end(task11)
+        
+        ends = result.end(task2)
+        assert now() + 3 * hour <= ends[50] <= ends[80] <= ends[95] <= now() + 8 * hour
+        assert result.end(root_task) == ends
+        
+    def test_executor(self, context, task2, now):
+        '''
+        When given an executor, split trials across its workers and merge the results
+        '''
+        hour = timedelta(hours=1)
+        for estimate_type in EstimateType:
+            task2.effort_estimates[estimate_type] = hour
+        with ThreadPoolExecutor(2) as executor:
+            result = simulate(context, trials=101, seed=0, executor=executor)
+        assert result.end(task2) == {percentile: now() + hour for percentile in result.percentiles}
+        
+class TestSandbox(object):
+    
+    def test_what_if(self, context, task1, task11, task2, now, hour, estimated):
+        sandbox = Sandbox(context)
+        sandbox.add_dependency(task2, task1)
+        sandbox.set_effort_estimate(task11, EstimateType.likely, 5 * hour)
+        assert sandbox.predicted_effort(task11) == 4 * hour
+        assert sandbox.planned_end(task2) == now() + 7 * hour
+        assert sandbox.critical_path() == [task11, task2]
+        
+        # The context is left untouched
+        assert not context.task_dependency_graph.has_edge(task2.start_node, task1.end_node)
+        assert task11.effort_estimates[EstimateType.likely] == 2 * hour
+        assert task2.planned_end == now() + 3 * hour
+        
+        sandbox.commit()
+        assert task2.planned_end == now() + 7 * hour
+        with pytest.raises(InvalidOperationError):
+            sandbox.remove_dependency(task2, task1)
+            
+    def test_move(self, root_task, context, task1, task11, task2, now, hour, estimated):
+        sandbox = Sandbox(context)
+        sandbox.move(task11, task2, 0)
+        assert sandbox.parent(task11) == task2
+        assert sandbox.children(root_task) == (task1, task2)
+        assert sandbox.is_leaf(task1)
+        assert not sandbox.is_leaf(task2)
+        assert sandbox.planned_end(task1) == now()  # new effort task without estimates
+        assert sandbox.planned_end(task2) == now() + 2 * hour
+        with pytest.raises(ValueError):
+            sandbox.move(task2, task11, 0)
+        assert task11.parent == task1
+        
+        sandbox.commit()
+        assert task11.parent == task2
+        assert task1.is_leaf
+        assert task2.planned_end == now() + 2 * hour
+        
+    def test_commit_rollback(self, context, task1, task11, task2, hour, estimated):
+        '''
+        When an edit fails on commit, the applied edits are undone
+        '''
+        sandbox = Sandbox(context)
+        sandbox.set_effort_estimate(task2, EstimateType.likely, hour)
+        sandbox.add_dependency(task2, task1)
+        task11.add_dependency(task2)
+        with pytest.raises(ValueError):
+            sandbox.commit()
+        assert task2.effort_estimates[EstimateType.likely] == 3 * hour
+        
+class TestRecomputation(object):
+    
+    def test_once_per_edit(self, context, root_task, task1, task11, task2, interval1, mocker):
+        '''
+        Derived attributes are recomputed and signalled once per edit
+        '''
+        task11.insert_effort_spent(0, interval1)
+        task2.insert_effort_spent(0, Interval(interval1.begin - timedelta(hours=1), interval1.begin))
+        update_planning_state = mocker.spy(root_task._state.__class__, '_update_planning_state')
+        update_schedule = mocker.spy(context.scheduler, '_update')
+        planning_state_changed = mocker.Mock(side_effect=lambda task: assert_finished())
+        root_task.events.planning_state_changed.connect(planning_state_changed)
+        def assert_finished():
+            # Signals are emitted after all has been recomputed
+            assert task1.planning_state == PlanningState.finished
+            assert root_task.planning_state == PlanningState.finished
+        
+        with context.recomputation.edit():
+            task11.planning_state = PlanningState.finished
+            task2.planning_state = PlanningState.finished
+            planning_state_changed.assert_not_called()
+        assert update_planning_state.call_count == 2  # task1, root_task
+        assert update_schedule.call_count == 1
+        planning_state_changed.assert_called_once_with(root_task)
+        
+    def test_dispose(self, context, task1, task11, mocker):
+        '''
+        Disposed tasks are not recomputed or signalled at the end of the edit
+        '''
+        set_predicted_effort = mocker.spy(task11._state.__class__, '_set_predicted_effort')
+        name_changed = mocker.Mock()
+        task11.events.name_changed.connect(name_changed)
+        with context.recomputation.edit():
+            for estimate_type in EstimateType:
+                task11.effort_estimates[estimate_type] = timedelta(hours=1)
+            context.recomputation.emit(task11, 'name_changed')
+            task1.dispose()
+        set_predicted_effort.assert_not_called()
+        name_changed.assert_not_called()
+        
+class TestReadyTasks(object):
+    
+    def test_ready(self, context, root_task, task1, task11, task2, interval1):
+        ready_tasks = context.ready_tasks
+        assert set(ready_tasks) == {task11, task2}
+        
+        task2.add_dependency(task1)
+        assert set(ready_tasks) == {task11}
+        
+        task11.insert_effort_spent(0, interval1)
+        task11.planning_state = PlanningState.finished
+        assert set(ready_tasks) == {task2}
+        
+        task3 = task2.append_new_task()
+        assert set(ready_tasks) == {task2, task3}
+        
+        task3.move(task2, 0)
+        assert set(ready_tasks) == {task3}  # task2 became a branch
+        
+        task3.dispose()
+        assert set(ready_tasks) == {task2}
+        
+    def test_top(self, context, task11, task2, now):
+        hour = timedelta(hours=1)
+        context.scheduler.project_start = now()
+        for estimate_type in EstimateType:
+            task11.effort_estimates[estimate_type] = 2 * hour
+            task2.effort_estimates[estimate_type] = 3 * hour
+        assert context.ready_tasks.top(2) == [task2, task11]  # least slack first
+        assert context.ready_tasks.top(1) == [task2]
+        
+        for estimate_type in EstimateType:
+            task2.effort_estimates[estimate_type] = hour
+        assert context.ready_tasks.top(3) == [task11, task2]
+        
+    def test_reorder(self, context, task11, task2, now, hour, estimated):
+        '''
+        Reordering pushes new heap entries, outdated ones are dropped lazily
+        '''
+        ready_tasks = context.ready_tasks
+        for i in range(100):
+            effort = hour if i % 2 else 4 * hour
+            for estimate_type in EstimateType:
+                task2.effort_estimates[estimate_type] = effort
+            assert ready_tasks.top(2) == ([task11, task2] if i % 2 else [task2, task11])
+            assert len(ready_tasks._heap) <= 2 * 2 + 64
+        
+class TestEffortIndex(object):
+    
+    def test_totals(self, context, root_task, task1, task111, task2, now):
+        '''
+        Range totals, overall and per subtree, follow inserts, moves and disposal
+        '''
+        index = context.effort_index
+        task111.insert_effort_spent(0, Interval(datetime(1999, 12, 30, 23, 59), datetime(1999, 12, 31, 0, 2)))  # spans midnight
+        task2.insert_effort_spent(0, Interval(datetime(1999, 12, 31, 23, 50), now()))
+        
+        assert index.total() == timedelta(minutes=13)
+        assert index.total(task=task1) == timedelta(minutes=3)
+        assert index.total(date(1999, 12, 31), date(2000, 1, 1)) == timedelta(minutes=12)
+        assert index.total(date(1999, 12, 31), date(2000, 1, 1), task=task1) == timedelta(minutes=2)
+        assert list(index.per_day(date(1999, 12, 30), date(2000, 1, 1))) == [
+            (date(1999, 12, 30), timedelta(minutes=1)),
+            (date(1999, 12, 31), timedelta(minutes=12)),
+        ]
+        
+        # When moving a task, its effort moves along to its new ancestors
+        task111.move(root_task, 0)
+        assert index.total(task=task1) == timedelta()
+        assert index.total() == timedelta(minutes=13)
+        
+        # When disposing a task, its effort is removed
+        task2.dispose()
+        assert index.total() == timedelta(minutes=3)
+        
+    def test_archived_overlap(self, context, root_task, task2, now):
+        '''
+        Only archived tasks whose span overlaps an inserted interval are loaded
+        '''
+        def interval(day, hour):
+            begin = datetime(1999, 12, day, hour)
+            return Interval(begin, begin + timedelta(hours=1))
+        def archived(name, *intervals):
+            branch = root_task.append_new_task(name)
+            leaf = root_task.append_new_task(name + '1')
+            leaf.move(branch, 0)
+            for interval_ in intervals:
+                leaf.insert_effort_spent(0, interval_)
+            leaf.planning_state = PlanningState.finished
+            branch.archive()
+            return branch
+        early = archived('early', interval(1, 10))
+        late = archived('late', interval(20, 10))
+        long_ = archived('long', interval(2, 10), interval(25, 10))  # spans late
+        
+        task2.insert_effort_spent(0, interval(10, 10))
+        assert early.is_archived and late.is_archived
+        assert not long_.is_archived
+        
+        with pytest.raises(ValueError):
+            task2.insert_effort_spent(0, interval(20, 10))
+        assert early.is_archived
+        assert not late.is_archived
+        
+        # Disposed archived tasks are no longer checked
+        early.dispose()
+        task2.insert_effort_spent(0, interval(1, 10))
+        assert context.effort_index.total() == 5 * timedelta(hours=1)
+        
 # TODO
 
 # freezegun doesn't work on pyqt. Must use qtbot.wait(ms), https://pytest-qt.readthedocs.io/en/1.11.0/reference.html
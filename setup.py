@@ -51,7 +51,7 @@ setup(
                                       'freezegun',
                                       'pytest-qt',
                                       'pytest-capturelog']},
-    'install_requires': ['chicken-turtle-util', 'click', 'pyxdg', 'more-itertools', 'networkx'],
+    'install_requires': ['chicken-turtle-util', 'click', 'pyxdg', 'more-itertools', 'networkx', 'numpy>=1.17'],
     'keywords': 'office project-management',
     'license': 'LGPL3',
     'long_description': 'A basic cross-platform project management tool with a focus on one-man\n'